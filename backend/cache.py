@@ -0,0 +1,167 @@
+# In-process TTL caches used in front of Supabase lookups
+
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Hashable, Optional, Set, Tuple
+
+# Returned by TTLCache.get when a key is absent or expired
+MISSING = object()
+
+
+class TTLCache:
+    """Bounded LRU cache whose entries expire after a time-to-live"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, Tuple[Any, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = MISSING) -> Any:
+        """Return the cached value for key, or default if absent or expired"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, deadline = entry
+                if deadline > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self._remove(key)
+            self.misses += 1
+            return default
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """Store value under key, evicting the least recently used entry when full"""
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._stored(key, value)
+            while len(self._data) > self.maxsize:
+                self._remove(next(iter(self._data)))
+
+    def delete(self, key: Hashable):
+        """Drop key from the cache if present"""
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._data):
+                self._remove(key)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._data),
+            "max_size": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    # Hooks for subclasses that keep secondary indexes; called with the lock held
+    def _stored(self, key: Hashable, value: Any):
+        pass
+
+    def _removed(self, key: Hashable, value: Any):
+        pass
+
+    def _remove(self, key: Hashable):
+        value, _ = self._data.pop(key)
+        self._removed(key, value)
+
+
+class SessionTokenCache(TTLCache):
+    """
+    Cache of session token digest (tokens.hash_token) -> (account_id, expires_at).
+    A value of None is a negative entry for a token that is not a live session.
+    Keeps an account_id -> tokens index so all sessions of an account can be dropped at once.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, negative_ttl: float):
+        super().__init__(maxsize, ttl)
+        self.negative_ttl = negative_ttl
+        self.negative_hits = 0
+        self._by_account: Dict[int, Set[str]] = {}
+
+    def lookup(self, token: str) -> Any:
+        """Return (account_id, expires_at), None for a known-bad token, or MISSING"""
+        entry = self.get(token)
+        if entry is None:
+            self.negative_hits += 1
+        elif entry is not MISSING and entry[1] <= datetime.now():
+            # Session expired while cached
+            self.delete(token)
+            return MISSING
+        return entry
+
+    def store(self, token: str, account_id: int, expires_at: datetime):
+        remaining = (expires_at - datetime.now()).total_seconds()
+        self.set(token, (account_id, expires_at), ttl=remaining)
+
+    def store_negative(self, token: str):
+        self.set(token, None, ttl=self.negative_ttl)
+
+    def invalidate_account(self, account_id: int):
+        """Drop every cached token belonging to account_id"""
+        with self._lock:
+            for token in list(self._by_account.get(account_id, ())):
+                if token in self._data:
+                    self._remove(token)
+            self._by_account.pop(account_id, None)
+
+    def stats(self) -> Dict[str, int]:
+        stats = super().stats()
+        stats["negative_hits"] = self.negative_hits
+        return stats
+
+    def _stored(self, key, value):
+        if value is not None:
+            self._by_account.setdefault(value[0], set()).add(key)
+
+    def _removed(self, key, value):
+        if value is not None:
+            tokens = self._by_account.get(value[0])
+            if tokens is not None:
+                tokens.discard(key)
+                if not tokens:
+                    del self._by_account[value[0]]
+
+
+class AccountProfileCache(TTLCache):
+    """
+    Cache of account_id -> (public profile columns, ETag) (read-through, see profiles.py).
+    Invalidations are remembered for fill_window seconds so a read that started
+    before an update or delete cannot put the old profile back when it finishes.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, fill_window: float):
+        super().__init__(maxsize, ttl)
+        self._invalidated = TTLCache(maxsize, fill_window)
+
+    def fill(self, account_id: int, profile: Any, started: float):
+        """Cache a profile read from the database; started is time.monotonic() before the read"""
+        invalidated = self._invalidated.get(account_id, None)
+        if invalidated is not None and invalidated >= started:
+            return
+        self.set(account_id, profile)
+
+    def replace(self, account_id: int, profile: Any):
+        """Write-through: cache a profile just written to the database"""
+        self._invalidated.set(account_id, time.monotonic())
+        self.set(account_id, profile)
+
+    def invalidate(self, account_id: int):
+        self._invalidated.set(account_id, time.monotonic())
+        self.delete(account_id)
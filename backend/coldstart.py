@@ -0,0 +1,59 @@
+# Cold start timing: how long from process start until the API can serve
+#
+# main.py imports this module before anything else and marks the end of each
+# startup phase; the startup log line and /health report the result:
+#   before_import_ms  process start -> main begins importing (interpreter, uvicorn)
+#   import_ms         main's own imports (python -m devtools.importprofile breaks them down)
+#   server_ms         main imported -> lifespan startup runs (uvicorn binding and setup)
+#   <step>_ms         each startup step
+#   cold_start_ms     process start -> ready to serve
+# Process start is read from /proc; where that is unavailable before_import_ms
+# is left out and cold_start_ms counts from the start of main's imports.
+
+import os
+import time
+from typing import Any, Dict, Optional
+
+
+def process_age() -> Optional[float]:
+    """Seconds since this process started (Linux /proc), None where unavailable"""
+    try:
+        with open("/proc/self/stat") as f:
+            # Field 22, starttime in clock ticks after boot; the command name (field 2) may contain spaces
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return max(0.0, uptime - start_ticks / os.sysconf("SC_CLK_TCK"))
+    except (OSError, ValueError, IndexError):
+        return None
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000, 1)
+
+
+class StartupTimer:
+    """Durations of consecutive startup phases, each measured from the previous mark"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.before_import = process_age()
+        self.phases: Dict[str, float] = {}
+        self._last = self.started
+
+    def mark(self, phase: str):
+        now = time.perf_counter()
+        self.phases[phase] = now - self._last
+        self._last = now
+
+    def summary(self) -> Dict[str, Any]:
+        result: Dict[str, Any] = {}
+        total = self._last - self.started
+        if self.before_import is not None:
+            result["before_import_ms"] = _ms(self.before_import)
+            total += self.before_import
+        result.update({f"{phase}_ms": _ms(seconds) for phase, seconds in self.phases.items()})
+        result["cold_start_ms"] = _ms(total)
+        return result
+
+
+startup_timer = StartupTimer()
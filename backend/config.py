@@ -30,4 +30,158 @@ API_TITLE = "Luca App API"
 API_VERSION = "2.0.0"
 
 # Security Constants
-TOKEN_EXPIRY_DAYS = 30
\ No newline at end of file
+TOKEN_EXPIRY_DAYS = 30
+
+# Concurrent sessions kept per account; logging in beyond this evicts the oldest (0 = no cap)
+MAX_SESSIONS_PER_ACCOUNT = int(os.environ.get('MAX_SESSIONS_PER_ACCOUNT', 10))
+
+# Session token cache (in front of the sessions table lookup in validate_token)
+# Each worker process has its own cache, so a session deleted by another worker
+# stays usable here for at most TOKEN_CACHE_TTL_SECONDS.
+TOKEN_CACHE_TTL_SECONDS = int(os.environ.get('TOKEN_CACHE_TTL_SECONDS', 60))
+TOKEN_CACHE_MAX_SIZE = int(os.environ.get('TOKEN_CACHE_MAX_SIZE', 10000))
+TOKEN_CACHE_NEGATIVE_TTL_SECONDS = int(os.environ.get('TOKEN_CACHE_NEGATIVE_TTL_SECONDS', 5))
+
+# Account profile cache (in front of the userAccount lookup for /accounts/me)
+# Per worker process, like the token cache: another worker's update shows up here
+# after at most ACCOUNT_CACHE_TTL_SECONDS.
+ACCOUNT_CACHE_TTL_SECONDS = int(os.environ.get('ACCOUNT_CACHE_TTL_SECONDS', 30))
+ACCOUNT_CACHE_MAX_SIZE = int(os.environ.get('ACCOUNT_CACHE_MAX_SIZE', 10000))
+
+# Password hashing pool (bcrypt runs here instead of on the event loop)
+# HASH_POOL_KIND is "thread" (bcrypt releases the GIL) or "process"
+HASH_POOL_KIND = os.environ.get('HASH_POOL_KIND', 'thread')
+HASH_POOL_WORKERS = int(os.environ.get('HASH_POOL_WORKERS', os.cpu_count() or 1))
+HASH_POOL_MAX_QUEUE = int(os.environ.get('HASH_POOL_MAX_QUEUE', 64))
+
+# Password hashing (see passwords.py)
+# PASSWORD_HASH_ALGORITHM is "bcrypt", "scrypt" or "argon2id" (needs the argon2-cffi package).
+# PASSWORD_HASH_COST is the time cost: bcrypt rounds, scrypt log2(N) or argon2 iterations.
+# "auto" calibrates it at startup so one hash takes about PASSWORD_HASH_TARGET_MS here;
+# set it explicitly when several machines share the database so they agree on the target.
+# Logins with a hash made by another algorithm or a lower cost are rehashed with these settings.
+PASSWORD_HASH_ALGORITHM = os.environ.get('PASSWORD_HASH_ALGORITHM', 'bcrypt')
+PASSWORD_HASH_COST = os.environ.get('PASSWORD_HASH_COST', 'auto')
+PASSWORD_HASH_TARGET_MS = float(os.environ.get('PASSWORD_HASH_TARGET_MS', 250))
+SCRYPT_BLOCK_SIZE = int(os.environ.get('SCRYPT_BLOCK_SIZE', 8))  # memory is 128 * r * N bytes
+SCRYPT_PARALLELISM = int(os.environ.get('SCRYPT_PARALLELISM', 1))
+ARGON2_MEMORY_KIB = int(os.environ.get('ARGON2_MEMORY_KIB', 65536))
+ARGON2_PARALLELISM = int(os.environ.get('ARGON2_PARALLELISM', 1))
+
+# Background rewrite of hex-encoded password hashes in the native format (hashmigration.py)
+PASSWORD_HASH_MIGRATION_ENABLED = os.environ.get('PASSWORD_HASH_MIGRATION_ENABLED', 'true').lower() == 'true'
+PASSWORD_HASH_MIGRATION_BATCH_SIZE = int(os.environ.get('PASSWORD_HASH_MIGRATION_BATCH_SIZE', 500))
+
+# Background hashing of raw session/reset tokens from before token_hash (tokenmigration.py).
+# Token lookups that miss by digest retry by raw token only in tables that had raw-token
+# rows when the worker started, and only until the migration has converted them.
+TOKEN_HASH_MIGRATION_ENABLED = os.environ.get('TOKEN_HASH_MIGRATION_ENABLED', 'true').lower() == 'true'
+TOKEN_HASH_MIGRATION_BATCH_SIZE = int(os.environ.get('TOKEN_HASH_MIGRATION_BATCH_SIZE', 500))
+
+# Database connection pool (async PostgREST client shared by all requests)
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 20))
+DB_TIMEOUT_SECONDS = float(os.environ.get('DB_TIMEOUT_SECONDS', 10))
+DB_CONNECT_TIMEOUT_SECONDS = float(os.environ.get('DB_CONNECT_TIMEOUT_SECONDS', 5))
+DB_POOL_TIMEOUT_SECONDS = float(os.environ.get('DB_POOL_TIMEOUT_SECONDS', 5))
+
+# Token mode: "opaque" (every request looks the token up in sessions) or "signed"
+# (login issues a short-lived HMAC-signed access token plus an opaque refresh token
+# stored in sessions; access tokens are verified without touching the database)
+TOKEN_MODE = os.environ.get('TOKEN_MODE', 'opaque')
+TOKEN_SIGNING_SECRET = os.environ.get('TOKEN_SIGNING_SECRET')
+ACCESS_TOKEN_TTL_SECONDS = int(os.environ.get('ACCESS_TOKEN_TTL_SECONDS', 900))
+
+if TOKEN_MODE == 'signed' and not TOKEN_SIGNING_SECRET:
+    raise RuntimeError("TOKEN_SIGNING_SECRET must be set when TOKEN_MODE=signed")
+
+# Login rate limiting
+# RATE_LIMIT_BACKEND: "memory" (per process), "sqlite" (shared by workers on one host)
+# or "redis" (shared across hosts; any Redis-protocol server)
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', 100000))
+RATE_LIMIT_SQLITE_PATH = os.environ.get('RATE_LIMIT_SQLITE_PATH', '/tmp/luca_ratelimit.sqlite3')
+RATE_LIMIT_REDIS_URL = os.environ.get('RATE_LIMIT_REDIS_URL', 'redis://localhost:6379/0')
+# MAX_LOGIN_ATTEMPTS_PER_IP: failed logins per client address before lockout, 0 = off.
+# Off by default: behind a proxy that is not listed in FORWARDED_ALLOW_IPS every
+# client has the proxy's address, so one counter would lock out all users at once.
+# Turn it on only together with FORWARDED_ALLOW_IPS (and expect shared addresses,
+# e.g. mobile carrier NAT, to share the counter).
+MAX_LOGIN_ATTEMPTS_PER_IP = int(os.environ.get('MAX_LOGIN_ATTEMPTS_PER_IP', 0))
+
+# Email delivery
+# EMAIL_TRANSPORT: "sendgrid", "smtp" or "console" (defaults to sendgrid when a key is set)
+# SENDGRID_API_HOST can point at a local HTTP sink for testing
+EMAIL_TRANSPORT = os.environ.get('EMAIL_TRANSPORT', 'sendgrid' if SENDGRID_API_KEY else 'console')
+SENDGRID_API_HOST = os.environ.get('SENDGRID_API_HOST', 'https://api.sendgrid.com')
+EMAIL_HOST = os.environ.get('EMAIL_HOST', 'smtp.gmail.com')
+EMAIL_PORT = int(os.environ.get('EMAIL_PORT', 587))
+EMAIL_USERNAME = os.environ.get('EMAIL_USERNAME')
+EMAIL_PASSWORD = os.environ.get('EMAIL_PASSWORD')
+EMAIL_USE_TLS = os.environ.get('EMAIL_USE_TLS', 'true').lower() == 'true'
+
+# Email outbox: handlers enqueue, a background worker delivers with retries
+# EMAIL_OUTBOX_BACKEND: "memory" (lost on restart) or "sqlite" (survives restarts)
+EMAIL_OUTBOX_BACKEND = os.environ.get('EMAIL_OUTBOX_BACKEND', 'memory')
+EMAIL_OUTBOX_SQLITE_PATH = os.environ.get('EMAIL_OUTBOX_SQLITE_PATH', '/tmp/luca_outbox.sqlite3')
+EMAIL_MAX_ATTEMPTS = int(os.environ.get('EMAIL_MAX_ATTEMPTS', 5))
+EMAIL_RETRY_BASE_SECONDS = float(os.environ.get('EMAIL_RETRY_BASE_SECONDS', 2))
+EMAIL_RETRY_MAX_SECONDS = float(os.environ.get('EMAIL_RETRY_MAX_SECONDS', 300))
+EMAIL_BULK_REQUESTS_PER_SECOND = float(os.environ.get('EMAIL_BULK_REQUESTS_PER_SECOND', 5))
+
+# Use the Postgres functions in sql/functions.sql for multi-step writes
+# (falls back to separate queries automatically if they are not installed)
+DB_RPC_ENABLED = os.environ.get('DB_RPC_ENABLED', 'true').lower() == 'true'
+
+# Expired row reaper (sessions and password reset tokens)
+# Each run deletes up to REAPER_MAX_BATCHES batches of REAPER_BATCH_SIZE rows per table;
+# run intervals are jittered by +/- REAPER_JITTER so workers don't sweep in lockstep
+REAPER_ENABLED = os.environ.get('REAPER_ENABLED', 'true').lower() == 'true'
+REAPER_INTERVAL_SECONDS = float(os.environ.get('REAPER_INTERVAL_SECONDS', 600))
+REAPER_BATCH_SIZE = int(os.environ.get('REAPER_BATCH_SIZE', 500))
+REAPER_MAX_BATCHES = int(os.environ.get('REAPER_MAX_BATCHES', 20))
+REAPER_JITTER = float(os.environ.get('REAPER_JITTER', 0.2))
+
+# Logging (see logs.py)
+# LOG_LEVELS sets per-module levels, e.g. "routes.auth=DEBUG,outbox=WARNING"
+# LOG_SAMPLE_RATES keeps a fraction of high-volume events, e.g. "login.success=0.1"
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+LOG_LEVELS = os.environ.get('LOG_LEVELS', '')
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')
+LOG_SAMPLE_RATES = os.environ.get('LOG_SAMPLE_RATES', 'login.success=0.1')
+LOG_CAPTURE_UVICORN = os.environ.get('LOG_CAPTURE_UVICORN', 'true').lower() == 'true'
+
+# Event loop diagnostics (see loopmonitor.py), off by default
+# When enabled, event loop lag is sampled every LOOP_MONITOR_INTERVAL_SECONDS and the
+# stack of anything blocking the loop longer than LOOP_BLOCK_THRESHOLD_SECONDS is captured
+LOOP_MONITOR_ENABLED = os.environ.get('LOOP_MONITOR_ENABLED', 'false').lower() == 'true'
+LOOP_MONITOR_INTERVAL_SECONDS = float(os.environ.get('LOOP_MONITOR_INTERVAL_SECONDS', 0.05))
+LOOP_BLOCK_THRESHOLD_SECONDS = float(os.environ.get('LOOP_BLOCK_THRESHOLD_SECONDS', 0.1))
+LOOP_MONITOR_MAX_REPORTS = int(os.environ.get('LOOP_MONITOR_MAX_REPORTS', 50))
+
+# Production launcher (serve.py)
+# WEB_CONCURRENCY worker processes share one listening socket; 0 = one per usable CPU.
+# A worker is recycled after WEB_MAX_REQUESTS requests plus up to WEB_MAX_REQUESTS_JITTER
+# more (0 = never), finishing in-flight requests for up to WEB_GRACEFUL_TIMEOUT_SECONDS.
+# WEB_LOOP / WEB_HTTP are uvicorn's --loop / --http; "auto" uses uvloop and httptools when installed.
+# WEB_KEEPALIVE_SECONDS should exceed the proxy's idle timeout, so the proxy never reuses
+# a connection the worker has just closed.
+WEB_HOST = os.environ.get('WEB_HOST', '0.0.0.0')
+WEB_PORT = int(os.environ.get('PORT', 6769))
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', 0))
+WEB_LOOP = os.environ.get('WEB_LOOP', 'auto')
+WEB_HTTP = os.environ.get('WEB_HTTP', 'auto')
+WEB_BACKLOG = int(os.environ.get('WEB_BACKLOG', 2048))
+WEB_KEEPALIVE_SECONDS = int(os.environ.get('WEB_KEEPALIVE_SECONDS', 75))
+WEB_MAX_REQUESTS = int(os.environ.get('WEB_MAX_REQUESTS', 0))
+WEB_MAX_REQUESTS_JITTER = int(os.environ.get('WEB_MAX_REQUESTS_JITTER', 0))
+WEB_GRACEFUL_TIMEOUT_SECONDS = int(os.environ.get('WEB_GRACEFUL_TIMEOUT_SECONDS', 30))
+WEB_ACCESS_LOG = os.environ.get('WEB_ACCESS_LOG', 'true').lower() == 'true'
+
+# Proxies trusted to set X-Forwarded-For / X-Forwarded-Proto: comma-separated addresses
+# or CIDRs, e.g. "10.0.0.0/8" for a platform whose load balancer reaches the app over a
+# private network (check the platform's docs for the range it connects from).
+# The client address, which the per-IP login limit counts, is the rightmost
+# X-Forwarded-For entry not in this list. Never use "*" behind a public proxy: every
+# hop is then trusted, so a client picks its own address by sending the header, which
+# lets it evade MAX_LOGIN_ATTEMPTS_PER_IP and lock out other users' addresses.
+FORWARDED_ALLOW_IPS = os.environ.get('FORWARDED_ALLOW_IPS', '127.0.0.1')
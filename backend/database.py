@@ -1,15 +1,77 @@
 # Database connection and initialization for Luca App API
 
-from supabase import create_client
-from config import SUPABASE_URL, SUPABASE_KEY
+import logging
+import time
 
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+import httpx
+from postgrest import AsyncPostgrestClient
+from postgrest.constants import DEFAULT_POSTGREST_CLIENT_HEADERS
+from config import SUPABASE_URL, DB_POOL_SIZE
+from metrics import DB_REQUESTS, DB_DURATION, resource_label
+
+logger = logging.getLogger(__name__)
+
+class InstrumentedTransport(httpx.AsyncBaseTransport):
+    """Wraps the pooled transport to record per-resource Supabase latency and status codes"""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, base_path: str):
+        self.transport = transport
+        self.base_path = base_path
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        resource = resource_label(request.url.path, self.base_path)
+        started = time.perf_counter()
+        status = "error"
+        try:
+            response = await self.transport.handle_async_request(request)
+            status = response.status_code
+            return response
+        finally:
+            DB_DURATION.labels(request.method, resource).observe(time.perf_counter() - started)
+            DB_REQUESTS.labels(request.method, resource, status).inc()
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+class PooledPostgrestClient(AsyncPostgrestClient):
+    """Async Supabase PostgREST client backed by one bounded, keep-alive HTTP connection pool"""
+    # One per worker process, owned by the app's Resources (see resources.py)
+
+    def __init__(self, base_url: str, api_key: str, pool_size: int, timeout: httpx.Timeout):
+        self.pool_size = pool_size
+        headers = {
+            **DEFAULT_POSTGREST_CLIENT_HEADERS,
+            "apikey": api_key,
+            "Authorization": f"Bearer {api_key}",
+        }
+        super().__init__(base_url, headers=headers, timeout=timeout)
+
+    def create_session(self, base_url, headers, timeout, verify=True, proxy=None) -> httpx.AsyncClient:
+        transport = httpx.AsyncHTTPTransport(
+            verify=verify,
+            proxy=proxy,
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=self.pool_size,
+                max_keepalive_connections=self.pool_size
+            ),
+        )
+        return httpx.AsyncClient(
+            base_url=base_url,
+            headers=headers,
+            timeout=timeout,
+            follow_redirects=True,
+            transport=InstrumentedTransport(transport, httpx.URL(str(base_url)).path),
+        )
 
 def init_database():
     # No automatic schema creation/migration - create tables manually in Supabase dashboard
     # Tables needed:
-    # - userAccount (id serial PRIMARY KEY, name text NOT NULL, email text UNIQUE NOT NULL, phone text NOT NULL, date_of_birth text NOT NULL, password text NOT NULL)
-    # - sessions (id serial PRIMARY KEY, account_id int REFERENCES "userAccount"(id), token text UNIQUE NOT NULL, expires_at timestamp NOT NULL)
-    # - password_reset_tokens (id serial PRIMARY KEY, account_id int REFERENCES "userAccount"(id), token text UNIQUE NOT NULL, expires_at timestamp NOT NULL, used boolean DEFAULT false)
-    # Create indexes as needed (e.g., on email, token)
-    print("Connected to Supabase database")
\ No newline at end of file
+    # - userAccount (id serial PRIMARY KEY, name text NOT NULL, email text UNIQUE NOT NULL, phone text NOT NULL, date_of_birth text NOT NULL, password text NOT NULL, created_at timestamptz DEFAULT now(), last_login timestamp)
+    # - sessions (id serial PRIMARY KEY, account_id int REFERENCES "userAccount"(id), token text UNIQUE, token_hash text UNIQUE, expires_at timestamp NOT NULL)
+    # - password_reset_tokens (id serial PRIMARY KEY, account_id int REFERENCES "userAccount"(id), token text UNIQUE, token_hash text UNIQUE, expires_at timestamp NOT NULL, used boolean DEFAULT false)
+    # Tokens are stored as their digest in token_hash; token only holds raw tokens of older
+    # rows (see sql/token_hash.sql). Columns added to userAccount since the original schema
+    # are in sql/accounts.sql. The reaper, token lookups and account listing also need the
+    # indexes in sql/indexes.sql
+    logger.info("Using Supabase database", extra={"url": SUPABASE_URL, "pool_size": DB_POOL_SIZE})
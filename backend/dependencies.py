@@ -1,9 +1,19 @@
-# FastAPI dependencies for authentication and authorization
+# FastAPI dependencies for authentication, authorization and the app's resources
 
-from fastapi import Depends, HTTPException, status
+import inspect
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from security import validate_token
 from typing import Optional
+from resources import Resources, bind_request
+from cache import AccountProfileCache, SessionTokenCache
+from database import PooledPostgrestClient
+from loopmonitor import LoopMonitor
+from outbox import Outbox
+from passwords import PasswordHasher
+from ratelimit import RateLimiter
+from tokens import TokenDenylist
+from workerpool import WorkerPool
 
 security = HTTPBearer()
 
@@ -21,7 +31,7 @@ async def get_current_account(credentials: HTTPAuthorizationCredentials = Depend
             headers={"WWW-Authenticate": "Bearer"}
         )
     
-    account_id: Optional[int] = validate_token(token)
+    account_id: Optional[int] = await validate_token(token)
     
     if not account_id:
         raise HTTPException(
@@ -30,4 +40,76 @@ async def get_current_account(credentials: HTTPAuthorizationCredentials = Depend
             headers={"WWW-Authenticate": "Bearer"}
         )
     
-    return account_id
\ No newline at end of file
+    return account_id
+
+async def get_bearer_token(credentials: HTTPAuthorizationCredentials = Depends(security)) -> str:
+    # The raw bearer token from the Authorization header (e.g. to delete it on logout).
+    # Combine with get_current_account so the token is validated first.
+    return credentials.credentials
+
+# Resources created by main.lifespan, one dependency per part, so tests can replace any of them:
+#   limiter = MemoryRateLimiter(max_keys=100)
+#   app.dependency_overrides[get_login_limiter] = lambda: limiter
+# Routes take what they use as parameters; bind_resources (an app-wide dependency)
+# hands overridden parts to code that reads resources.current() as well.
+# async, so FastAPI calls them on the event loop instead of a threadpool.
+async def get_resources(request: Request) -> Resources:
+    return request.app.state.resources
+
+async def get_db(resources: Resources = Depends(get_resources)) -> PooledPostgrestClient:
+    return resources.db
+
+async def get_token_cache(resources: Resources = Depends(get_resources)) -> SessionTokenCache:
+    return resources.token_cache
+
+async def get_account_cache(resources: Resources = Depends(get_resources)) -> AccountProfileCache:
+    return resources.account_cache
+
+async def get_denylist(resources: Resources = Depends(get_resources)) -> TokenDenylist:
+    return resources.denylist
+
+async def get_password_hasher(resources: Resources = Depends(get_resources)) -> PasswordHasher:
+    return resources.password_hasher
+
+async def get_hash_pool(resources: Resources = Depends(get_resources)) -> WorkerPool:
+    return resources.hash_pool
+
+async def get_outbox(resources: Resources = Depends(get_resources)) -> Outbox:
+    return resources.outbox
+
+async def get_login_limiter(resources: Resources = Depends(get_resources)) -> RateLimiter:
+    return resources.login_limiter
+
+async def get_loop_monitor(resources: Resources = Depends(get_resources)) -> LoopMonitor:
+    return resources.loop_monitor
+
+# The Resources attribute each dependency provides
+_PARTS = {
+    get_db: "db",
+    get_token_cache: "token_cache",
+    get_account_cache: "account_cache",
+    get_denylist: "denylist",
+    get_password_hasher: "password_hasher",
+    get_hash_pool: "hash_pool",
+    get_outbox: "outbox",
+    get_login_limiter: "login_limiter",
+    get_loop_monitor: "loop_monitor",
+}
+
+async def _call_override(override):
+    value = override()
+    return await value if inspect.isawaitable(value) else value
+
+async def bind_resources(request: Request):
+    # App-wide (main.py), solved before route dependencies such as get_current_account.
+    # Without overrides current() already is the app's resources, so this costs nothing
+    # per request; overrides of get_resources and the parts must take no arguments.
+    overrides = request.app.dependency_overrides
+    if not overrides:
+        return
+    resources = request.app.state.resources
+    if get_resources in overrides:
+        resources = await _call_override(overrides[get_resources])
+    parts = {name: await _call_override(overrides[dependency])
+             for dependency, name in _PARTS.items() if dependency in overrides}
+    bind_request(resources.replacing(**parts))
@@ -0,0 +1,2 @@
+# Local stand-ins for external services (Supabase/PostgREST, email), used for
+# testing and benchmarking without network access. Not imported by the API.
\ No newline at end of file
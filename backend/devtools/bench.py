@@ -0,0 +1,433 @@
+# Load tests and micro-benchmarks for the auth API
+#
+# The API runs in-process (driven through httpx's ASGI transport, so no socket
+# between client and app) and talks to the fake PostgREST and fake SendGrid
+# servers over local HTTP, like it would to Supabase and SendGrid. Each load
+# scenario runs `concurrency` client tasks for `duration` seconds and reports
+# throughput, latency percentiles, event loop lag and database round trips per
+# request. Results are written as JSON so runs can be compared across releases.
+#
+# Run from backend/:
+#   python -m devtools.bench --duration 10 --concurrency 20 --output bench.json
+#   python -m devtools.bench --scenarios me,admin --no-micro
+#   python -m devtools.bench --only-micro
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import secrets
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+SCENARIOS = ("register", "login", "me", "forgot", "admin")
+BENCH_PASSWORD = "benchpass1"
+
+
+def percentile(sorted_values: List[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+def summarize_ms(samples: List[float]) -> Dict[str, Optional[float]]:
+    """p50/p95/p99/max/mean in milliseconds of samples given in seconds"""
+    values = sorted(samples)
+    def ms(value):
+        return round(value * 1000, 3) if value is not None else None
+    return {
+        "p50_ms": ms(percentile(values, 50)),
+        "p95_ms": ms(percentile(values, 95)),
+        "p99_ms": ms(percentile(values, 99)),
+        "max_ms": ms(values[-1] if values else None),
+        "mean_ms": ms(sum(values) / len(values) if values else None),
+    }
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Fake backends
+class FakeBackends:
+    """Fake PostgREST and SendGrid served by one uvicorn server on a background thread"""
+
+    def __init__(self, email_latency: float):
+        from starlette.applications import Starlette
+        from devtools.fake_email import FakeEmailSink
+        from devtools.fake_postgrest import FakePostgrest
+
+        self.db = FakePostgrest()
+        self.email = FakeEmailSink(latency=email_latency)
+        self.app = Starlette(routes=self.db.routes + self.email.routes)
+        self.server = None
+        self.url = None
+
+    def start(self):
+        import uvicorn
+
+        self.server = uvicorn.Server(uvicorn.Config(
+            self.app, host="127.0.0.1", port=0, log_level="warning", lifespan="off"
+        ))
+        threading.Thread(target=self.server.run, name="fake-backends", daemon=True).start()
+        while not self.server.started:
+            time.sleep(0.01)
+        port = self.server.servers[0].sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+
+    def stop(self):
+        if self.server is not None:
+            self.server.should_exit = True
+
+
+def configure_environment(args, backends: FakeBackends):
+    """Point the API at the fakes; must run before the API modules are imported"""
+    os.environ.update({
+        "SUPABASE_URL": backends.url,
+        "SUPABASE_KEY": "bench",
+        "EMAIL_TRANSPORT": "sendgrid",
+        "SENDGRID_API_KEY": "bench",
+        "SENDGRID_API_HOST": backends.url,
+        "EMAIL_OUTBOX_BACKEND": "memory",
+        "RATE_LIMIT_BACKEND": "memory",
+        "REAPER_ENABLED": "false",
+        "TOKEN_MODE": args.token_mode,
+        "TOKEN_SIGNING_SECRET": os.environ.get("TOKEN_SIGNING_SECRET", "bench-signing-secret"),
+        "LOG_LEVEL": args.log_level,
+    })
+
+
+def seed_accounts(backends: FakeBackends, count: int) -> List[Dict[str, Any]]:
+    """Insert accounts with a known password and one live session each, straight into the fake database"""
+    from security import hash_password, session_tokens
+    from tokens import hash_token
+
+    password_hash = hash_password(BENCH_PASSWORD)
+    expires_at = (datetime.now() + timedelta(days=30)).isoformat()
+    conn = backends.db.conn
+    accounts = []
+    for i in range(count):
+        email = f"seed-{i}@bench.example.com"
+        account_id = conn.execute(
+            'INSERT INTO "userAccount" (name, email, phone, date_of_birth, password) VALUES (?, ?, ?, ?, ?) RETURNING id',
+            (f"Seed User {i}", email, "5550000000", "1990-01-01", password_hash)
+        ).fetchone()[0]
+        token = secrets.token_urlsafe(32)
+        session_id = conn.execute(
+            "INSERT INTO sessions (account_id, token_hash, expires_at) VALUES (?, ?, ?) RETURNING id",
+            (account_id, hash_token(token), expires_at)
+        ).fetchone()[0]
+        access_token = session_tokens(account_id, token, session_id)["token"]
+        accounts.append({"id": account_id, "email": email, "token": access_token})
+    return accounts
+
+
+# Load scenarios: each returns (method, url, request kwargs) for one request
+def scenario_requests(run_id: str, accounts: List[Dict[str, Any]]) -> Dict[str, Callable[[int, int], tuple]]:
+    def account(worker: int, i: int) -> Dict[str, Any]:
+        return accounts[(worker * 7919 + i) % len(accounts)]
+
+    def register(worker, i):
+        return "POST", "/auth/register", {"json": {
+            "name": "Bench User",
+            "email": f"bench-{run_id}-{worker}-{i}@bench.example.com",
+            "phone": "5551234567",
+            "date_of_birth": "1990-01-01",
+            "password": BENCH_PASSWORD,
+        }}
+
+    def login(worker, i):
+        return "POST", "/auth/login", {"json": {"email": account(worker, i)["email"], "password": BENCH_PASSWORD}}
+
+    def me(worker, i):
+        return "GET", "/accounts/me", {"headers": {"Authorization": f"Bearer {account(worker, i)['token']}"}}
+
+    def forgot(worker, i):
+        return "POST", "/auth/password/forgot", {"json": {"email": account(worker, i)["email"]}}
+
+    def admin(worker, i):
+        return "GET", "/admin/accounts", {
+            "params": {"limit": 100},
+            "headers": {"Authorization": f"Bearer {account(worker, i)['token']}"},
+        }
+
+    return {"register": register, "login": login, "me": me, "forgot": forgot, "admin": admin}
+
+
+class LoopLagMonitor:
+    """Measures how late a periodic sleep wakes up, i.e. how long the event loop was blocked"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+        self._expected: Optional[float] = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self._expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - self._expected))
+            self._expected = None
+
+    def start(self):
+        self.samples = []
+        self._expected = None
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> List[float]:
+        # A sleep still pending is as late as the loop has been blocked since it was due;
+        # without this a scenario that blocks the loop for its whole run records nothing
+        now = asyncio.get_running_loop().time()
+        if self._expected is not None and now > self._expected:
+            self.samples.append(now - self._expected)
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        return self.samples
+
+
+async def run_scenario(client, name: str, make_request: Callable, concurrency: int,
+                       duration: float, warmup: float, backends: FakeBackends) -> Dict[str, Any]:
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    errors: Dict[str, int] = {}
+    counter = {"i": 0}
+    recording = {"on": False}
+
+    async def worker(index: int, deadline: float):
+        while time.perf_counter() < deadline:
+            counter["i"] += 1
+            method, url, kwargs = make_request(index, counter["i"])
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, url, **kwargs)
+                status = str(response.status_code)
+            except Exception as e:
+                status = None
+                key = type(e).__name__
+                if recording["on"]:
+                    errors[key] = errors.get(key, 0) + 1
+            elapsed = time.perf_counter() - started
+            if recording["on"] and status is not None:
+                latencies.append(elapsed)
+                statuses[status] = statuses.get(status, 0) + 1
+
+    if warmup > 0:
+        await asyncio.gather(*(worker(i, time.perf_counter() + warmup) for i in range(concurrency)))
+
+    lag = LoopLagMonitor()
+    db_before = backends.db.request_count
+    recording["on"] = True
+    lag.start()
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(i, started + duration) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    recording["on"] = False
+    lag_samples = await lag.stop()
+    db_requests = backends.db.request_count - db_before
+
+    completed = len(latencies)
+    ok = sum(count for status, count in statuses.items() if status.startswith("2"))
+    return {
+        "requests": completed,
+        "ok": ok,
+        "statuses": statuses,
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(completed / elapsed, 1) if elapsed else None,
+        "latency": summarize_ms(latencies),
+        "event_loop_lag": summarize_ms(lag_samples),
+        "db_requests_per_request": round(db_requests / completed, 2) if completed else None,
+    }
+
+
+async def run_load(args, backends: FakeBackends) -> Dict[str, Any]:
+    import httpx
+    import main
+
+    results = {}
+    transport = httpx.ASGITransport(app=main.app, client=("127.0.0.1", 50000))
+    async with main.app.router.lifespan_context(main.app):
+        # Seed once calibration (started in the background at startup) is done, so the
+        # accounts are hashed at the calibrated cost
+        await main.app.state.resources.calibration
+        accounts = seed_accounts(backends, args.accounts)
+        requests = scenario_requests(secrets.token_hex(4), accounts)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for name in args.scenarios:
+                print(f"load: {name} ({args.concurrency} clients, {args.duration}s)", file=sys.stderr)
+                results[name] = await run_scenario(
+                    client, name, requests[name], args.concurrency, args.duration, args.warmup, backends
+                )
+            # Let queued emails drain before reporting what the sink received
+            await main.app.state.resources.outbox.drain_once()
+    results["email_sink"] = backends.email.stats()
+    return results
+
+
+# Micro-benchmarks
+def bench_sync(fn: Callable, min_time: float, max_iterations: int) -> Dict[str, Any]:
+    samples = []
+    deadline = time.perf_counter() + min_time
+    while len(samples) < max_iterations and (time.perf_counter() < deadline or len(samples) < 3):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return _micro_result(samples)
+
+async def bench_async(fn: Callable, min_time: float, max_iterations: int) -> Dict[str, Any]:
+    samples = []
+    deadline = time.perf_counter() + min_time
+    while len(samples) < max_iterations and (time.perf_counter() < deadline or len(samples) < 3):
+        started = time.perf_counter()
+        await fn()
+        samples.append(time.perf_counter() - started)
+    return _micro_result(samples)
+
+def _micro_result(samples: List[float]) -> Dict[str, Any]:
+    values = sorted(samples)
+    total = sum(values)
+    def us(value):
+        return round(value * 1e6, 2)
+    return {
+        "iterations": len(values),
+        "ops_per_second": round(len(values) / total, 1) if total else None,
+        "mean_us": us(total / len(values)),
+        "p50_us": us(percentile(values, 50)),
+        "p99_us": us(percentile(values, 99)),
+    }
+
+async def run_micro(args) -> Dict[str, Any]:
+    from pydantic import ValidationError
+    from models import AccountCreate
+    from resources import current
+    from security import hash_password, verify_password, validate_token
+    from tokens import hash_token, issue_access_token
+
+    results = {}
+    min_time = args.micro_time
+
+    print("micro: security.hash_password / verify_password", file=sys.stderr)
+    password_hash = hash_password(BENCH_PASSWORD)
+    results["security.hash_password"] = bench_sync(lambda: hash_password(BENCH_PASSWORD), min_time, 20)
+    results["security.verify_password"] = bench_sync(lambda: verify_password(BENCH_PASSWORD, password_hash), min_time, 20)
+
+    print("micro: security.validate_token", file=sys.stderr)
+    opaque = secrets.token_urlsafe(32)
+    current().token_cache.store(hash_token(opaque), 1, datetime.now() + timedelta(days=1))
+    results["security.validate_token[opaque, cached]"] = await bench_async(
+        lambda: validate_token(opaque), min_time, 200000
+    )
+    signed = issue_access_token(1, 1)
+    results["security.validate_token[signed]"] = await bench_async(
+        lambda: validate_token(signed), min_time, 200000
+    )
+
+    print("micro: models.AccountCreate", file=sys.stderr)
+    valid = {
+        "name": "Bench User", "email": "bench@example.com", "phone": "(555) 123-4567",
+        "date_of_birth": "1990-01-01", "password": BENCH_PASSWORD,
+    }
+    invalid = {**valid, "password": "short", "date_of_birth": "2015-01-01"}
+
+    def reject():
+        try:
+            AccountCreate(**invalid)
+        except ValidationError:
+            pass
+
+    results["models.AccountCreate[valid]"] = bench_sync(lambda: AccountCreate(**valid), min_time, 200000)
+    results["models.AccountCreate[invalid]"] = bench_sync(reject, min_time, 200000)
+    return results
+
+
+async def run(args, backends: FakeBackends) -> Dict[str, Any]:
+    report: Dict[str, Any] = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "config": {
+                "scenarios": list(args.scenarios),
+                "concurrency": args.concurrency,
+                "duration": args.duration,
+                "warmup": args.warmup,
+                "accounts": args.accounts,
+                "token_mode": args.token_mode,
+                "email_latency": args.email_latency,
+            },
+        },
+    }
+    if not args.only_micro:
+        report["load"] = await run_load(args, backends)
+    if args.micro or args.only_micro:
+        import main
+        # The functions measured use the app's resources (hasher, token cache, denylist)
+        async with main.app.router.lifespan_context(main.app):
+            # Measure hashing at the calibrated cost, not whatever it is while calibration runs
+            await main.app.state.resources.calibration
+            report["micro"] = await run_micro(args)
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load tests and micro-benchmarks for the Luca App API")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help=f"Comma-separated load scenarios (default: all of {', '.join(SCENARIOS)})")
+    parser.add_argument("--concurrency", type=int, default=20, help="Concurrent clients per scenario")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds each scenario is measured")
+    parser.add_argument("--warmup", type=float, default=1.0, help="Unmeasured seconds before each scenario")
+    parser.add_argument("--accounts", type=int, default=200, help="Accounts seeded for login/me/forgot/admin")
+    parser.add_argument("--token-mode", choices=("opaque", "signed"), default="opaque")
+    parser.add_argument("--email-latency", type=float, default=0.0, help="Simulated SendGrid latency in seconds")
+    parser.add_argument("--micro", action=argparse.BooleanOptionalAction, default=True,
+                        help="Also run the micro-benchmarks")
+    parser.add_argument("--only-micro", action="store_true", help="Run only the micro-benchmarks")
+    parser.add_argument("--micro-time", type=float, default=1.0, help="Minimum seconds per micro-benchmark")
+    parser.add_argument("--log-level", default="WARNING", help="API log level during the run")
+    parser.add_argument("--output", help="Write the JSON report here (default: stdout)")
+    args = parser.parse_args(argv)
+    args.scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    backends = FakeBackends(email_latency=args.email_latency)
+    backends.start()
+    try:
+        configure_environment(args, backends)
+        report = asyncio.run(run(args, backends))
+    finally:
+        backends.stop()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+        print(f"Results written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
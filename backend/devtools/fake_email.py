@@ -0,0 +1,76 @@
+# Fake SendGrid API that accepts and counts mail instead of delivering it
+#
+# Point the API at it with EMAIL_TRANSPORT=sendgrid, SENDGRID_API_KEY=<anything>
+# and SENDGRID_API_HOST=http://127.0.0.1:<port>. Optional latency and failure
+# rate make it possible to exercise the outbox retry path.
+#
+# Run standalone:  python -m devtools.fake_email --port 54322
+
+import argparse
+import asyncio
+import json
+import random
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+
+class FakeEmailSink:
+    """Records what the API sent to /v3/mail/send"""
+
+    def __init__(self, latency: float = 0.0, fail_rate: float = 0.0, keep: int = 100):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.keep = keep
+        self.requests = 0
+        self.recipients = 0
+        self.failures = 0
+        self.messages: list = []
+
+    async def handle_send(self, request: Request) -> Response:
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.fail_rate and random.random() < self.fail_rate:
+            self.failures += 1
+            return JSONResponse({"errors": [{"message": "Simulated failure"}]}, status_code=503)
+        body = json.loads(await request.body() or b"{}")
+        for personalization in body.get("personalizations", []):
+            self.recipients += len(personalization.get("to", []))
+        if len(self.messages) < self.keep:
+            self.messages.append(body)
+        return Response(status_code=202)
+
+    async def handle_stats(self, request: Request) -> Response:
+        return JSONResponse(self.stats())
+
+    def stats(self) -> dict:
+        return {"requests": self.requests, "recipients": self.recipients, "failures": self.failures}
+
+    @property
+    def routes(self) -> list:
+        return [
+            Route("/v3/mail/send", self.handle_send, methods=["POST"]),
+            Route("/_stats", self.handle_stats, methods=["GET"]),
+        ]
+
+
+def create_app(latency: float = 0.0, fail_rate: float = 0.0) -> Starlette:
+    sink = FakeEmailSink(latency, fail_rate)
+    app = Starlette(routes=sink.routes)
+    app.state.sink = sink
+    return app
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Fake SendGrid API that counts mail instead of sending it")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=54322)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to wait before answering")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of requests answered with 503")
+    args = parser.parse_args()
+    uvicorn.run(create_app(args.latency, args.fail_rate), host=args.host, port=args.port, log_level="warning")
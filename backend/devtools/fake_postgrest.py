@@ -0,0 +1,391 @@
+# Fake Supabase PostgREST server backed by SQLite
+#
+# Implements the subset of the PostgREST API that repository.py uses: select with
+# filters/order/limit, insert, update and delete with RETURNING, and the
+# functions from sql/functions.sql (reimplemented here in Python).
+#
+# Run standalone:  python -m devtools.fake_postgrest --port 54321
+# then start the API with SUPABASE_URL=http://127.0.0.1:54321
+
+import argparse
+import base64
+import hashlib
+import json
+import re
+import sqlite3
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Tuple
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+# Same pattern as convert_hex_password_hashes in sql/functions.sql
+HEX_HASH = re.compile(r"^(24326124|24326224|24327924|2473637279707424|246172676f6e32696424)([0-9a-f]{2})*$")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS "userAccount" (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    email TEXT UNIQUE NOT NULL,
+    phone TEXT NOT NULL,
+    date_of_birth TEXT NOT NULL,
+    password TEXT NOT NULL,
+    created_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%f', 'now', 'localtime')),
+    last_login TEXT
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    account_id INTEGER REFERENCES "userAccount"(id),
+    token TEXT UNIQUE,
+    token_hash TEXT UNIQUE,
+    expires_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_account_id ON sessions (account_id);
+CREATE INDEX IF NOT EXISTS sessions_expires_at ON sessions (expires_at);
+CREATE TABLE IF NOT EXISTS password_reset_tokens (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    account_id INTEGER REFERENCES "userAccount"(id),
+    token TEXT UNIQUE,
+    token_hash TEXT UNIQUE,
+    expires_at TEXT NOT NULL,
+    used INTEGER DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS password_reset_tokens_expires_at ON password_reset_tokens (expires_at);
+"""
+
+# Columns stored as 0/1 in SQLite but exposed as JSON booleans
+BOOLEAN_COLUMNS = {"password_reset_tokens": {"used"}}
+
+OPERATORS = {"eq": "=", "neq": "!=", "gt": ">", "gte": ">=", "lt": "<", "lte": "<="}
+
+_IDENTIFIER = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+class PostgrestError(Exception):
+    def __init__(self, status: int, code: str, message: str):
+        super().__init__(message)
+        self.status = status
+        self.code = code
+        self.message = message
+
+
+def _quote(identifier: str) -> str:
+    if not _IDENTIFIER.match(identifier):
+        raise PostgrestError(400, "PGRST100", f"Invalid identifier: {identifier}")
+    return f'"{identifier}"'
+
+
+def _now() -> str:
+    return datetime.now().isoformat()
+
+
+def _token_digest(token: str) -> str:
+    """token_digest() from sql/functions.sql"""
+    return base64.urlsafe_b64encode(hashlib.sha256(token.encode("utf-8")).digest()).rstrip(b"=").decode("ascii")
+
+
+class FakePostgrest:
+    """In-process SQLite database plus the request handling for the fake server"""
+
+    def __init__(self, db_path: str = ":memory:"):
+        self.conn = sqlite3.connect(db_path, isolation_level=None, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+        self.rpcs: Dict[str, Callable[[Dict[str, Any]], List[Dict[str, Any]]]] = {
+            "register_account": self.rpc_register_account,
+            "start_session": self.rpc_start_session,
+            "request_password_reset": self.rpc_request_password_reset,
+            "reset_password_with_token": self.rpc_reset_password_with_token,
+            "convert_hex_password_hashes": self.rpc_convert_hex_password_hashes,
+            "hash_legacy_tokens": self.rpc_hash_legacy_tokens,
+        }
+        self.request_count = 0
+
+    # Row conversion
+    def _value(self, table: str, column: str, raw: str) -> Any:
+        if column in BOOLEAN_COLUMNS.get(table, ()):
+            return {"true": 1, "false": 0}.get(raw.lower(), raw)
+        return raw
+
+    def _row(self, table: str, row: sqlite3.Row) -> Dict[str, Any]:
+        out = dict(row)
+        for column in BOOLEAN_COLUMNS.get(table, ()):
+            if column in out and out[column] is not None:
+                out[column] = bool(out[column])
+        return out
+
+    def _columns(self, select: str) -> str:
+        columns = [c.strip() for c in select.split(",") if c.strip()]
+        if not columns or columns == ["*"]:
+            return "*"
+        return ", ".join(_quote(c) for c in columns)
+
+    def _where(self, table: str, params: List[Tuple[str, str]]) -> Tuple[str, list]:
+        clauses, args = [], []
+        for column, expression in params:
+            if column in ("select", "order", "limit", "offset", "columns"):
+                continue
+            negate = expression.startswith("not.")
+            if negate:
+                expression = expression[4:]
+            op, _, raw = expression.partition(".")
+            quoted = _quote(column)
+            if op in OPERATORS:
+                clause = f"{quoted} {OPERATORS[op]} ?"
+                args.append(self._value(table, column, raw))
+            elif op in ("like", "ilike"):
+                # SQLite LIKE is case-insensitive for ASCII, so like behaves as ilike here
+                clause = f"{quoted} LIKE ? ESCAPE '\\'"
+                args.append(raw.replace("*", "%"))
+            elif op == "in":
+                values = [v.strip().strip('"') for v in raw.strip("()").split(",") if v.strip()]
+                clause = f"{quoted} IN ({', '.join('?' for _ in values)})"
+                args.extend(self._value(table, column, v) for v in values)
+            elif op == "is":
+                literal = {"null": "NULL", "true": "1", "false": "0"}.get(raw.lower())
+                if literal is None:
+                    raise PostgrestError(400, "PGRST100", f"Invalid is value: {raw}")
+                clause = f"{quoted} IS {literal}"
+            else:
+                raise PostgrestError(400, "PGRST100", f"Unsupported operator: {op}")
+            clauses.append(f"NOT ({clause})" if negate else clause)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", args
+
+    def _order_limit(self, params: Dict[str, str]) -> str:
+        sql = ""
+        if "order" in params:
+            terms = []
+            for term in params["order"].split(","):
+                column, _, direction = term.partition(".")
+                terms.append(f"{_quote(column)} {'DESC' if direction.startswith('desc') else 'ASC'}")
+            sql += " ORDER BY " + ", ".join(terms)
+        if "limit" in params:
+            sql += f" LIMIT {int(params['limit'])}"
+            if "offset" in params:
+                sql += f" OFFSET {int(params['offset'])}"
+        return sql
+
+    def _execute(self, table: str, sql: str, args: list) -> List[Dict[str, Any]]:
+        try:
+            return [self._row(table, row) for row in self.conn.execute(sql, args).fetchall()]
+        except sqlite3.IntegrityError as e:
+            if "UNIQUE" in str(e):
+                raise PostgrestError(409, "23505", str(e))
+            raise PostgrestError(400, "23502", str(e))
+        except sqlite3.OperationalError as e:
+            if "no such table" in str(e):
+                raise PostgrestError(404, "42P01", str(e))
+            raise PostgrestError(400, "42703", str(e))
+
+    # Table operations
+    def select(self, table: str, query: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        params = dict(query)
+        where, args = self._where(table, query)
+        sql = f"SELECT {self._columns(params.get('select', '*'))} FROM {_quote(table)}{where}{self._order_limit(params)}"
+        return self._execute(table, sql, args)
+
+    def insert(self, table: str, body: Any, query: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        rows = body if isinstance(body, list) else [body]
+        returning = self._columns(dict(query).get("select", "*"))
+        created = []
+        self.conn.execute("BEGIN")
+        try:
+            for row in rows:
+                columns = ", ".join(_quote(c) for c in row)
+                placeholders = ", ".join("?" for _ in row)
+                values = [self._value(table, c, v) if isinstance(v, str) else v for c, v in row.items()]
+                sql = f"INSERT INTO {_quote(table)} ({columns}) VALUES ({placeholders}) RETURNING {returning}"
+                created.extend(self._execute(table, sql, values))
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return created
+
+    def update(self, table: str, body: Dict[str, Any], query: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        assignments = ", ".join(f"{_quote(c)} = ?" for c in body)
+        values = [int(v) if isinstance(v, bool) else v for v in body.values()]
+        where, args = self._where(table, query)
+        returning = self._columns(dict(query).get("select", "*"))
+        sql = f"UPDATE {_quote(table)} SET {assignments}{where} RETURNING {returning}"
+        return self._execute(table, sql, values + args)
+
+    def delete(self, table: str, query: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        where, args = self._where(table, query)
+        returning = self._columns(dict(query).get("select", "*"))
+        return self._execute(table, f"DELETE FROM {_quote(table)}{where} RETURNING {returning}", args)
+
+    # Functions from sql/functions.sql
+    def _transaction(self, fn: Callable[[], List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn()
+            self.conn.execute("COMMIT")
+            return result
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def rpc_register_account(self, p: Dict[str, Any]) -> List[Dict[str, Any]]:
+        def run():
+            account = self._execute("userAccount",
+                'INSERT INTO "userAccount" (name, email, phone, date_of_birth, password) VALUES (?, ?, ?, ?, ?) RETURNING *',
+                [p["p_name"], p["p_email"], p["p_phone"], p["p_date_of_birth"], p["p_password"]])[0]
+            session = self._execute("sessions",
+                "INSERT INTO sessions (account_id, token_hash, expires_at) VALUES (?, ?, ?) RETURNING id",
+                [account["id"], p["p_token_hash"], p["p_expires_at"]])[0]
+            return [{
+                **{c: account[c] for c in ("id", "name", "email", "phone", "date_of_birth")},
+                "session_id": session["id"],
+            }]
+        return self._transaction(run)
+
+    def rpc_start_session(self, p: Dict[str, Any]) -> List[Dict[str, Any]]:
+        def run():
+            self._execute("userAccount", 'UPDATE "userAccount" SET last_login = ? WHERE id = ?',
+                          [p["p_login_at"], p["p_account_id"]])
+            session = self._execute("sessions",
+                "INSERT INTO sessions (account_id, token_hash, expires_at) VALUES (?, ?, ?) RETURNING id",
+                [p["p_account_id"], p["p_token_hash"], p["p_expires_at"]])[0]
+            evicted = []
+            if p.get("p_max_sessions", 0) > 0:
+                evicted = [
+                    {"id": row["id"], "token_hash": row["token_hash"] or _token_digest(row["token"])}
+                    for row in self._execute("sessions",
+                        "DELETE FROM sessions WHERE id IN (SELECT id FROM sessions WHERE account_id = ? "
+                        "ORDER BY id DESC LIMIT -1 OFFSET ?) RETURNING id, token_hash, token",
+                        [p["p_account_id"], p["p_max_sessions"]])
+                ]
+            return [{"session_id": session["id"], "evicted": evicted}]
+        return self._transaction(run)
+
+    def rpc_request_password_reset(self, p: Dict[str, Any]) -> List[Dict[str, Any]]:
+        def run():
+            accounts = self._execute("userAccount", 'SELECT id, email, name FROM "userAccount" WHERE email = ?',
+                                     [p["p_email"]])
+            if not accounts:
+                return []
+            account = accounts[0]
+            self._execute("password_reset_tokens",
+                          "DELETE FROM password_reset_tokens WHERE account_id = ? AND used = 0", [account["id"]])
+            self._execute("password_reset_tokens",
+                          "INSERT INTO password_reset_tokens (account_id, token_hash, expires_at) VALUES (?, ?, ?)",
+                          [account["id"], p["p_token_hash"], p["p_expires_at"]])
+            return [account]
+        return self._transaction(run)
+
+    def rpc_reset_password_with_token(self, p: Dict[str, Any]) -> List[Dict[str, Any]]:
+        def run():
+            consumed = self._execute("password_reset_tokens",
+                "UPDATE password_reset_tokens SET used = 1 WHERE (token_hash = ? OR (? IS NOT NULL AND token = ?)) "
+                "AND used = 0 AND expires_at > ? RETURNING account_id",
+                [p["p_token_hash"], p["p_token"], p["p_token"], p["p_now"]])
+            if not consumed:
+                return []
+            account_id = consumed[0]["account_id"]
+            updated = self._execute("userAccount", 'UPDATE "userAccount" SET password = ? WHERE id = ? RETURNING id',
+                                    [p["p_password"], account_id])
+            if not updated:
+                return []
+            deleted = self._execute("sessions", "DELETE FROM sessions WHERE account_id = ? RETURNING id",
+                                    [account_id])
+            return [{"account_id": account_id, "sessions_deleted": len(deleted)}]
+        return self._transaction(run)
+
+    def rpc_convert_hex_password_hashes(self, p: Dict[str, Any]) -> List[Dict[str, Any]]:
+        def run():
+            batch = self._execute("userAccount",
+                'SELECT id, password FROM "userAccount" WHERE id > ? AND password LIKE \'24%\' ORDER BY id LIMIT ?',
+                [p["p_after_id"], p["p_batch_size"]])
+            converted = 0
+            for row in batch:
+                if HEX_HASH.match(row["password"]):
+                    self._execute("userAccount", 'UPDATE "userAccount" SET password = ? WHERE id = ?',
+                                  [bytes.fromhex(row["password"]).decode("utf-8"), row["id"]])
+                    converted += 1
+            last_id = batch[-1]["id"] if batch else None
+            return [{"last_id": last_id, "converted": converted, "done": len(batch) < p["p_batch_size"]}]
+        return self._transaction(run)
+
+    def rpc_hash_legacy_tokens(self, p: Dict[str, Any]) -> List[Dict[str, Any]]:
+        table = p["p_table"]
+        if table not in ("sessions", "password_reset_tokens"):
+            raise PostgrestError(400, "P0001", f"hash_legacy_tokens: unsupported table {table}")
+
+        def run():
+            batch = self._execute(table, f"SELECT id, token FROM {table} WHERE token IS NOT NULL ORDER BY id LIMIT ?",
+                                  [p["p_batch_size"]])
+            for row in batch:
+                self._execute(table, f"UPDATE {table} SET token_hash = ?, token = NULL WHERE id = ?",
+                              [_token_digest(row["token"]), row["id"]])
+            return [{"converted": len(batch)}]
+        return self._transaction(run)
+
+    # HTTP layer
+    async def handle_table(self, request: Request) -> Response:
+        self.request_count += 1
+        table = request.path_params["table"]
+        query = list(request.query_params.multi_items())
+        try:
+            if request.method == "GET":
+                return JSONResponse(self.select(table, query))
+            body = json.loads(await request.body() or b"null")
+            if request.method == "POST":
+                rows = self.insert(table, body, query)
+                status = 201
+            elif request.method == "PATCH":
+                rows = self.update(table, body, query)
+                status = 200
+            else:
+                rows = self.delete(table, query)
+                status = 200
+            if "return=minimal" in request.headers.get("prefer", ""):
+                return Response(status_code=204 if status == 200 else status)
+            return JSONResponse(rows, status_code=status)
+        except PostgrestError as e:
+            return self._error(e)
+
+    async def handle_rpc(self, request: Request) -> Response:
+        self.request_count += 1
+        name = request.path_params["name"]
+        fn = self.rpcs.get(name)
+        if fn is None:
+            return self._error(PostgrestError(404, "PGRST202", f"Could not find the function public.{name}"))
+        try:
+            return JSONResponse(fn(json.loads(await request.body() or b"{}")))
+        except PostgrestError as e:
+            return self._error(e)
+
+    @property
+    def routes(self) -> list:
+        return [
+            Route("/rest/v1/rpc/{name}", self.handle_rpc, methods=["POST", "GET"]),
+            Route("/rest/v1/{table}", self.handle_table, methods=["GET", "POST", "PATCH", "DELETE"]),
+        ]
+
+    @staticmethod
+    def _error(e: PostgrestError) -> Response:
+        return JSONResponse(
+            {"code": e.code, "message": e.message, "details": None, "hint": None},
+            status_code=e.status
+        )
+
+
+def create_app(db_path: str = ":memory:") -> Starlette:
+    fake = FakePostgrest(db_path)
+    app = Starlette(routes=fake.routes)
+    app.state.fake = fake
+    return app
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Fake Supabase PostgREST server backed by SQLite")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=54321)
+    parser.add_argument("--db", default=":memory:", help="SQLite database path")
+    args = parser.parse_args()
+    uvicorn.run(create_app(args.db), host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,126 @@
+# Import-time profile: what importing the API costs, per module and per package
+#
+# Runs `python -X importtime -c "import main"` in a fresh interpreter, so nothing is
+# already in sys.modules, and summarises CPython's report:
+#   self        time spent running the module's own body
+#   cumulative  self plus the modules it imported first
+# Packages add up the self time of every module under one top-level name, so
+# the package rows sum to the total. Modules from this directory are marked with *.
+#
+# Run from backend/:
+#   python -m devtools.importprofile
+#   python -m devtools.importprofile --top 40 --module security --json imports.json
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+from typing import Any, Dict, List
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# "import time:       self [us] |  cumulative | imported package"
+_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$")
+
+
+def run_importtime(module: str, python: str = sys.executable) -> str:
+    """stderr of a fresh interpreter importing module with -X importtime"""
+    result = subprocess.run(
+        [python, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BACKEND_DIR, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        tail = "\n".join(line for line in result.stderr.splitlines() if not line.startswith("import time:"))
+        raise RuntimeError(f"import {module} failed:\n{tail[-2000:]}")
+    return result.stderr
+
+def parse_importtime(report: str) -> List[Dict[str, Any]]:
+    """One entry per imported module: name, depth, self_us, cumulative_us"""
+    modules = []
+    for line in report.splitlines():
+        match = _LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            modules.append({
+                "name": name,
+                "depth": (len(indent) - 1) // 2,
+                "self_us": int(self_us),
+                "cumulative_us": int(cumulative_us),
+            })
+    return modules
+
+def is_first_party(name: str) -> bool:
+    top = name.split(".")[0]
+    return (os.path.exists(os.path.join(BACKEND_DIR, f"{top}.py"))
+            or os.path.isdir(os.path.join(BACKEND_DIR, top)))
+
+def summarize(modules: List[Dict[str, Any]], top: int) -> Dict[str, Any]:
+    packages: Dict[str, Dict[str, Any]] = {}
+    for module in modules:
+        name = module["name"].split(".")[0]
+        package = packages.setdefault(name, {"name": name, "self_us": 0, "modules": 0})
+        package["self_us"] += module["self_us"]
+        package["modules"] += 1
+
+    def ms(us: int) -> float:
+        return round(us / 1000, 1)
+
+    total_us = sum(module["self_us"] for module in modules)
+    by_package = sorted(packages.values(), key=lambda p: p["self_us"], reverse=True)
+    by_cumulative = sorted(modules, key=lambda m: m["cumulative_us"], reverse=True)
+    by_self = sorted(modules, key=lambda m: m["self_us"], reverse=True)
+    return {
+        "total_ms": ms(total_us),
+        "modules": len(modules),
+        "packages": [
+            {"name": p["name"], "self_ms": ms(p["self_us"]), "share": round(p["self_us"] / total_us, 3),
+             "modules": p["modules"], "first_party": is_first_party(p["name"])}
+            for p in by_package[:top]
+        ],
+        "slowest_cumulative": [
+            {"name": m["name"], "cumulative_ms": ms(m["cumulative_us"]), "self_ms": ms(m["self_us"])}
+            for m in by_cumulative[:top]
+        ],
+        "slowest_self": [
+            {"name": m["name"], "self_ms": ms(m["self_us"])}
+            for m in by_self[:top]
+        ],
+    }
+
+def print_summary(module: str, summary: Dict[str, Any]):
+    print(f"import {module}: {summary['total_ms']} ms over {summary['modules']} modules\n")
+    print(f"{'package':<32} {'self ms':>9} {'share':>7} {'modules':>8}")
+    for p in summary["packages"]:
+        name = p["name"] + (" *" if p["first_party"] else "")
+        print(f"{name:<32} {p['self_ms']:>9} {p['share'] * 100:>6.1f}% {p['modules']:>8}")
+    print(f"\n{'module':<48} {'cumul. ms':>10} {'self ms':>9}")
+    for m in summary["slowest_cumulative"]:
+        name = m["name"] + (" *" if is_first_party(m["name"]) else "")
+        print(f"{name:<48} {m['cumulative_ms']:>10} {m['self_ms']:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-module import cost of the API")
+    parser.add_argument("--module", default="main", help="Module to import (default: main)")
+    parser.add_argument("--top", type=int, default=25, help="Rows per table")
+    parser.add_argument("--runs", type=int, default=3, help="Imports to run; the fastest is reported")
+    parser.add_argument("--json", dest="output", help="Also write the summary to this JSON file")
+    args = parser.parse_args()
+
+    # The first run also warms the OS file cache and writes .pyc files; keep the fastest
+    best = None
+    for _ in range(max(1, args.runs)):
+        summary = summarize(parse_importtime(run_importtime(args.module)), args.top)
+        if best is None or summary["total_ms"] < best["total_ms"]:
+            best = summary
+    print_summary(args.module, best)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"module": args.module, **best}, f, indent=2)
+        print(f"\nSummary written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,42 @@
 """
-Email service for sending password reset emails using SendGrid
+Email service for password reset and welcome emails.
+Renders message bodies (templates/) and delivers them through a pluggable transport:
+SendGrid API, SMTP, or console output when no provider is configured.
+Handlers don't call these directly - they enqueue to the outbox (see outbox.py).
+send_bulk sends campaigns to many recipients per SendGrid request.
 """
 
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail, Email, To, Content
-from config import SENDGRID_API_KEY, EMAIL_FROM_ADDRESS, EMAIL_FROM_NAME, WEB_URL
+import asyncio
+import logging
+import smtplib
+from abc import ABC, abstractmethod
+from email.message import EmailMessage
+import time
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
 
+import httpx
+from config import (
+    EMAIL_FROM_ADDRESS, EMAIL_FROM_NAME, WEB_URL,
+    EMAIL_HOST, EMAIL_PORT, EMAIL_USERNAME, EMAIL_PASSWORD, EMAIL_USE_TLS,
+    EMAIL_BULK_REQUESTS_PER_SECOND
+)
+from templates import render
+from metrics import EMAIL_BULK_BATCH
+from resources import current
 
-def send_reset_email(to_email: str, to_name: str, reset_link: str):
+if TYPE_CHECKING:
+    from sendgrid.helpers.mail import Mail
+
+logger = logging.getLogger(__name__)
+
+# SendGrid accepts at most this many personalizations (recipients) per request
+SENDGRID_MAX_PERSONALIZATIONS = 1000
+
+
+def render_reset_email(to_name: str, reset_link: str) -> Dict[str, str]:
     """
-    Send password reset email using SendGrid API.
+    Build the password reset email.
     Uses HTTPS web link that redirects to app deep link.
-    Works reliably on any hosting platform including Render.
     """
     # Extract token from deep link and create web URL
     # Input: lucaapp://reset-password?token=xxx
@@ -23,190 +48,225 @@ def send_reset_email(to_email: str, to_name: str, reset_link: str):
         # Fallback if format is unexpected
         web_reset_link = reset_link
     
-    # Check if SendGrid is configured
-    if not SENDGRID_API_KEY:
-        print("⚠️  SendGrid not configured - check .env file")
-        print(f"   SENDGRID_API_KEY: {'✓ Set' if SENDGRID_API_KEY else '✗ Missing'}")
-        print(f"\n   Web reset link (for manual testing): {web_reset_link}\n")
-        print(f"   App deep link (for manual testing): {reset_link}\n")
-        return
+    html_content = render("reset_email.html", to_name=to_name, web_reset_link=web_reset_link)
+    text_content = render("reset_email.txt", to_name=to_name, web_reset_link=web_reset_link)
     
-    try:
-        print(f"\n📧 Sending password reset email via SendGrid...")
-        print(f"   From: {EMAIL_FROM_NAME} <{EMAIL_FROM_ADDRESS}>")
-        print(f"   To: {to_name} <{to_email}>")
-        print(f"   Web Link: {web_reset_link}")
-        
-        # Create HTML content
-        html_content = f'''
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <style>
-                body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
-                .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
-                .button {{ 
-                    display: inline-block; 
-                    padding: 12px 24px; 
-                    background-color: #D9B53E; 
-                    color: white !important; 
-                    text-decoration: none; 
-                    border-radius: 5px; 
-                    margin: 20px 0;
-                }}
-                .footer {{ margin-top: 30px; font-size: 12px; color: #666; }}
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <h2>Hi {to_name},</h2>
-                <p>You requested to reset your password for your Luca App account.</p>
-                <p>Click the button below to reset your password:</p>
-                <a href="{web_reset_link}" class="button">Reset Password</a>
-                <p>Or copy and paste this link:</p>
-                <p style="word-break: break-all; color: #666; font-size: 12px;">{web_reset_link}</p>
-                <p><strong>This link will expire in 1 hour.</strong></p>
-                <p>If you didn't request this reset, please ignore this email.</p>
-                <div class="footer">
-                    <p>Thanks,<br>The Luca App Team</p>
-                </div>
-            </div>
-        </body>
-        </html>
-        '''
-        
-        # Create plain text fallback
-        text_content = f'''
-        Hi {to_name},
-        
-        You requested to reset your password for your Luca App account.
-        
-        Click this link to reset your password:
-        {web_reset_link}
-        
-        This link will expire in 1 hour.
-        
-        If you didn't request this reset, please ignore this email.
-        
-        Thanks,
-        The Luca App Team
-        '''
-        
+    return {
+        "subject": "Reset Your Luca App Password",
+        "text": text_content,
+        "html": html_content,
+        "link": web_reset_link,
+    }
+
+
+def render_welcome_email(to_name: str) -> Dict[str, str]:
+    """
+    Build the welcome email for new users.
+    """
+    html_content = render("welcome_email.html", to_name=to_name)
+    text_content = render("welcome_email.txt", to_name=to_name)
+    
+    return {
+        "subject": "Welcome to Luca App!",
+        "text": text_content,
+        "html": html_content,
+    }
+
+
+# Templates the outbox can deliver, keyed by the name stored with each queued message
+RENDERERS = {
+    "reset": render_reset_email,
+    "welcome": render_welcome_email,
+}
+
+
+class EmailTransport(ABC):
+    """Delivers one rendered email; raises on failure so the outbox can retry"""
+
+    name = "base"
+
+    @abstractmethod
+    async def send(self, to_email: str, to_name: str, email: Dict[str, str]):
+        """Deliver email to to_email"""
+
+    async def close(self):
+        pass
+
+
+class SendGridClient:
+    """
+    Async SendGrid v3 client over one keep-alive HTTP connection pool.
+    Shared by single sends (SendGridTransport) and campaigns (send_bulk).
+    host can point at a local HTTP sink for testing.
+    """
+
+    def __init__(self, api_key: str, host: str, pool_size: int = 10, timeout: float = 30.0):
+        self.http = httpx.AsyncClient(
+            base_url=host,
+            headers={"Authorization": f"Bearer {api_key}"},
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        )
+
+    async def send(self, message: "Mail") -> httpx.Response:
+        response = await self.http.post("/v3/mail/send", json=message.get())
+        response.raise_for_status()
+        return response
+
+    async def aclose(self):
+        await self.http.aclose()
+
+
+class SendGridTransport(EmailTransport):
+    """SendGrid v3 API through the app's pooled client (Resources.sendgrid, closed with the app)"""
+
+    name = "sendgrid"
+
+    async def send(self, to_email: str, to_name: str, email: Dict[str, str]):
+        # Imported on first use: sendgrid (and the cryptography package it loads) only
+        # slows down the start of processes that never send through SendGrid
+        from sendgrid.helpers.mail import Mail, Email, To, Content
+
         # Create the email message
         message = Mail(
             from_email=Email(EMAIL_FROM_ADDRESS, EMAIL_FROM_NAME),
             to_emails=To(to_email, to_name),
-            subject='Reset Your Luca App Password',
-            plain_text_content=Content("text/plain", text_content),
-            html_content=Content("text/html", html_content)
+            subject=email["subject"],
+            plain_text_content=Content("text/plain", email["text"]),
+            html_content=Content("text/html", email["html"])
         )
         
         # Send email via SendGrid API
-        sg = SendGridAPIClient(SENDGRID_API_KEY)
-        response = sg.send(message)
-        
-        print(f"✅ Email sent successfully via SendGrid!")
-        print(f"   Status Code: {response.status_code}")
-        print(f"   Response: {response.body}\n")
+        response = await current().sendgrid.send(message)
+        logger.info("Email sent", extra={
+            "event": "email.sent", "transport": self.name, "to": to_email, "status_code": response.status_code
+        })
+
+
+class SMTPTransport(EmailTransport):
+    """Plain SMTP, e.g. Gmail or a local fake SMTP server for testing"""
+
+    name = "smtp"
+
+    def __init__(self, host: str, port: int, username: str, password: str, use_tls: bool):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+
+    def _send(self, to_email: str, to_name: str, email: Dict[str, str]):
+        message = EmailMessage()
+        message["From"] = f"{EMAIL_FROM_NAME} <{EMAIL_FROM_ADDRESS}>"
+        message["To"] = f"{to_name} <{to_email}>"
+        message["Subject"] = email["subject"]
+        message.set_content(email["text"])
+        message.add_alternative(email["html"], subtype="html")
         
-    except Exception as e:
-        print(f"❌ Error sending email via SendGrid: {str(e)}")
-        print(f"   Type: {type(e).__name__}")
-        print(f"\n   Web reset link (for manual testing): {web_reset_link}")
-        print(f"   App deep link: {reset_link}\n")
-        raise  # Re-raise to let the API endpoint handle it appropriately
+        with smtplib.SMTP(self.host, self.port, timeout=30) as smtp:
+            if self.use_tls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+            smtp.send_message(message)
+        logger.info("Email sent", extra={"event": "email.sent", "transport": self.name, "to": to_email})
+
+    async def send(self, to_email: str, to_name: str, email: Dict[str, str]):
+        await asyncio.to_thread(self._send, to_email, to_name, email)
+
+
+class ConsoleTransport(EmailTransport):
+    """Used when no provider is configured: logs the email instead of sending it"""
+
+    name = "console"
+
+    async def send(self, to_email: str, to_name: str, email: Dict[str, str]):
+        # The link is logged for manual testing; never use this transport in production
+        logger.warning("Email provider not configured - email not sent", extra={
+            "event": "email.not_sent", "to": to_email, "subject": email["subject"], "link": email.get("link")
+        })
 
 
-def send_welcome_email(to_email: str, to_name: str):
+def create_transport(name: str) -> EmailTransport:
+    if name == "sendgrid":
+        return SendGridTransport()
+    if name == "smtp":
+        return SMTPTransport(EMAIL_HOST, EMAIL_PORT, EMAIL_USERNAME, EMAIL_PASSWORD, EMAIL_USE_TLS)
+    if name == "console":
+        return ConsoleTransport()
+    raise ValueError(f"Unknown EMAIL_TRANSPORT: {name}")
+
+
+async def send_bulk(
+    recipients: List[Dict[str, Any]],
+    subject: str,
+    text: str,
+    html: str,
+    batch_size: int = SENDGRID_MAX_PERSONALIZATIONS,
+    requests_per_second: float = EMAIL_BULK_REQUESTS_PER_SECOND,
+    client: Optional[SendGridClient] = None,
+) -> Dict[str, Any]:
     """
-    Send welcome email to new users using SendGrid API.
+    Send one message to many recipients, batch_size recipients per SendGrid request.
+    Each recipient is {"email", "name", "substitutions": {...}}; "-name-" in the subject
+    and bodies is always replaced with the recipient's name, plus any substitutions given.
+    Requests are paced to at most requests_per_second, through client (default: the
+    app's pooled SendGrid client). Returns a per-batch report.
     """
-    # Check if SendGrid is configured
-    if not SENDGRID_API_KEY:
-        print("⚠️  SendGrid not configured - check .env file")
-        print(f"   SENDGRID_API_KEY: {'✓ Set' if SENDGRID_API_KEY else '✗ Missing'}")
-        print(f"\n   Welcome email not sent to {to_email}\n")
-        return
+    from sendgrid.helpers.mail import Mail, Email, To, Content, Personalization, Substitution
+
+    batch_size = max(1, min(batch_size, SENDGRID_MAX_PERSONALIZATIONS))
+    interval = 1.0 / requests_per_second if requests_per_second > 0 else 0.0
+    client = client or current().sendgrid
+    report = {"batches": [], "sent": 0, "failed": 0}
+    started = time.perf_counter()
+    next_request_at = started
     
-    try:
-        print(f"\n📧 Sending welcome email via SendGrid...")
-        print(f"   From: {EMAIL_FROM_NAME} <{EMAIL_FROM_ADDRESS}>")
-        print(f"   To: {to_name} <{to_email}>")
-        
-        # Create HTML content
-        html_content = f'''
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <style>
-                body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
-                .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
-                .header {{ background-color: #D9B53E; color: white; padding: 20px; text-align: center; border-radius: 5px 5px 0 0; }}
-                .content {{ background-color: #f9f9f9; padding: 20px; }}
-                .footer {{ margin-top: 30px; font-size: 12px; color: #666; text-align: center; }}
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <div class="header">
-                    <h1>Welcome to Luca App!</h1>
-                </div>
-                <div class="content">
-                    <h2>Hi {to_name},</h2>
-                    <p>Thank you for joining Luca App! We're excited to have you on board.</p>
-                    <p>Your account has been successfully created and you can now:</p>
-                    <ul>
-                        <li>Track your finances</li>
-                        <li>Manage your budget</li>
-                        <li>View detailed analytics</li>
-                    </ul>
-                    <p>If you have any questions or need assistance, feel free to reach out to our support team.</p>
-                </div>
-                <div class="footer">
-                    <p>Thanks,<br>The Luca App Team</p>
-                </div>
-            </div>
-        </body>
-        </html>
-        '''
-        
-        # Create plain text fallback
-        text_content = f'''
-        Welcome to Luca App!
-        
-        Hi {to_name},
-        
-        Thank you for joining Luca App! We're excited to have you on board.
-        
-        Your account has been successfully created and you can now:
-        - Track your finances
-        - Manage your budget
-        - View detailed analytics
-        
-        If you have any questions or need assistance, feel free to reach out to our support team.
-        
-        Thanks,
-        The Luca App Team
-        '''
-        
-        # Create the email message
+    for offset in range(0, len(recipients), batch_size):
+        batch = recipients[offset:offset + batch_size]
         message = Mail(
             from_email=Email(EMAIL_FROM_ADDRESS, EMAIL_FROM_NAME),
-            to_emails=To(to_email, to_name),
-            subject='Welcome to Luca App!',
-            plain_text_content=Content("text/plain", text_content),
-            html_content=Content("text/html", html_content)
+            subject=subject,
+            plain_text_content=Content("text/plain", text),
+            html_content=Content("text/html", html)
         )
+        for recipient in batch:
+            personalization = Personalization()
+            personalization.add_to(To(recipient["email"], recipient.get("name")))
+            substitutions = {"-name-": recipient.get("name") or "", **recipient.get("substitutions", {})}
+            for key, value in substitutions.items():
+                personalization.add_substitution(Substitution(key, str(value)))
+            message.add_personalization(personalization)
         
-        # Send email via SendGrid API
-        sg = SendGridAPIClient(SENDGRID_API_KEY)
-        response = sg.send(message)
+        # Stay within the requests-per-second budget
+        delay = next_request_at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        next_request_at = time.perf_counter() + interval
         
-        print(f"✅ Welcome email sent successfully via SendGrid!")
-        print(f"   Status Code: {response.status_code}")
-        print(f"   Response: {response.body}\n")
+        batch_started = time.perf_counter()
+        result = {"batch": len(report["batches"]), "recipients": len(batch)}
+        try:
+            response = await client.send(message)
+            result["status_code"] = response.status_code
+            report["sent"] += len(batch)
+        except httpx.HTTPStatusError as e:
+            result["status_code"] = e.response.status_code
+            result["error"] = f"HTTP {e.response.status_code}: {e.response.text[:200]}"
+            report["failed"] += len(batch)
+        except Exception as e:
+            result["error"] = f"{type(e).__name__}: {e}"
+            report["failed"] += len(batch)
+        elapsed = time.perf_counter() - batch_started
+        EMAIL_BULK_BATCH.labels("failed" if "error" in result else "sent").observe(elapsed)
+        result["seconds"] = round(elapsed, 3)
+        result["recipients_per_second"] = round(len(batch) / elapsed, 1) if elapsed else None
+        report["batches"].append(result)
         
-    except Exception as e:
-        print(f"❌ Error sending welcome email via SendGrid: {str(e)}")
-        print(f"   Type: {type(e).__name__}\n")
-        # Don't raise - welcome email is nice-to-have, not critical
\ No newline at end of file
+        logger.log(logging.WARNING if "error" in result else logging.INFO, "Bulk email batch sent",
+                   extra={"event": "email.bulk_batch", **result})
+    
+    total = time.perf_counter() - started
+    report["seconds"] = round(total, 3)
+    report["recipients_per_second"] = round(report["sent"] / total, 1) if total else None
+    return report
\ No newline at end of file
@@ -0,0 +1,101 @@
+# Background rewrite of hex-encoded password hashes in the native format
+#
+# Accounts created before passwords.py stored hashes as-is hold the hex encoding
+# of a bcrypt hash: 120 characters instead of 60, and an extra decode on every
+# login. A login rewrites its own row; this job rewrites the rest. It walks
+# userAccount by id in batches, one round trip per batch through the
+# convert_hex_password_hashes function, or, if that is not installed, one read
+# per batch plus one conditional update per row. Only rows whose password starts
+# with the hex of "$" are read (a partial index, see sql/indexes.sql). It runs once
+# after startup, is skipped after one query when no such row is left, and stops at
+# the end of the table. Converting is idempotent, so it is safe for several workers
+# to run it at once.
+
+import asyncio
+import logging
+import random
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import repository
+from passwords import decode_stored
+
+logger = logging.getLogger(__name__)
+
+# Upper bound of the random pause between two batches, in seconds
+BATCH_PAUSE_SECONDS = 0.5
+
+
+class PasswordHashMigration:
+    """Converts hex-encoded password hashes to the native format, batch by batch"""
+
+    def __init__(self, batch_size: int):
+        self.batch_size = batch_size
+        self.counters: Dict[str, int] = {"batches": 0, "converted": 0, "errors": 0}
+        self.last_id = 0
+        self.finished = False
+        self.seconds: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def _fallback_batch(self, after_id: int) -> Tuple[Optional[int], int, bool]:
+        rows = await repository.hex_password_rows(after_id, self.batch_size)
+        converted = 0
+        for row in rows:
+            kind, password_hash = decode_stored(row["password"])
+            if kind == "hex" and await repository.replace_password_hash(row["id"], row["password"], password_hash):
+                converted += 1
+        last_id = rows[-1]["id"] if rows else None
+        return last_id, converted, len(rows) < self.batch_size
+
+    async def run_batch(self, after_id: int) -> bool:
+        """Convert one batch after after_id and advance last_id; returns True when done"""
+        result = await repository.convert_hex_password_hashes(after_id, self.batch_size)
+        if result is None:
+            result = await self._fallback_batch(after_id)
+        last_id, converted, done = result
+        if last_id is not None:
+            self.last_id = last_id
+        self.counters["batches"] += 1
+        self.counters["converted"] += converted
+        return done
+
+    async def run(self):
+        started = time.perf_counter()
+        if await repository.has_hex_passwords():
+            while not await self.run_batch(self.last_id):
+                await asyncio.sleep(random.uniform(0, BATCH_PAUSE_SECONDS))
+        self.finished = True
+        self.seconds = round(time.perf_counter() - started, 3)
+        logger.info("Password hash migration finished", extra={
+            "event": "password_migration.finished", **self.counters, "seconds": self.seconds
+        })
+
+    async def _run(self):
+        try:
+            await self.run()
+        except Exception:
+            # Not retried until the next start; logins still convert their own rows
+            self.counters["errors"] += 1
+            logger.exception("Password hash migration failed", extra={"last_id": self.last_id})
+
+    async def start(self):
+        if self._task is None and not self.finished:
+            self._task = asyncio.create_task(self._run(), name="password-hash-migration")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "finished": self.finished,
+            **self.counters,
+            "last_id": self.last_id,
+            "seconds": self.seconds,
+        }
@@ -0,0 +1,18 @@
+# HTTP validators shared by endpoints that support conditional GET (ETag / If-None-Match)
+
+import hashlib
+
+from fastapi import Request
+
+
+def etag_for(data: bytes) -> str:
+    """Strong ETag derived from the content bytes"""
+    return '"' + hashlib.sha256(data).hexdigest()[:32] + '"'
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """True if the request's If-None-Match covers etag (weak comparison, as RFC 9110 requires)"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return "*" in candidates or etag in candidates
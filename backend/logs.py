@@ -0,0 +1,196 @@
+# Logging setup: non-blocking, structured (JSON) logs with request ids
+#
+# Modules log through the standard library (logger = logging.getLogger(__name__)).
+# setup_logging() puts a QueueHandler on the root logger, so a log call only
+# appends the record to an in-memory queue; a QueueListener thread formats and
+# writes it to stdout. Request handlers never wait on stdout.
+#
+# Structured fields go in `extra`, e.g.
+#     logger.info("Login successful", extra={"event": "login.success", "account_id": 42})
+# Records whose `event` has a rate in LOG_SAMPLE_RATES are sampled (warnings and
+# errors never are). Every record carries the id of the request that produced it.
+
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import queue
+import random
+import sys
+import traceback
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+
+from config import LOG_LEVEL, LOG_LEVELS, LOG_FORMAT, LOG_SAMPLE_RATES, LOG_CAPTURE_UVICORN
+
+# Id of the request being handled in the current task ("-" outside requests)
+request_id_var: contextvars.ContextVar[str] = contextvars.ContextVar("request_id", default="-")
+
+# Attributes every LogRecord has; anything else on a record came from `extra`
+# (uvicorn's color_message duplicates the message with terminal escapes)
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "color_message"}
+
+# Third-party loggers that are chatty at INFO (httpx logs every request); LOG_LEVELS overrides
+DEFAULT_LEVELS = {"httpx": "WARNING", "httpcore": "WARNING", "hpack": "WARNING"}
+
+_listener: Optional[QueueListener] = None
+
+
+def parse_levels(spec: str) -> Dict[str, str]:
+    """Parse "routes.auth=DEBUG,outbox=WARNING" into {logger name: level}"""
+    levels = {}
+    for item in spec.split(","):
+        name, _, level = item.partition("=")
+        if name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+def parse_rates(spec: str) -> Dict[str, float]:
+    """Parse "login.success=0.1" into {event: fraction of records kept}"""
+    return {event: float(rate) for event, rate in parse_levels(spec).items()}
+
+
+class RequestContextFilter(logging.Filter):
+    """Stamps records with the current request id (runs in the caller, before queueing)"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps only a fraction of the records for high-volume events"""
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = self.rates.get(getattr(record, "event", None))
+        if rate is None or record.levelno >= logging.WARNING:
+            return True
+        if random.random() >= rate:
+            return False
+        record.sample_rate = rate
+        return True
+
+
+class _QueueHandler(QueueHandler):
+    # The default prepare() folds the traceback into the message; keep it separate
+    # so the JSON formatter can put it in its own field
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        if record.exc_info:
+            record.exc_text = "".join(traceback.format_exception(*record.exc_info))
+        record.msg, record.args, record.exc_info = record.message, None, None
+        return record
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, request_id, message, then extra fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        out = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and key not in out:
+                out[key] = value
+        if record.exc_text:
+            out["exception"] = record.exc_text
+        return json.dumps(out, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Human-readable lines for local development (LOG_FORMAT=text)"""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s %(name)s [%(request_id)s] %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        record.request_id = getattr(record, "request_id", "-")
+        line = super().format(record)
+        fields = {k: v for k, v in vars(record).items() if k not in _RECORD_ATTRIBUTES and k != "request_id"}
+        if fields:
+            line += " " + " ".join(f"{k}={v}" for k, v in fields.items())
+        return line
+
+
+def setup_logging():
+    """Route all logging through a queue to a background writer thread (idempotent)"""
+    global _listener
+    if _listener is not None:
+        return
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    handler = _QueueHandler(log_queue)
+    handler.addFilter(RequestContextFilter())
+    handler.addFilter(SamplingFilter(parse_rates(LOG_SAMPLE_RATES)))
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(TextFormatter() if LOG_FORMAT == "text" else JSONFormatter())
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(LOG_LEVEL.upper())
+    for name, level in {**DEFAULT_LEVELS, **parse_levels(LOG_LEVELS)}.items():
+        logging.getLogger(name).setLevel(level)
+
+    if LOG_CAPTURE_UVICORN:
+        # uvicorn installs its own stream handlers; send its records through the queue too
+        for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+            uvicorn_logger = logging.getLogger(name)
+            uvicorn_logger.handlers = []
+            uvicorn_logger.propagate = True
+
+    _listener = QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    # Flush whatever is still queued when the process exits
+    atexit.register(stop_logging)
+
+def stop_logging():
+    """Flush queued records and stop the writer thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class RequestIdMiddleware:
+    """
+    ASGI middleware that gives every request an id (the client's X-Request-ID if
+    it sent one) for log records, and echoes it in the response headers.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:64]
+                break
+        request_id = request_id or uuid.uuid4().hex[:16]
+        token = request_id_var.set(request_id)
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            request_id_var.reset(token)
@@ -0,0 +1,257 @@
+# Event loop lag and blocking-call detector (LOOP_MONITOR_ENABLED=true)
+#
+# A task on the event loop wakes up every interval and records how late it ran:
+# that is the event loop lag. A watchdog thread checks the task's heartbeat. If the
+# loop has not come back for longer than the threshold, something is running
+# synchronously on it (a blocking client call, bcrypt, a large JSON dump), so the
+# watchdog captures the loop thread's stack while the stall is still happening.
+# From the stack it takes the call site, which is the innermost frame in our code.
+# From the task that was running it takes the route and request id. When the loop
+# resumes, the stall is logged, counted in /metrics and kept for
+# /admin/diagnostics.
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from logs import request_id_var
+from metrics import EVENT_LOOP_LAG, EVENT_LOOP_BLOCKS, route_label
+from resources import current
+
+logger = logging.getLogger(__name__)
+
+# Frames from files under this directory are "our code" when picking the call site
+_THIS_FILE = os.path.abspath(__file__)
+APP_ROOT = os.path.dirname(_THIS_FILE)
+
+# Innermost frames kept per captured stack
+STACK_LIMIT = 40
+
+# Recent lag samples kept for percentiles (one minute at the default interval)
+LAG_WINDOW = 1200
+
+
+def _percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100))]
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000, 1)
+
+def _describe_frame(frame: traceback.FrameSummary) -> str:
+    filename = frame.filename
+    if filename.startswith(APP_ROOT + os.sep):
+        filename = os.path.relpath(filename, APP_ROOT)
+    line = f"{filename}:{frame.lineno} in {frame.name}"
+    return f"{line}: {frame.line}" if frame.line else line
+
+
+class LoopMonitor:
+    """Samples event loop lag and captures the stack behind every stall longer than threshold"""
+
+    def __init__(self, interval: float, threshold: float, max_reports: int):
+        self.interval = interval
+        self.threshold = threshold
+        self.lag_samples: Deque[float] = deque(maxlen=LAG_WINDOW)
+        self.max_lag = 0.0
+        self.blocks = 0
+        self.blocked_seconds = 0.0
+        self.reports: Deque[Dict[str, Any]] = deque(maxlen=max_reports)
+        # (route or task, call site) -> {"count", "total_seconds", "max_seconds"}
+        self.call_sites: Dict[tuple, Dict[str, float]] = {}
+        # Tasks currently handling a request -> (ASGI scope, request id), kept by LoopMonitorMiddleware
+        self.active: Dict[asyncio.Task, tuple] = {}
+        self._lock = threading.Lock()
+        self._pending: Optional[Dict[str, Any]] = None
+        self._last_tick = 0.0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+
+    # Event loop side
+    async def _sample(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._last_tick = now
+            self.record_lag(max(0.0, now - expected))
+
+    def record_lag(self, lag: float):
+        self.lag_samples.append(lag)
+        if lag > self.max_lag:
+            self.max_lag = lag
+        EVENT_LOOP_LAG.observe(lag)
+        if lag >= self.threshold:
+            self._finish_block(lag)
+
+    def _finish_block(self, lag: float):
+        with self._lock:
+            report, self._pending = self._pending, None
+        if report is None:
+            # The watchdog did not see the stall, e.g. lag from many short steps in a row
+            report = {"at": time.time(), "route": None, "task": None, "request_id": None,
+                      "call_site": None, "innermost": None, "stack": []}
+        report["duration_ms"] = _ms(lag)
+
+        self.blocks += 1
+        self.blocked_seconds += lag
+        where = report["route"] or report["task"] or "unknown"
+        site = self.call_sites.setdefault(
+            (where, report["call_site"]), {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+        site["count"] += 1
+        site["total_seconds"] += lag
+        site["max_seconds"] = max(site["max_seconds"], lag)
+        self.reports.append(report)
+        EVENT_LOOP_BLOCKS.labels(where).inc()
+
+        logger.warning("Event loop blocked", extra={
+            "event": "loop.blocked",
+            "duration_ms": report["duration_ms"],
+            "route": report["route"],
+            "task": report["task"],
+            "blocked_request_id": report["request_id"],
+            "call_site": report["call_site"],
+            "innermost": report["innermost"],
+            "stack": "\n".join(report["stack"]),
+        })
+
+    # Watchdog thread side
+    def _watch(self):
+        check_every = min(self.threshold / 2, 0.05)
+        reported_tick = None
+        while not self._stopping.wait(check_every):
+            last_tick = self._last_tick
+            if last_tick == reported_tick:
+                continue
+            if time.monotonic() - last_tick - self.interval < self.threshold:
+                continue
+            # The loop is still stuck: capture what it is running now, once per stall
+            reported_tick = last_tick
+            report = self._capture()
+            with self._lock:
+                self._pending = report
+
+    def _capture(self) -> Dict[str, Any]:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        stack = traceback.extract_stack(frame, limit=STACK_LIMIT) if frame is not None else []
+        ours = [f for f in stack if f.filename.startswith(APP_ROOT + os.sep) and f.filename != _THIS_FILE]
+
+        try:
+            task = asyncio.current_task(self._loop)
+        except RuntimeError:
+            task = None
+        route = request_id = None
+        scope_entry = self.active.get(task) if task is not None else None
+        if scope_entry is not None:
+            scope, request_id = scope_entry
+            route = f"{scope['method']} {route_label(scope)}"
+
+        return {
+            "at": time.time(),
+            "route": route,
+            "task": task.get_name() if task is not None else None,
+            "request_id": request_id,
+            "call_site": _describe_frame(ours[-1]) if ours else None,
+            "innermost": _describe_frame(stack[-1]) if stack else None,
+            "stack": [_describe_frame(f) for f in stack],
+        }
+
+    # Lifecycle
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    async def start(self):
+        if self._task is None:
+            self._loop = asyncio.get_running_loop()
+            self._loop_thread_id = threading.get_ident()
+            self._last_tick = time.monotonic()
+            self._stopping.clear()
+            self._task = asyncio.create_task(self._sample(), name="loop-monitor")
+            self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+            self._watchdog.start()
+            logger.info("Event loop monitor started", extra={
+                "event": "loop.monitor_started",
+                "interval_ms": _ms(self.interval),
+                "threshold_ms": _ms(self.threshold),
+            })
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self._stopping.set()
+            self._watchdog.join(timeout=1)
+            self._watchdog = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "blocks": self.blocks,
+            "max_lag_ms": _ms(self.max_lag),
+        }
+
+    def summary(self, top: int = 10, recent: int = 10) -> Dict[str, Any]:
+        """Lag percentiles, the call sites that blocked the loop longest, and the latest stalls"""
+        lags = sorted(self.lag_samples)
+        call_sites = sorted(self.call_sites.items(), key=lambda item: item[1]["total_seconds"], reverse=True)
+        return {
+            "running": self.running,
+            "interval_ms": _ms(self.interval),
+            "threshold_ms": _ms(self.threshold),
+            "lag": {
+                "samples": len(lags),
+                "p50_ms": _ms(_percentile(lags, 50)),
+                "p99_ms": _ms(_percentile(lags, 99)),
+                "max_ms": _ms(lags[-1] if lags else 0.0),
+                "max_ms_since_start": _ms(self.max_lag),
+            },
+            "blocks": self.blocks,
+            "blocked_ms": _ms(self.blocked_seconds),
+            "top_call_sites": [
+                {
+                    "route": where,
+                    "call_site": call_site,
+                    "count": site["count"],
+                    "total_ms": _ms(site["total_seconds"]),
+                    "max_ms": _ms(site["max_seconds"]),
+                }
+                for (where, call_site), site in call_sites[:top]
+            ],
+            "recent": list(self.reports)[-recent:][::-1],
+        }
+
+
+class LoopMonitorMiddleware:
+    """ASGI middleware recording which request each task is handling, so stalls can name their route"""
+
+    def __init__(self, app, monitor: Optional[LoopMonitor] = None):
+        self.app = app
+        self.monitor = monitor
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        # Looked up per request: the app's monitor is created by the lifespan, after the middleware
+        monitor = self.monitor or current().loop_monitor
+        task = asyncio.current_task()
+        monitor.active[task] = (scope, request_id_var.get())
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            monitor.active.pop(task, None)
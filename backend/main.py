@@ -1,17 +1,65 @@
 # Main application file that brings together all modules.
 
-from fastapi import FastAPI
+# First, so the cold start timing covers every import below
+from coldstart import startup_timer
+
+import logging
+from contextlib import asynccontextmanager
+
+from fastapi import Depends, FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+from config import API_TITLE, API_VERSION, SENDGRID_API_KEY, EMAIL_FROM_ADDRESS, LOOP_MONITOR_ENABLED
+from logs import setup_logging, RequestIdMiddleware
+from metrics import registry, MetricsMiddleware
+
+# Configure logging before the other modules start emitting records
+setup_logging()
+logger = logging.getLogger(__name__)
 
-from config import API_TITLE, API_VERSION, SENDGRID_API_KEY, EMAIL_FROM_ADDRESS
 from database import init_database
+from resources import Resources, current
+from dependencies import get_resources, bind_resources
+from workerpool import PoolSaturatedError
+from loopmonitor import LoopMonitorMiddleware
 
 # Import routers
 from routes import auth, accounts, admin
 import redirectendpoints
 
+startup_timer.mark("import")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create the app's resources (pools, caches, background tasks) at startup and close them at shutdown"""
+    startup_timer.mark("server")
+    init_database()
+    startup_timer.mark("database")
+    # Tests may set app.state.resources beforehand to run against fakes
+    resources = getattr(app.state, "resources", None) or Resources.from_config()
+    await resources.start()
+    app.state.resources = resources
+    
+    if SENDGRID_API_KEY:
+        logger.info("Email service: SendGrid", extra={"from": EMAIL_FROM_ADDRESS})
+    else:
+        logger.warning("Email service not configured: set SENDGRID_API_KEY (see SENDGRID_SETUP_GUIDE.md)")
+    
+    startup_timer.mark("startup")
+    logger.info("Luca App API started", extra={
+        "event": "startup", "version": API_VERSION, "docs": "/docs", **startup_timer.summary()
+    })
+    try:
+        yield
+    finally:
+        logger.info("Luca App API shutting down", extra={"event": "shutdown"})
+        # Background tasks stop first, then the pools they use are drained and closed
+        await resources.close()
+        del app.state.resources
+
 # Create FastAPI app
-app = FastAPI(title=API_TITLE, version=API_VERSION)
+app = FastAPI(title=API_TITLE, version=API_VERSION, lifespan=lifespan, dependencies=[Depends(bind_resources)])
 
 # CORS middleware to allow iOS app to connect
 app.add_middleware(
@@ -20,8 +68,28 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID", "ETag"],
 )
 
+# Lets the event loop monitor attribute stalls to the route being handled
+if LOOP_MONITOR_ENABLED:
+    app.add_middleware(LoopMonitorMiddleware)
+
+# Latency, status code and in-flight metrics for /metrics
+app.add_middleware(MetricsMiddleware)
+
+# Request ids for log records (outermost, so every log line of a request carries it)
+app.add_middleware(RequestIdMiddleware)
+
+@app.exception_handler(PoolSaturatedError)
+async def pool_saturated_handler(request: Request, exc: PoolSaturatedError):
+    # Shed load instead of queueing unbounded work behind a full worker pool
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Server is busy, please retry shortly"},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
 # Include routers
 app.include_router(auth.router)
 app.include_router(accounts.router)
@@ -39,42 +107,30 @@ async def root():
     }
 
 @app.get("/health")
-def health_check():
+def health_check(resources: Resources = Depends(get_resources)):
     """Health check endpoint for monitoring"""    
     return {
         "status": "healthy",
-        "email_service": "sendgrid" if SENDGRID_API_KEY else "not_configured"
+        "email_service": "sendgrid" if SENDGRID_API_KEY else "not_configured",
+        **resources.stats(),
+        "startup": startup_timer.summary(),
     }
 
-@app.on_event("startup")
-async def startup_event():
-    """Initialize database and check configuration on startup"""
-    init_database()
-    print("\n" + "="*60)
-    print("🚀 Luca App API Starting...")
-    print("="*60)
-    print(f"📦 Version: {API_VERSION}")
-    print(f"🔐 Security: Enabled")
-    
-    # Check SendGrid configuration
-    if SENDGRID_API_KEY:
-        print(f"📧 Email Service: SendGrid ✅")
-        print(f"   From: {EMAIL_FROM_ADDRESS}")
-    else:
-        print(f"⚠️  Email Service: NOT CONFIGURED")
-        print(f"   Set SENDGRID_API_KEY in your .env file")
-        print(f"   See SENDGRID_SETUP_GUIDE.md for instructions")
-    
-    print("="*60)
-    print("✅ Luca App API started successfully")
-    print("📚 API docs available at: http://localhost:6769/docs")
-    print("="*60 + "\n")
+# Gauges read from component state when /metrics is scraped
+registry.callback_gauge(
+    "cache_entries", "Entries in the in-process caches",
+    lambda: {("token",): len(current().token_cache), ("account",): len(current().account_cache)}, ("cache",))
+registry.callback_gauge(
+    "worker_pool_in_flight", "Calls running or queued on a worker pool",
+    lambda: {(current().hash_pool.name,): current().hash_pool.in_flight}, ("pool",))
 
-@app.on_event("shutdown")
-async def shutdown_event():
-    """Cleanup on shutdown"""
-    print("\n👋 Luca App API shutting down...")
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus text exposition of this worker process's metrics"""
+    # async so rendering runs on the event loop, which is the only writer of the metrics
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
+# Single-process development server; production runs serve.py (several workers)
 if __name__ == "__main__":
     import uvicorn
     import os
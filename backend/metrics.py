@@ -0,0 +1,300 @@
+# In-process metrics in the Prometheus text exposition format (served at /metrics)
+#
+# Counters, gauges and fixed-bucket histograms with labels. Every update happens on
+# the event loop thread (the worker pool reports bcrypt timings after the await),
+# so recording is a dict lookup plus a few arithmetic operations, with no locks.
+# Histogram buckets are stored per bucket and only made cumulative when scraped.
+# Each worker process keeps its own metrics.
+
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Tuple
+
+# Latency buckets in seconds, from sub-millisecond cache hits up to slow bcrypt/SMTP calls
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+
+    @abstractmethod
+    def _new_child(self):
+        """A new series for one set of label values"""
+
+    def labels(self, *values) -> object:
+        """The series for these label values (created on first use)"""
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            child = self._children[key] = self._new_child()
+        return child
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, child in sorted(self._children.items()):
+            lines.extend(self._render_child(key, child))
+        return lines
+
+    def _render_child(self, key, child) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(child.value)}"]
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1):
+        self._children[()].inc(amount)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1):
+        self._children[()].inc(amount)
+
+    def dec(self, amount: float = 1):
+        self._children[()].dec(amount)
+
+    def set(self, value: float):
+        self._children[()].set(value)
+
+
+class CallbackGauge(_Metric):
+    """Gauge read from fn() at scrape time; fn returns a number, or {label values tuple: number}"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, fn: Callable, labelnames: Iterable[str] = ()):
+        self.fn = fn
+        super().__init__(name, help, labelnames)
+
+    def _new_child(self):
+        return _Value()
+
+    def render(self) -> List[str]:
+        value = self.fn()
+        samples = value if isinstance(value, dict) else {(): value}
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, sample in sorted(samples.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(sample)}")
+        return lines
+
+
+class _HistogramSeries:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self) -> "_Timer":
+        return _Timer(self)
+
+
+class _Timer:
+    """Context manager observing the elapsed time of its block"""
+
+    __slots__ = ("series", "started")
+
+    def __init__(self, series: _HistogramSeries):
+        self.series = series
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.series.observe(time.perf_counter() - self.started)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames)
+
+    def _new_child(self):
+        return _HistogramSeries(self.buckets)
+
+    def observe(self, value: float):
+        self._children[()].observe(value)
+
+    def _render_child(self, key, child: _HistogramSeries) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+            cumulative += count
+            labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+        lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self.register(Gauge(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Iterable[str] = (),
+                  buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def callback_gauge(self, name: str, help: str, fn: Callable, labelnames: Iterable[str] = ()) -> CallbackGauge:
+        return self.register(CallbackGauge(name, help, fn, labelnames))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# Metrics recorded across modules
+HTTP_REQUESTS = registry.counter(
+    "http_requests_total", "HTTP requests by method, route template and status code",
+    ("method", "route", "status"))
+HTTP_DURATION = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency by method and route template",
+    ("method", "route"))
+HTTP_IN_FLIGHT = registry.gauge(
+    "http_requests_in_flight", "HTTP requests currently being handled")
+DB_REQUESTS = registry.counter(
+    "db_requests_total", "Supabase (PostgREST) requests by method, resource and status code",
+    ("method", "resource", "status"))
+DB_DURATION = registry.histogram(
+    "db_request_duration_seconds", "Supabase (PostgREST) request latency until response headers",
+    ("method", "resource"))
+POOL_RUN = registry.histogram(
+    "worker_pool_run_seconds", "Time spent running a call on a worker pool (bcrypt hash/verify)",
+    ("pool", "operation"))
+POOL_WAIT = registry.histogram(
+    "worker_pool_queue_wait_seconds", "Time a call waited for a free worker",
+    ("pool", "operation"))
+POOL_REJECTED = registry.counter(
+    "worker_pool_rejected_total", "Calls rejected because the pool backlog was full",
+    ("pool",))
+EMAIL_SEND = registry.histogram(
+    "email_send_duration_seconds", "Email delivery attempt latency by transport and outcome",
+    ("transport", "outcome"))
+EMAIL_BULK_BATCH = registry.histogram(
+    "email_bulk_batch_duration_seconds", "Bulk email batch request latency by outcome",
+    ("outcome",))
+EVENT_LOOP_LAG = registry.histogram(
+    "event_loop_lag_seconds", "How late the event loop monitor's periodic wake-up ran (LOOP_MONITOR_ENABLED)")
+EVENT_LOOP_BLOCKS = registry.counter(
+    "event_loop_blocks_total", "Event loop stalls longer than LOOP_BLOCK_THRESHOLD_SECONDS by route or task",
+    ("route",))
+
+
+def route_label(scope) -> str:
+    """Route template for a handled request (e.g. /accounts/{account_id}), to keep label cardinality low"""
+    route = scope.get("route")
+    path = getattr(route, "path", None)
+    return path if path else "unmatched"
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording per-route latency, status codes and in-flight requests"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = {"code": 500}
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            HTTP_IN_FLIGHT.dec()
+            method, route = scope["method"], route_label(scope)
+            HTTP_DURATION.labels(method, route).observe(elapsed)
+            HTTP_REQUESTS.labels(method, route, status["code"]).inc()
+
+
+def resource_label(path: str, base_path: str) -> str:
+    """PostgREST resource from a request path: the table name, or rpc/<function>"""
+    resource = path[len(base_path):] if path.startswith(base_path) else path
+    return resource.strip("/") or "/"
@@ -58,6 +58,11 @@ class AccountResponse(BaseModel):
     phone: str
     date_of_birth: str
 
+class SessionResponse(BaseModel):
+    id: int
+    expires_at: str
+    current: bool
+
 class AccountLogin(BaseModel):
     email: EmailStr
     password: str
@@ -66,6 +71,14 @@ class LoginResponse(BaseModel):
     message: str
     token: str
     account: AccountResponse
+    # Only set when TOKEN_MODE=signed
+    refresh_token: Optional[str] = None
+    expires_in: Optional[int] = None
+
+class RefreshResponse(BaseModel):
+    token: str
+    refresh_token: str
+    expires_in: int
 
 class ForgotPasswordRequest(BaseModel):
     email: EmailStr
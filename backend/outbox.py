@@ -0,0 +1,274 @@
+# Email outbox: request handlers enqueue messages and return immediately,
+# a background asyncio worker delivers them with retries and exponential backoff.
+# Messages that still fail after EMAIL_MAX_ATTEMPTS go to a dead-letter list.
+
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import random
+import sqlite3
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+from config import EMAIL_OUTBOX_SQLITE_PATH
+from emailservice import RENDERERS, EmailTransport
+from logs import request_id_var
+from metrics import EMAIL_SEND
+
+logger = logging.getLogger(__name__)
+
+# How many messages the worker takes per pass, and how many it sends at once
+BATCH_SIZE = 20
+SEND_CONCURRENCY = 5
+
+
+class MemoryOutboxStore:
+    """Outbox kept in process memory; pending messages are lost on restart"""
+
+    def __init__(self, dead_letter_limit: int = 1000):
+        self._queue: list = []
+        self._seq = itertools.count()
+        self._dead: deque = deque(maxlen=dead_letter_limit)
+
+    async def put(self, message: Dict[str, Any], due: float):
+        message.setdefault("id", next(self._seq))
+        heapq.heappush(self._queue, (due, message["id"], message))
+
+    async def claim(self, now: float, limit: int) -> List[Dict[str, Any]]:
+        claimed = []
+        while self._queue and self._queue[0][0] <= now and len(claimed) < limit:
+            claimed.append(heapq.heappop(self._queue)[2])
+        return claimed
+
+    async def complete(self, message: Dict[str, Any]):
+        pass
+
+    async def reschedule(self, message: Dict[str, Any], due: float):
+        heapq.heappush(self._queue, (due, message["id"], message))
+
+    async def bury(self, message: Dict[str, Any]):
+        self._dead.append(message)
+
+    async def next_due(self) -> Optional[float]:
+        return self._queue[0][0] if self._queue else None
+
+    async def dead_letters(self, limit: int = 100) -> List[Dict[str, Any]]:
+        return list(self._dead)[-limit:]
+
+    async def close(self):
+        pass
+
+
+class SQLiteOutboxStore:
+    """Outbox in a SQLite file; survives restarts and can be shared by workers on one host"""
+
+    # A message claimed longer ago than this is assumed lost (worker crashed) and is retried
+    CLAIM_TIMEOUT_SECONDS = 300
+
+    def __init__(self, path: str):
+        self._lock = asyncio.Lock()
+        self._conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS email_outbox ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, payload TEXT NOT NULL, "
+            "attempts INTEGER NOT NULL DEFAULT 0, last_error TEXT, "
+            "status TEXT NOT NULL DEFAULT 'pending', due REAL NOT NULL, claimed_at REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS email_outbox_status_due ON email_outbox (status, due)")
+
+    async def _run(self, sql: str, params: tuple = ()) -> list:
+        async with self._lock:
+            return await asyncio.to_thread(lambda: self._conn.execute(sql, params).fetchall())
+
+    @staticmethod
+    def _payload(message: Dict[str, Any]) -> str:
+        return json.dumps({k: message.get(k) for k in ("template", "to_email", "to_name", "context", "request_id")})
+
+    async def put(self, message: Dict[str, Any], due: float):
+        await self._run("INSERT INTO email_outbox (payload, due) VALUES (?, ?)", (self._payload(message), due))
+
+    async def claim(self, now: float, limit: int) -> List[Dict[str, Any]]:
+        rows = await self._run(
+            "UPDATE email_outbox SET status = 'sending', claimed_at = ? WHERE id IN ("
+            "SELECT id FROM email_outbox WHERE (status = 'pending' AND due <= ?) "
+            "OR (status = 'sending' AND claimed_at < ?) ORDER BY due LIMIT ?"
+            ") RETURNING id, payload, attempts, last_error",
+            (now, now, now - self.CLAIM_TIMEOUT_SECONDS, limit)
+        )
+        return [
+            {"id": row[0], **json.loads(row[1]), "attempts": row[2], "last_error": row[3]}
+            for row in rows
+        ]
+
+    async def complete(self, message: Dict[str, Any]):
+        await self._run("DELETE FROM email_outbox WHERE id = ?", (message["id"],))
+
+    async def reschedule(self, message: Dict[str, Any], due: float):
+        await self._run(
+            "UPDATE email_outbox SET status = 'pending', due = ?, attempts = ?, last_error = ? WHERE id = ?",
+            (due, message["attempts"], message["last_error"], message["id"])
+        )
+
+    async def bury(self, message: Dict[str, Any]):
+        await self._run(
+            "UPDATE email_outbox SET status = 'dead', attempts = ?, last_error = ? WHERE id = ?",
+            (message["attempts"], message["last_error"], message["id"])
+        )
+
+    async def next_due(self) -> Optional[float]:
+        rows = await self._run("SELECT MIN(due) FROM email_outbox WHERE status = 'pending'")
+        return rows[0][0] if rows else None
+
+    async def dead_letters(self, limit: int = 100) -> List[Dict[str, Any]]:
+        rows = await self._run(
+            "SELECT id, payload, attempts, last_error FROM email_outbox WHERE status = 'dead' ORDER BY id DESC LIMIT ?",
+            (limit,)
+        )
+        return [
+            {"id": row[0], **json.loads(row[1]), "attempts": row[2], "last_error": row[3]}
+            for row in rows
+        ]
+
+    async def close(self):
+        self._conn.close()
+
+
+class Outbox:
+    """Queue of emails plus the background worker that drains it"""
+
+    def __init__(self, store, transport: EmailTransport, max_attempts: int,
+                 retry_base: float, retry_max: float, poll_interval: float = 5.0):
+        self.store = store
+        self.transport = transport
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.poll_interval = poll_interval
+        self.counters = {"enqueued": 0, "sent": 0, "retried": 0, "dead_lettered": 0}
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task: Optional[asyncio.Task] = None
+
+    async def enqueue(self, template: str, to_email: str, to_name: str, **context):
+        """Queue an email for background delivery; returns without waiting for the provider"""
+        message = {
+            "template": template,
+            "to_email": to_email,
+            "to_name": to_name,
+            "context": context,
+            "attempts": 0,
+            "last_error": None,
+            # Logged with every delivery attempt so they can be traced back to the request
+            "request_id": request_id_var.get(),
+        }
+        await self.store.put(message, time.time())
+        self.counters["enqueued"] += 1
+        self._wakeup.set()
+
+    def backoff(self, attempts: int) -> float:
+        """Delay before retry number `attempts`: exponential, capped, with jitter"""
+        delay = min(self.retry_max, self.retry_base * (2 ** (attempts - 1)))
+        return delay * random.uniform(0.5, 1.0)
+
+    async def deliver(self, message: Dict[str, Any]):
+        token = request_id_var.set(message.get("request_id") or "-")
+        try:
+            await self._deliver(message)
+        finally:
+            request_id_var.reset(token)
+
+    async def _deliver(self, message: Dict[str, Any]):
+        message["attempts"] += 1
+        started = time.perf_counter()
+        try:
+            renderer = RENDERERS[message["template"]]
+            email = renderer(message["to_name"], **message["context"])
+            await self.transport.send(message["to_email"], message["to_name"], email)
+        except Exception as e:
+            EMAIL_SEND.labels(self.transport.name, "failed").observe(time.perf_counter() - started)
+            message["last_error"] = f"{type(e).__name__}: {e}"
+            if message["attempts"] >= self.max_attempts or message["template"] not in RENDERERS:
+                logger.error("Email dead-lettered", extra={
+                    "event": "email.dead_lettered", "to": message["to_email"], "template": message["template"],
+                    "attempts": message["attempts"], "error": message["last_error"]
+                })
+                await self.store.bury(message)
+                self.counters["dead_lettered"] += 1
+            else:
+                delay = self.backoff(message["attempts"])
+                logger.warning("Email delivery failed, will retry", extra={
+                    "event": "email.retry", "to": message["to_email"], "template": message["template"],
+                    "attempts": message["attempts"], "error": message["last_error"], "retry_in": round(delay, 1)
+                })
+                await self.store.reschedule(message, time.time() + delay)
+                self.counters["retried"] += 1
+            return
+        EMAIL_SEND.labels(self.transport.name, "sent").observe(time.perf_counter() - started)
+        await self.store.complete(message)
+        self.counters["sent"] += 1
+
+    async def drain_once(self) -> int:
+        """Deliver every message that is currently due; returns how many were attempted"""
+        attempted = 0
+        semaphore = asyncio.Semaphore(SEND_CONCURRENCY)
+
+        async def deliver_limited(message):
+            async with semaphore:
+                await self.deliver(message)
+
+        while True:
+            batch = await self.store.claim(time.time(), BATCH_SIZE)
+            if not batch:
+                return attempted
+            await asyncio.gather(*(deliver_limited(message) for message in batch))
+            attempted += len(batch)
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await self.drain_once()
+                next_due = await self.store.next_due()
+            except Exception:
+                logger.exception("Email outbox worker error")
+                next_due = None
+            timeout = self.poll_interval
+            if next_due is not None:
+                timeout = min(timeout, max(0.0, next_due - time.time()))
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run(), name="email-outbox")
+
+    async def stop(self, timeout: float = 10.0):
+        """Stop the worker, giving in-flight deliveries up to timeout seconds to finish"""
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            try:
+                await asyncio.wait_for(self._task, timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._task = None
+        await self.transport.close()
+        await self.store.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"transport": self.transport.name, "running": self._task is not None, **self.counters}
+
+
+def create_store(backend: str):
+    if backend == "memory":
+        return MemoryOutboxStore()
+    if backend == "sqlite":
+        return SQLiteOutboxStore(EMAIL_OUTBOX_SQLITE_PATH)
+    raise ValueError(f"Unknown EMAIL_OUTBOX_BACKEND: {backend}")
@@ -0,0 +1,220 @@
+# Password hashing with a configurable algorithm and work factor
+#
+# Hashes are stored in userAccount.password as-is, in the self-describing form of
+# their algorithm:
+#   bcrypt    $2b$12$<salt and hash>                      (cost = log2 of the rounds)
+#   scrypt    $scrypt$ln=15,r=8,p=1$<salt>$<hash>         (cost = log2 of N)
+#   argon2id  $argon2id$v=19$m=65536,t=3,p=1$<salt>$<hash> (cost = t)
+# so verify() dispatches on the prefix and needs_rehash() can spot hashes made
+# with an older algorithm or a lower cost. Older rows hold the hex encoding of a
+# bcrypt hash, or a plain text password; decode_stored() tells the three apart.
+# With cost "auto", calibrate() measures this machine at startup and picks the
+# cost that makes one hash take about the target time.
+
+import base64
+import binascii
+import hashlib
+import hmac
+import math
+import os
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import bcrypt
+
+try:
+    import argon2
+except ImportError:  # optional; only needed for PASSWORD_HASH_ALGORITHM=argon2id
+    argon2 = None
+
+ALGORITHMS = ("bcrypt", "scrypt", "argon2id")
+
+# Per algorithm: (lowest cost, highest cost, cost used before/without calibration)
+COST_LIMITS = {
+    "bcrypt": (10, 16, 12),
+    "scrypt": (14, 18, 15),
+    "argon2id": (1, 10, 3),
+}
+
+# Prefix of each algorithm's hashes
+PREFIXES = {
+    "$2a$": "bcrypt", "$2b$": "bcrypt", "$2y$": "bcrypt",
+    "$scrypt$": "scrypt",
+    "$argon2id$": "argon2id",
+}
+
+# The same prefixes hex-encoded, as in rows written before hashes were stored natively
+HEX_PREFIXES = tuple(binascii.hexlify(prefix.encode("ascii")).decode("ascii") for prefix in PREFIXES)
+
+# Cost at which calibrate() measures before extrapolating to the target
+PROBE_COST = {"bcrypt": 10, "scrypt": 14, "argon2id": 1}
+
+SALT_BYTES = 16
+SCRYPT_KEY_BYTES = 32
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.b64encode(data).decode("ascii").rstrip("=")
+
+def _b64decode(data: str) -> bytes:
+    return base64.b64decode(data + "=" * (-len(data) % 4))
+
+def _scrypt(password: bytes, salt: bytes, log_n: int, r: int, p: int) -> bytes:
+    n = 1 << log_n
+    return hashlib.scrypt(password, salt=salt, n=n, r=r, p=p,
+                          maxmem=128 * r * (n + p + 2) + 1024 * 1024, dklen=SCRYPT_KEY_BYTES)
+
+def _parse_params(text: str) -> Dict[str, int]:
+    """"ln=15,r=8,p=1" -> {"ln": 15, "r": 8, "p": 1}"""
+    return {key: int(value) for key, value in (item.split("=", 1) for item in text.split(","))}
+
+def identify(password_hash: str) -> Optional[str]:
+    """Algorithm of a hash from its prefix, or None if it is not a supported hash"""
+    for prefix, algorithm in PREFIXES.items():
+        if password_hash.startswith(prefix):
+            return algorithm
+    return None
+
+def decode_stored(stored: str) -> Tuple[str, Optional[str]]:
+    """
+    Classify a userAccount.password value:
+    ("hash", hash) for a hash, ("hex", hash) for a hex-encoded hash,
+    ("plain", None) for a legacy plain text password
+    """
+    if identify(stored):
+        return "hash", stored
+    if stored.startswith(HEX_PREFIXES):
+        try:
+            decoded = binascii.unhexlify(stored).decode("ascii")
+        except (binascii.Error, UnicodeDecodeError):
+            return "plain", None
+        if identify(decoded):
+            return "hex", decoded
+    return "plain", None
+
+
+class PasswordHasher:
+    """
+    Hashes with one algorithm and cost; verifies hashes of any supported algorithm.
+    Plain attributes only, so instances pickle for a process pool.
+    """
+
+    def __init__(self, algorithm: str, cost: Optional[int], target_seconds: float,
+                 scrypt_block_size: int = 8, scrypt_parallelism: int = 1,
+                 argon2_memory_kib: int = 65536, argon2_parallelism: int = 1):
+        if algorithm not in ALGORITHMS:
+            raise ValueError(f"Unknown password hash algorithm: {algorithm}")
+        if algorithm == "argon2id" and argon2 is None:
+            raise RuntimeError("PASSWORD_HASH_ALGORITHM=argon2id needs the argon2-cffi package")
+        self.algorithm = algorithm
+        self.auto = cost is None
+        self.cost = COST_LIMITS[algorithm][2] if cost is None else cost
+        self.target_seconds = target_seconds
+        self.scrypt_block_size = scrypt_block_size
+        self.scrypt_parallelism = scrypt_parallelism
+        self.argon2_memory_kib = argon2_memory_kib
+        self.argon2_parallelism = argon2_parallelism
+
+    def _argon2(self, cost: int) -> "argon2.PasswordHasher":
+        return argon2.PasswordHasher(
+            time_cost=cost, memory_cost=self.argon2_memory_kib,
+            parallelism=self.argon2_parallelism, type=argon2.Type.ID
+        )
+
+    def hash(self, password: str, cost: Optional[int] = None) -> str:
+        """Hash with the configured algorithm at `cost` (default: the current cost)"""
+        cost = self.cost if cost is None else cost
+        password_bytes = password.encode("utf-8")
+        if self.algorithm == "bcrypt":
+            return bcrypt.hashpw(password_bytes, bcrypt.gensalt(rounds=cost)).decode("ascii")
+        if self.algorithm == "scrypt":
+            r, p = self.scrypt_block_size, self.scrypt_parallelism
+            salt = os.urandom(SALT_BYTES)
+            key = _scrypt(password_bytes, salt, cost, r, p)
+            return f"$scrypt$ln={cost},r={r},p={p}${_b64encode(salt)}${_b64encode(key)}"
+        return self._argon2(cost).hash(password_bytes)
+
+    def verify(self, password: str, password_hash: str) -> bool:
+        """Check a password against a hash of any supported algorithm; ValueError if unrecognised"""
+        algorithm = identify(password_hash)
+        password_bytes = password.encode("utf-8")
+        if algorithm == "bcrypt":
+            return bcrypt.checkpw(password_bytes, password_hash.encode("ascii"))
+        if algorithm == "scrypt":
+            _, _, params, salt, key = password_hash.split("$")
+            params = _parse_params(params)
+            actual = _scrypt(password_bytes, _b64decode(salt), params["ln"], params["r"], params["p"])
+            return hmac.compare_digest(actual, _b64decode(key))
+        if algorithm == "argon2id":
+            if argon2 is None:
+                raise ValueError("argon2 password hash found but argon2-cffi is not installed")
+            try:
+                return argon2.PasswordHasher().verify(password_hash, password_bytes)
+            except argon2.exceptions.VerificationError:
+                return False
+        raise ValueError("Unrecognised password hash format")
+
+    def cost_of(self, password_hash: str) -> Optional[tuple]:
+        """(algorithm, cost, other parameters) recorded in a hash, or None if unrecognised"""
+        algorithm = identify(password_hash)
+        parts = password_hash.split("$")
+        if algorithm == "bcrypt" and len(parts) > 2 and parts[2].isdigit():
+            return ("bcrypt", int(parts[2]), ())
+        if algorithm == "scrypt" and len(parts) == 5:
+            params = _parse_params(parts[2])
+            return ("scrypt", params["ln"], (params["r"], params["p"]))
+        if algorithm == "argon2id" and len(parts) == 6:
+            params = _parse_params(parts[3])
+            return ("argon2id", params["t"], (params["m"], params["p"]))
+        return None
+
+    def current_params(self) -> tuple:
+        if self.algorithm == "scrypt":
+            return ("scrypt", self.cost, (self.scrypt_block_size, self.scrypt_parallelism))
+        if self.algorithm == "argon2id":
+            return ("argon2id", self.cost, (self.argon2_memory_kib, self.argon2_parallelism))
+        return ("bcrypt", self.cost, ())
+
+    def needs_rehash(self, password_hash: str) -> bool:
+        """
+        True if the hash was made with another algorithm or parameters than the current
+        ones, or with a lower cost. A higher cost is kept: with cost "auto" machines
+        can calibrate to different costs, and would otherwise undo each other's rehashes.
+        """
+        params = self.cost_of(password_hash)
+        if params is None:
+            return True
+        algorithm, cost, other = params
+        current_algorithm, current_cost, current_other = self.current_params()
+        return algorithm != current_algorithm or other != current_other or cost < current_cost
+
+    def calibrate(self) -> Dict[str, Any]:
+        """
+        Pick the cost whose hash time is closest to target_seconds (only with cost "auto").
+        Measures one hash at a low cost and extrapolates: bcrypt and scrypt double per
+        step, argon2 grows linearly with its iterations.
+        """
+        if not self.auto:
+            return self.describe()
+        low, high, _ = COST_LIMITS[self.algorithm]
+        probe = PROBE_COST[self.algorithm]
+        elapsed = float("inf")
+        for _ in range(2):  # best of two, to discount a cold first run
+            started = time.perf_counter()
+            self.hash("calibration-password", cost=probe)
+            elapsed = min(elapsed, time.perf_counter() - started)
+
+        if self.algorithm == "argon2id":
+            cost = round(probe * self.target_seconds / elapsed)
+        else:
+            cost = probe + round(math.log2(self.target_seconds / elapsed))
+        self.cost = max(low, min(high, cost))
+        return {**self.describe(), "probe_cost": probe, "probe_ms": round(elapsed * 1000, 1)}
+
+    def describe(self) -> Dict[str, Any]:
+        info = {"algorithm": self.algorithm, "cost": self.cost, "auto": self.auto}
+        if self.algorithm == "scrypt":
+            info.update(r=self.scrypt_block_size, p=self.scrypt_parallelism)
+        elif self.algorithm == "argon2id":
+            info.update(memory_kib=self.argon2_memory_kib, p=self.argon2_parallelism)
+        return info
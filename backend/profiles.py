@@ -0,0 +1,54 @@
+# Read-through cache of account profiles (the public AccountResponse columns)
+#
+# /accounts/me is polled on every screen of the iOS app and the profile rarely
+# changes, so reads are served from an in-process cache keyed by account_id.
+# Writes made through this module update or invalidate the cache; each worker
+# process has its own cache, so a change made by another worker is visible here
+# after at most ACCOUNT_CACHE_TTL_SECONDS.
+#
+# Each cached profile carries an ETag (a hash of its JSON), computed once when it
+# is cached, so conditional GETs are answered from memory.
+
+import json
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import repository
+from cache import MISSING
+from httpcache import etag_for
+from resources import current
+
+
+def profile_etag(profile: Dict[str, Any]) -> str:
+    return etag_for(json.dumps(profile, sort_keys=True, default=str).encode("utf-8"))
+
+async def get_account_profile_entry(account_id: int) -> Optional[Tuple[Dict[str, Any], str]]:
+    """(profile, etag) for account_id, from the cache or the database; None if it doesn't exist"""
+    cached = current().account_cache.get(account_id)
+    if cached is not MISSING:
+        return cached
+    
+    started = time.monotonic()
+    account = await repository.get_account_by_id(account_id)
+    if not account:
+        return None
+    entry = (account, profile_etag(account))
+    current().account_cache.fill(account_id, entry, started)
+    return entry
+
+async def get_account_profile(account_id: int) -> Optional[Dict[str, Any]]:
+    """Public profile for account_id (a copy callers may modify); None if it doesn't exist"""
+    entry = await get_account_profile_entry(account_id)
+    return dict(entry[0]) if entry else None
+
+async def update_account_profile(account_id: int, updates: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Update account columns in one round trip and return the new profile (None if no such account)"""
+    account = await repository.update_account(account_id, updates)
+    if account:
+        current().account_cache.replace(account_id, (account, profile_etag(account)))
+        return dict(account)
+    current().account_cache.invalidate(account_id)
+    return None
+
+def invalidate_account_profile(account_id: int):
+    current().account_cache.invalidate(account_id)
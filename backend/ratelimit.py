@@ -0,0 +1,281 @@
+# Sliding-window rate limiting for failed logins, with pluggable storage backends
+#
+# Every backend keeps, per key, the timestamps of the most recent failures (at most
+# `limit` of them). A key is locked out while `limit` failures fall inside `window`
+# seconds; the lockout ends when the oldest of those failures leaves the window.
+
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+import sqlite3
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Deque, List, Optional, Tuple
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter(ABC):
+    """Interface shared by all rate limiter backends"""
+
+    @abstractmethod
+    async def hit(self, key: str, limit: int, window: int):
+        """Record one failure for key"""
+
+    @abstractmethod
+    async def retry_after(self, key: str, limit: int, window: int) -> int:
+        """Seconds until key may try again, 0 if it is not locked out"""
+
+    @abstractmethod
+    async def reset(self, key: str):
+        """Forget all failures for key"""
+
+    async def close(self):
+        pass
+
+
+def _remaining(timestamps: List[float], limit: int, window: int, now: float) -> int:
+    recent = [ts for ts in timestamps if ts > now - window]
+    if len(recent) < limit:
+        return 0
+    oldest = sorted(recent)[-limit]
+    return max(1, int(oldest + window - now + 0.999))
+
+
+class MemoryRateLimiter(RateLimiter):
+    """Per-process backend: bounded LRU of keys, swept periodically"""
+
+    def __init__(self, max_keys: int, sweep_interval: int = 60):
+        self.max_keys = max_keys
+        self.sweep_interval = sweep_interval
+        self._hits: "OrderedDict[str, Tuple[int, Deque[float]]]" = OrderedDict()
+        self._next_sweep = time.monotonic() + sweep_interval
+
+    async def hit(self, key: str, limit: int, window: int):
+        now = time.time()
+        self._sweep(now)
+        entry = self._hits.get(key)
+        if entry is None or entry[1].maxlen != limit:
+            entry = (window, deque(entry[1] if entry else (), maxlen=limit))
+        entry[1].append(now)
+        self._hits[key] = entry
+        self._hits.move_to_end(key)
+        while len(self._hits) > self.max_keys:
+            self._hits.popitem(last=False)
+
+    async def retry_after(self, key: str, limit: int, window: int) -> int:
+        entry = self._hits.get(key)
+        if entry is None:
+            return 0
+        return _remaining(list(entry[1]), limit, window, time.time())
+
+    async def reset(self, key: str):
+        self._hits.pop(key, None)
+
+    def _sweep(self, now: float):
+        if time.monotonic() < self._next_sweep:
+            return
+        self._next_sweep = time.monotonic() + self.sweep_interval
+        expired = [key for key, (window, hits) in self._hits.items() if not hits or hits[-1] <= now - window]
+        for key in expired:
+            del self._hits[key]
+
+    def __len__(self) -> int:
+        return len(self._hits)
+
+
+class SQLiteRateLimiter(RateLimiter):
+    """Backend shared by every worker process on one host through a SQLite file"""
+
+    def __init__(self, path: str, sweep_interval: int = 60):
+        self.path = path
+        self.sweep_interval = sweep_interval
+        self._next_sweep = 0.0
+        self._lock = asyncio.Lock()
+        self._conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS login_failures (key TEXT NOT NULL, ts REAL NOT NULL, expires REAL NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS login_failures_key_ts ON login_failures (key, ts)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS login_failures_expires ON login_failures (expires)")
+
+    async def _run(self, fn, *args):
+        # sqlite3 blocks while another process holds the write lock, so keep it off the event loop
+        async with self._lock:
+            return await asyncio.to_thread(fn, *args)
+
+    def _hit(self, key: str, limit: int, window: int):
+        now = time.time()
+        with self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.execute("INSERT INTO login_failures (key, ts, expires) VALUES (?, ?, ?)", (key, now, now + window))
+            self._conn.execute(
+                "DELETE FROM login_failures WHERE key = ? AND ts NOT IN "
+                "(SELECT ts FROM login_failures WHERE key = ? ORDER BY ts DESC LIMIT ?)",
+                (key, key, limit)
+            )
+            if now >= self._next_sweep:
+                self._next_sweep = now + self.sweep_interval
+                self._conn.execute("DELETE FROM login_failures WHERE expires <= ?", (now,))
+
+    def _retry_after(self, key: str, limit: int, window: int) -> int:
+        now = time.time()
+        rows = self._conn.execute(
+            "SELECT ts FROM login_failures WHERE key = ? AND ts > ? ORDER BY ts DESC LIMIT ?",
+            (key, now - window, limit)
+        ).fetchall()
+        return _remaining([row[0] for row in rows], limit, window, now)
+
+    def _reset(self, key: str):
+        self._conn.execute("DELETE FROM login_failures WHERE key = ?", (key,))
+
+    async def hit(self, key: str, limit: int, window: int):
+        await self._run(self._hit, key, limit, window)
+
+    async def retry_after(self, key: str, limit: int, window: int) -> int:
+        return await self._run(self._retry_after, key, limit, window)
+
+    async def reset(self, key: str):
+        await self._run(self._reset, key)
+
+    async def close(self):
+        self._conn.close()
+
+
+class RedisError(Exception):
+    pass
+
+
+class RedisRateLimiter(RateLimiter):
+    """
+    Backend shared across hosts, speaking the Redis protocol (RESP) directly.
+    Works with Redis or any server implementing ZADD/ZREMRANGEBYSCORE/
+    ZREMRANGEBYRANK/ZRANGE/PEXPIRE/DEL. Fails open if the server is unreachable.
+    """
+
+    def __init__(self, url: str, timeout: float = 1.0):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.timeout = timeout
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._lock = asyncio.Lock()
+
+    @staticmethod
+    def _encode(*args) -> bytes:
+        out = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            out.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(out)
+
+    async def _read_reply(self):
+        line = await self._reader.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed")
+        kind, body = line[:1], line[1:-2]
+        if kind == b"+":
+            return body.decode()
+        if kind == b"-":
+            raise RedisError(body.decode())
+        if kind == b":":
+            return int(body)
+        if kind == b"$":
+            length = int(body)
+            if length < 0:
+                return None
+            data = await self._reader.readexactly(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            length = int(body)
+            if length < 0:
+                return None
+            return [await self._read_reply() for _ in range(length)]
+        raise RedisError(f"Unexpected reply: {line!r}")
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        setup = []
+        if self.password:
+            setup.append(("AUTH", self.password))
+        if self.db:
+            setup.append(("SELECT", self.db))
+        if setup:
+            await self._pipeline(setup)
+
+    async def _pipeline(self, commands: List[tuple]) -> list:
+        self._writer.write(b"".join(self._encode(*cmd) for cmd in commands))
+        await self._writer.drain()
+        # Read every reply even after an error so the connection stays in sync
+        replies, error = [], None
+        for _ in commands:
+            try:
+                replies.append(await self._read_reply())
+            except RedisError as e:
+                replies.append(None)
+                error = error or e
+        if error:
+            raise error
+        return replies
+
+    async def _execute(self, commands: List[tuple]) -> Optional[list]:
+        async with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._writer is None:
+                        await asyncio.wait_for(self._connect(), self.timeout)
+                    return await asyncio.wait_for(self._pipeline(commands), self.timeout)
+                except RedisError as e:
+                    logger.warning("Rate limiter backend error, allowing request", extra={"error": str(e)})
+                    return None
+                except (OSError, ConnectionError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+                    await self._disconnect()
+                    if attempt:
+                        logger.warning("Rate limiter backend unavailable, allowing request", extra={"error": repr(e)})
+        return None
+
+    async def _disconnect(self):
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except (OSError, ConnectionError):
+                pass
+        self._reader = self._writer = None
+
+    async def hit(self, key: str, limit: int, window: int):
+        now = time.time()
+        await self._execute([
+            ("ZADD", key, now, f"{now}:{uuid.uuid4().hex[:8]}"),
+            ("ZREMRANGEBYSCORE", key, "-inf", now - window),
+            ("ZREMRANGEBYRANK", key, 0, -(limit + 1)),
+            ("PEXPIRE", key, window * 1000),
+        ])
+
+    async def retry_after(self, key: str, limit: int, window: int) -> int:
+        replies = await self._execute([("ZRANGE", key, 0, -1, "WITHSCORES")])
+        if not replies or not replies[0]:
+            return 0
+        scores = [float(score) for score in replies[0][1::2]]
+        return _remaining(scores, limit, window, time.time())
+
+    async def reset(self, key: str):
+        await self._execute([("DEL", key)])
+
+    async def close(self):
+        async with self._lock:
+            await self._disconnect()
+
+
+def create_rate_limiter(backend: str, max_keys: int, sqlite_path: str, redis_url: str) -> RateLimiter:
+    if backend == "memory":
+        return MemoryRateLimiter(max_keys=max_keys)
+    if backend == "sqlite":
+        return SQLiteRateLimiter(sqlite_path)
+    if backend == "redis":
+        return RedisRateLimiter(redis_url)
+    raise ValueError(f"Unknown RATE_LIMIT_BACKEND: {backend}")
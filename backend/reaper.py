@@ -0,0 +1,109 @@
+# Background reaper for expired rows
+#
+# Nothing else deletes expired sessions or password reset tokens, so without this
+# both tables grow without bound. Each run removes expired rows in bounded batches
+# (select ids by expires_at, then delete those ids) with a short random pause
+# between batches, so a large backlog is cleared over several runs instead of in
+# one long burst. Reset tokens expire an hour after creation, so used tokens are
+# removed here too once they expire.
+
+import asyncio
+import logging
+import random
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import repository
+
+logger = logging.getLogger(__name__)
+
+# (table name, fetch expired ids, delete ids)
+TABLES: List[tuple] = [
+    ("sessions", repository.expired_session_ids, repository.delete_sessions_by_ids),
+    ("password_reset_tokens", repository.expired_reset_token_ids, repository.delete_reset_tokens_by_ids),
+]
+
+# Upper bound of the random pause between two batches, in seconds
+BATCH_PAUSE_SECONDS = 0.5
+
+
+class Reaper:
+    """Periodically deletes expired rows from the tables in TABLES"""
+
+    def __init__(self, interval: float, batch_size: int, max_batches: int, jitter: float):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self.jitter = jitter
+        self.counters: Dict[str, int] = {"runs": 0, "errors": 0}
+        self.removed: Dict[str, int] = {table: 0 for table, _, _ in TABLES}
+        self.last_run: Optional[Dict[str, Any]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def next_delay(self) -> float:
+        """Seconds until the next run: interval +/- jitter"""
+        return self.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    async def reap_table(self, fetch_ids: Callable[[str, int], Awaitable[List[int]]],
+                         delete_ids: Callable[[List[int]], Awaitable[int]]) -> int:
+        """Delete up to max_batches batches of expired rows; returns how many were removed"""
+        removed = 0
+        for batch in range(self.max_batches):
+            if batch:
+                await asyncio.sleep(random.uniform(0, BATCH_PAUSE_SECONDS))
+            ids = await fetch_ids(datetime.now().isoformat(), self.batch_size)
+            if not ids:
+                break
+            removed += await delete_ids(ids)
+            if len(ids) < self.batch_size:
+                break
+        return removed
+
+    async def run_once(self) -> Dict[str, Any]:
+        """One pass over every table; returns rows removed per table and the duration"""
+        started = time.perf_counter()
+        report: Dict[str, Any] = {}
+        for table, fetch_ids, delete_ids in TABLES:
+            report[table] = await self.reap_table(fetch_ids, delete_ids)
+            self.removed[table] += report[table]
+        report["seconds"] = round(time.perf_counter() - started, 3)
+        self.counters["runs"] += 1
+        self.last_run = report
+        logger.info("Reaper removed expired rows", extra={"event": "reaper.run", **report})
+        return report
+
+    async def _run(self):
+        # Start at a random point in the first interval so workers spread out
+        delay = random.uniform(0, self.interval)
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                await self.run_once()
+            except Exception:
+                self.counters["errors"] += 1
+                logger.exception("Reaper run failed")
+            delay = self.next_delay()
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="reaper")
+
+    async def stop(self):
+        # Cancelled even mid-run: each batch is an idempotent delete by id, and
+        # whatever is left is removed by the next run after restart
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self._task is not None,
+            **self.counters,
+            "removed": dict(self.removed),
+            "last_run": self.last_run,
+        }
@@ -0,0 +1,408 @@
+# Async data-access layer: every Supabase query the API makes goes through here
+
+import logging
+import re
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from postgrest.exceptions import APIError
+
+from config import DB_RPC_ENABLED
+from resources import current
+from tokens import hash_token
+
+logger = logging.getLogger(__name__)
+
+# Columns safe to return to clients (never includes the password hash)
+ACCOUNT_COLUMNS = "id, name, email, phone, date_of_birth"
+
+# PostgREST error codes
+FUNCTION_NOT_FOUND = "PGRST202"
+UNIQUE_VIOLATION = "23505"
+
+
+class EmailTakenError(Exception):
+    """Raised when registering an email that already has an account"""
+
+
+# Postgres functions from sql/functions.sql; one is switched off the first
+# time PostgREST reports it missing, and callers fall back to plain queries
+_rpc_enabled: Dict[str, bool] = {}
+
+
+# Tables whose token column may still hold raw tokens from before token_hash
+# existed. While it might, a lookup that misses by digest is retried by raw token.
+# check_legacy_tokens() sets the flags from the database at startup, so a worker
+# started after the migration never retries; the token hash migration
+# (tokenmigration.py) clears a flag once it has converted a table.
+_legacy_tokens: Dict[str, bool] = {"sessions": True, "password_reset_tokens": True}
+
+
+def _first(response) -> Optional[Dict[str, Any]]:
+    return response.data[0] if response.data else None
+
+def _returning(query, columns: str):
+    """Limit the representation a write returns to columns (PostgREST ?select= on insert/update/delete)"""
+    query.params = query.params.add("select", columns)
+    return query
+
+async def _call_rpc(name: str, params: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+    """Call a Postgres function; None if RPCs are disabled or it is not installed"""
+    if not _rpc_enabled.get(name, DB_RPC_ENABLED):
+        return None
+    try:
+        response = await current().db.rpc(name, params).execute()
+    except APIError as e:
+        if e.code != FUNCTION_NOT_FOUND:
+            raise
+        logger.warning("Database function not installed (see sql/functions.sql), using fallback queries",
+                       extra={"function": name})
+        _rpc_enabled[name] = False
+        return None
+    return response.data
+
+def _token_keys(table: str, token: str) -> List[Tuple[str, str]]:
+    """(column, value) pairs to find a token row by: its digest, then the raw token while legacy rows remain"""
+    keys = [("token_hash", hash_token(token))]
+    if _legacy_tokens[table]:
+        keys.append(("token", token))
+    return keys
+
+def _with_token_hash(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Fill in token_hash for legacy rows that only have the raw token"""
+    for row in rows:
+        if not row.get("token_hash") and row.get("token"):
+            row["token_hash"] = hash_token(row["token"])
+        row.pop("token", None)
+    return rows
+
+
+# Accounts
+async def get_account_by_id(account_id: int, columns: str = ACCOUNT_COLUMNS) -> Optional[Dict[str, Any]]:
+    response = await current().db.table("userAccount").select(columns).eq("id", account_id).execute()
+    return _first(response)
+
+async def get_account_by_email(email: str, columns: str = ACCOUNT_COLUMNS) -> Optional[Dict[str, Any]]:
+    response = await current().db.table("userAccount").select(columns).eq("email", email).execute()
+    return _first(response)
+
+async def list_accounts_page(
+    after_id: Optional[int] = None,
+    limit: int = 100,
+    email_prefix: Optional[str] = None,
+    created_after: Optional[datetime] = None,
+    columns: str = ACCOUNT_COLUMNS,
+) -> List[Dict[str, Any]]:
+    """Keyset-paginated accounts ordered by id, starting after after_id"""
+    query = current().db.table("userAccount").select(columns).order("id").limit(limit)
+    if after_id is not None:
+        query = query.gt("id", after_id)
+    if email_prefix:
+        # Escape LIKE wildcards so the prefix is matched literally
+        escaped = re.sub(r"([\\%_])", r"\\\1", email_prefix)
+        query = query.ilike("email", f"{escaped}*")
+    if created_after is not None:
+        query = query.gte("created_at", created_after.isoformat())
+    response = await query.execute()
+    return response.data or []
+
+async def insert_account(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Insert an account row and return it"""
+    response = await current().db.table("userAccount").insert(data).execute()
+    return response.data[0]
+
+async def create_account_with_session(account: Dict[str, Any], token: str, expires_at: str) -> Dict[str, Any]:
+    """
+    Create an account and its first session in one round trip (register_account RPC).
+    Returns the public account columns plus session_id; raises EmailTakenError.
+    """
+    try:
+        rows = await _call_rpc("register_account", {
+            "p_name": account["name"],
+            "p_email": account["email"],
+            "p_phone": account["phone"],
+            "p_date_of_birth": account["date_of_birth"],
+            "p_password": account["password"],
+            "p_token_hash": hash_token(token),
+            "p_expires_at": expires_at,
+        })
+        if rows is not None:
+            return rows[0]
+
+        # Fallback: separate queries
+        if await get_account_by_email(account["email"], columns="id"):
+            raise EmailTakenError(account["email"])
+        created = await insert_account(account)
+    except APIError as e:
+        if e.code == UNIQUE_VIOLATION:
+            raise EmailTakenError(account["email"]) from e
+        raise
+    session = await insert_session(created["id"], token, expires_at)
+    return {
+        **{column: created[column] for column in ("id", "name", "email", "phone", "date_of_birth")},
+        "session_id": session["id"],
+    }
+
+async def update_account(account_id: int, updates: Dict[str, Any], columns: str = ACCOUNT_COLUMNS) -> Optional[Dict[str, Any]]:
+    """Update an account row and return the given columns of the updated row (one round trip)"""
+    query = current().db.table("userAccount").update(updates).eq("id", account_id)
+    response = await _returning(query, columns).execute()
+    return _first(response)
+
+async def replace_password_hash(account_id: int, old: str, new: str) -> bool:
+    """Set the password only if it still holds `old`, so a concurrent change wins; True if updated"""
+    query = current().db.table("userAccount").update({"password": new}).eq("id", account_id).eq("password", old)
+    response = await _returning(query, "id").execute()
+    return bool(response.data)
+
+async def convert_hex_password_hashes(after_id: int, limit: int) -> Optional[Tuple[Optional[int], int, bool]]:
+    """
+    Rewrite hex-encoded hashes natively for up to limit accounts after after_id in one
+    round trip (convert_hex_password_hashes RPC). Returns (last id looked at, or None if
+    there was none; rows converted; True if nothing is left after it), or None if the
+    RPC is unavailable.
+    """
+    rows = await _call_rpc("convert_hex_password_hashes", {"p_after_id": after_id, "p_batch_size": limit})
+    if rows is None:
+        return None
+    return rows[0]["last_id"], rows[0]["converted"], rows[0]["done"]
+
+async def hex_password_rows(after_id: int, limit: int) -> List[Dict[str, Any]]:
+    """id and password of up to limit accounts after after_id whose password may be hex-encoded"""
+    # "24" is the hex of "$", the first character of every hash (partial index in sql/indexes.sql)
+    response = await current().db.table("userAccount").select("id, password").gt("id", after_id).like("password", "24*").order("id").limit(limit).execute()
+    return response.data or []
+
+async def has_hex_passwords() -> bool:
+    """Whether any account may still hold a hex-encoded hash (one indexed query)"""
+    return bool(await hex_password_rows(0, 1))
+
+async def delete_account(account_id: int):
+    await current().db.table("userAccount").delete().eq("id", account_id).execute()
+
+
+# Sessions
+# Functions here take the raw token and store or look up its digest (token_hash);
+# rows they return carry token_hash, never the token.
+async def insert_session(account_id: int, token: str, expires_at: str) -> Dict[str, Any]:
+    query = current().db.table("sessions").insert({
+        "account_id": account_id,
+        "token_hash": hash_token(token),
+        "expires_at": expires_at
+    })
+    response = await _returning(query, "id, account_id, expires_at").execute()
+    return response.data[0]
+
+async def start_session(account_id: int, token: str, expires_at: str,
+                        max_sessions: int) -> Tuple[int, List[Dict[str, Any]]]:
+    """
+    Record last_login and insert a session in one round trip (start_session RPC),
+    evicting the account's oldest sessions beyond max_sessions (0 = no cap).
+    Returns the new session id and the evicted sessions (id, token_hash).
+    """
+    login_at = datetime.now().isoformat()
+    rows = await _call_rpc("start_session", {
+        "p_account_id": account_id,
+        "p_token_hash": hash_token(token),
+        "p_expires_at": expires_at,
+        "p_login_at": login_at,
+        "p_max_sessions": max_sessions,
+    })
+    if rows is not None:
+        return rows[0]["session_id"], rows[0]["evicted"] or []
+
+    # Fallback: separate queries
+    try:
+        await update_account(account_id, {'last_login': login_at})
+    except APIError:
+        pass  # Column may not exist in the database
+    session = await insert_session(account_id, token, expires_at)
+    evicted = await evict_oldest_sessions(account_id, max_sessions) if max_sessions > 0 else []
+    return session["id"], evicted
+
+async def evict_oldest_sessions(account_id: int, keep: int) -> List[Dict[str, Any]]:
+    """Delete all but the newest keep sessions of an account; returns the deleted (id, token_hash) rows"""
+    response = await current().db.table("sessions").select("id").eq("account_id", account_id).order("id", desc=True).execute()
+    doomed = [row["id"] for row in (response.data or [])[keep:]]
+    if not doomed:
+        return []
+    query = current().db.table("sessions").delete().in_("id", doomed)
+    response = await _returning(query, "id, token_hash, token").execute()
+    return _with_token_hash(response.data or [])
+
+async def list_live_sessions(account_id: int) -> List[Dict[str, Any]]:
+    """Unexpired sessions of an account, newest first (id, token_hash, expires_at)"""
+    response = await current().db.table("sessions").select("id, token_hash, token, expires_at").eq("account_id", account_id).gt("expires_at", datetime.now().isoformat()).order("id", desc=True).execute()
+    return _with_token_hash(response.data or [])
+
+async def get_live_session(token: str) -> Optional[Dict[str, Any]]:
+    """Return id, account_id and expires_at for an unexpired session token"""
+    now = datetime.now().isoformat()
+    for column, value in _token_keys("sessions", token):
+        response = await current().db.table("sessions").select("id, account_id, expires_at").eq(column, value).gt("expires_at", now).execute()
+        if response.data:
+            return response.data[0]
+    return None
+
+async def delete_session(token: str) -> List[Dict[str, Any]]:
+    """Delete a session by token and return the deleted (id, account_id, token_hash) rows"""
+    for column, value in _token_keys("sessions", token):
+        query = current().db.table("sessions").delete().eq(column, value)
+        response = await _returning(query, "id, account_id, token_hash, token").execute()
+        if response.data:
+            return _with_token_hash(response.data)
+    return []
+
+async def delete_session_by_id(session_id: int):
+    await current().db.table("sessions").delete().eq("id", session_id).execute()
+
+async def delete_account_session(account_id: int, session_id: int) -> List[Dict[str, Any]]:
+    """Delete one session if it belongs to account_id; returns the deleted (id, account_id, token_hash) rows"""
+    query = current().db.table("sessions").delete().eq("id", session_id).eq("account_id", account_id)
+    response = await _returning(query, "id, account_id, token_hash, token").execute()
+    return _with_token_hash(response.data or [])
+
+async def delete_sessions_for_account(account_id: int):
+    await current().db.table("sessions").delete().eq("account_id", account_id).execute()
+
+async def expired_session_ids(before: str, limit: int) -> List[int]:
+    """Ids of up to limit sessions that expired before the given time (uses the expires_at index)"""
+    response = await current().db.table("sessions").select("id").lt("expires_at", before).order("expires_at").limit(limit).execute()
+    return [row["id"] for row in response.data or []]
+
+async def delete_sessions_by_ids(session_ids: List[int]) -> int:
+    """Delete sessions by id and return how many were removed"""
+    response = await current().db.table("sessions").delete().in_("id", session_ids).execute()
+    return len(response.data or [])
+
+
+# Password reset tokens
+async def insert_reset_token(account_id: int, token: str, expires_at: str):
+    await current().db.table("password_reset_tokens").insert({
+        "account_id": account_id,
+        "token_hash": hash_token(token),
+        "expires_at": expires_at
+    }).execute()
+
+async def create_reset_token(email: str, token: str, expires_at: str) -> Optional[Dict[str, Any]]:
+    """
+    Replace the unused reset tokens of the account with this email by a new one,
+    in one round trip (request_password_reset RPC). Returns the account's id, email
+    and name, or None if no account has the email.
+    """
+    rows = await _call_rpc("request_password_reset", {
+        "p_email": email,
+        "p_token_hash": hash_token(token),
+        "p_expires_at": expires_at,
+    })
+    if rows is not None:
+        return rows[0] if rows else None
+
+    # Fallback: separate queries
+    account = await get_account_by_email(email, columns="id, email, name")
+    if account:
+        await delete_unused_reset_tokens(account["id"])
+        await insert_reset_token(account["id"], token, expires_at)
+    return account
+
+async def get_reset_token(token: str) -> Optional[Dict[str, Any]]:
+    for column, value in _token_keys("password_reset_tokens", token):
+        response = await current().db.table("password_reset_tokens").select("id, account_id, expires_at, used").eq(column, value).execute()
+        if response.data:
+            return response.data[0]
+    return None
+
+async def consume_reset_token(token: str) -> Optional[int]:
+    """
+    Mark a reset token used if it is unused and unexpired, in one conditional update;
+    returns its account id, or None if the token cannot be used. Of two concurrent
+    calls with the same token only one gets the account id.
+    """
+    now = datetime.now().isoformat()
+    for column, value in _token_keys("password_reset_tokens", token):
+        query = current().db.table("password_reset_tokens").update({'used': True}).eq(column, value).eq("used", False).gt("expires_at", now)
+        response = await _returning(query, "account_id").execute()
+        if response.data:
+            return response.data[0]["account_id"]
+    return None
+
+async def reset_password_with_token(token: str, password_hash: str) -> Optional[int]:
+    """
+    Consume a reset token and set the account's new password hash, deleting every
+    session of the account, in one transaction (reset_password_with_token RPC).
+    Returns the account id; None if the token cannot be used or the account no
+    longer exists. Of two concurrent calls with the same token only one succeeds.
+    """
+    rows = await _call_rpc("reset_password_with_token", {
+        "p_token_hash": hash_token(token),
+        "p_token": token if _legacy_tokens["password_reset_tokens"] else None,
+        "p_password": password_hash,
+        "p_now": datetime.now().isoformat(),
+    })
+    if rows is not None:
+        return rows[0]["account_id"] if rows else None
+
+    # Fallback: separate queries, starting with the conditional update of the token
+    account_id = await consume_reset_token(token)
+    if account_id is None:
+        return None
+    if not await update_account(account_id, {'password': password_hash}, columns="id"):
+        return None
+    await delete_sessions_for_account(account_id)
+    return account_id
+
+async def delete_unused_reset_tokens(account_id: int):
+    await current().db.table("password_reset_tokens").delete().eq("account_id", account_id).eq("used", False).execute()
+
+async def expired_reset_token_ids(before: str, limit: int) -> List[int]:
+    """Ids of up to limit reset tokens (used or not) that expired before the given time"""
+    response = await current().db.table("password_reset_tokens").select("id").lt("expires_at", before).order("expires_at").limit(limit).execute()
+    return [row["id"] for row in response.data or []]
+
+async def delete_reset_tokens_by_ids(token_ids: List[int]) -> int:
+    """Delete reset tokens by id and return how many were removed"""
+    response = await current().db.table("password_reset_tokens").delete().in_("id", token_ids).execute()
+    return len(response.data or [])
+
+
+# Token hash migration (tokenmigration.py)
+async def hash_legacy_tokens(table: str, limit: int) -> Optional[int]:
+    """
+    Replace the raw token of up to limit rows of table by its digest in one round
+    trip (hash_legacy_tokens RPC). Returns the rows converted, or None if the RPC
+    is unavailable.
+    """
+    rows = await _call_rpc("hash_legacy_tokens", {"p_table": table, "p_batch_size": limit})
+    if rows is None:
+        return None
+    return rows[0]["converted"]
+
+async def legacy_token_rows(table: str, limit: int) -> List[Dict[str, Any]]:
+    """id and raw token of up to limit rows of table that have no token_hash yet"""
+    response = await current().db.table(table).select("id, token").not_.is_("token", "null").order("id").limit(limit).execute()
+    return response.data or []
+
+async def store_token_hash(table: str, row_id: int, token: str) -> bool:
+    """Swap a row's raw token for its digest unless the row changed meanwhile; True if updated"""
+    query = current().db.table(table).update({"token_hash": hash_token(token), "token": None}).eq("id", row_id).eq("token", token)
+    response = await _returning(query, "id").execute()
+    return bool(response.data)
+
+async def check_legacy_tokens():
+    """
+    Keep the raw-token retries only for tables that still have a raw-token row (one
+    indexed query per table, see sql/token_hash.sql). A table stays flagged if the check fails.
+    """
+    for table in _legacy_tokens:
+        try:
+            _legacy_tokens[table] = bool(await legacy_token_rows(table, 1))
+        except Exception:
+            logger.warning("Could not check for raw tokens; keeping raw-token lookups",
+                           exc_info=True, extra={"table": table})
+
+def mark_tokens_migrated(table: str):
+    """Stop retrying lookups in table by raw token once no row holds one"""
+    _legacy_tokens[table] = False
+
+def legacy_tokens_remaining() -> Dict[str, bool]:
+    return dict(_legacy_tokens)
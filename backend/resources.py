@@ -0,0 +1,272 @@
+# Application resources: everything the API keeps between requests
+#
+# One Resources object per worker process owns the connection pools (PostgREST,
+# SendGrid), the in-process caches, the login rate limiter, the password hash
+# pool and the background tasks (outbox worker, reaper, migrations, event loop
+# monitor). main.lifespan builds it from config, starts it before the first
+# request and closes it at shutdown; nothing is created at import time.
+#
+# Every part is also a FastAPI dependency (dependencies.py), so tests can override
+# any of them (app.dependency_overrides) or hand the lifespan a whole Resources
+# built with fakes:
+#   app.state.resources = Resources.from_config(login_limiter=MemoryRateLimiter(max_keys=100))
+# Code outside the route signatures (repository, security, profiles) reads
+# current(): during a request, the app's Resources with any overridden parts
+# swapped in (dependencies.bind_resources); otherwise the app's Resources.
+
+import asyncio
+import copy
+import logging
+from contextvars import ContextVar
+from typing import TYPE_CHECKING, Any, Dict, Optional
+
+from config import (
+    SUPABASE_URL, SUPABASE_KEY, SENDGRID_API_KEY, SENDGRID_API_HOST, DB_POOL_SIZE, DB_TIMEOUT_SECONDS,
+    DB_CONNECT_TIMEOUT_SECONDS, DB_POOL_TIMEOUT_SECONDS, TOKEN_CACHE_TTL_SECONDS, TOKEN_CACHE_MAX_SIZE,
+    TOKEN_CACHE_NEGATIVE_TTL_SECONDS, ACCOUNT_CACHE_TTL_SECONDS, ACCOUNT_CACHE_MAX_SIZE,
+    ACCESS_TOKEN_TTL_SECONDS, HASH_POOL_KIND, HASH_POOL_WORKERS, HASH_POOL_MAX_QUEUE,
+    RATE_LIMIT_BACKEND, RATE_LIMIT_MAX_KEYS, RATE_LIMIT_SQLITE_PATH, RATE_LIMIT_REDIS_URL,
+    PASSWORD_HASH_ALGORITHM, PASSWORD_HASH_COST, PASSWORD_HASH_TARGET_MS, SCRYPT_BLOCK_SIZE,
+    SCRYPT_PARALLELISM, ARGON2_MEMORY_KIB, ARGON2_PARALLELISM, EMAIL_TRANSPORT, EMAIL_OUTBOX_BACKEND,
+    EMAIL_MAX_ATTEMPTS, EMAIL_RETRY_BASE_SECONDS, EMAIL_RETRY_MAX_SECONDS, REAPER_ENABLED,
+    REAPER_INTERVAL_SECONDS, REAPER_BATCH_SIZE, REAPER_MAX_BATCHES, REAPER_JITTER,
+    PASSWORD_HASH_MIGRATION_ENABLED, PASSWORD_HASH_MIGRATION_BATCH_SIZE, TOKEN_HASH_MIGRATION_ENABLED,
+    TOKEN_HASH_MIGRATION_BATCH_SIZE, LOOP_MONITOR_ENABLED, LOOP_MONITOR_INTERVAL_SECONDS,
+    LOOP_BLOCK_THRESHOLD_SECONDS, LOOP_MONITOR_MAX_REPORTS
+)
+
+if TYPE_CHECKING:
+    from cache import AccountProfileCache, SessionTokenCache
+    from database import PooledPostgrestClient
+    from emailservice import SendGridClient
+    from hashmigration import PasswordHashMigration
+    from loopmonitor import LoopMonitor
+    from outbox import Outbox
+    from passwords import PasswordHasher
+    from ratelimit import RateLimiter
+    from reaper import Reaper
+    from tokenmigration import TokenHashMigration
+    from tokens import TokenDenylist
+    from workerpool import WorkerPool
+
+logger = logging.getLogger(__name__)
+
+
+class Resources:
+    """Pools, caches, rate limiter and background tasks of one worker process"""
+
+    def __init__(
+        self,
+        db: "PooledPostgrestClient",
+        token_cache: "SessionTokenCache",
+        account_cache: "AccountProfileCache",
+        denylist: "TokenDenylist",
+        login_limiter: "RateLimiter",
+        password_hasher: "PasswordHasher",
+        hash_pool: "WorkerPool",
+        outbox: "Outbox",
+        reaper: "Reaper",
+        password_migration: "PasswordHashMigration",
+        token_migration: "TokenHashMigration",
+        loop_monitor: "LoopMonitor",
+        sendgrid: Optional["SendGridClient"] = None,
+    ):
+        self.db = db
+        self.token_cache = token_cache
+        self.account_cache = account_cache
+        self.denylist = denylist
+        self.login_limiter = login_limiter
+        self.password_hasher = password_hasher
+        self.hash_pool = hash_pool
+        self.outbox = outbox
+        self.reaper = reaper
+        self.password_migration = password_migration
+        self.token_migration = token_migration
+        self.loop_monitor = loop_monitor
+        self._sendgrid = sendgrid
+        self.calibration: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_config(cls, **overrides) -> "Resources":
+        """Build every resource from config; keyword arguments replace individual ones (e.g. fakes)"""
+        # Imported here, not at the top: these modules read current() from this one
+        import httpx
+        from cache import AccountProfileCache, SessionTokenCache
+        from database import PooledPostgrestClient
+        from emailservice import create_transport
+        from hashmigration import PasswordHashMigration
+        from loopmonitor import LoopMonitor
+        from outbox import Outbox, create_store
+        from passwords import PasswordHasher
+        from ratelimit import create_rate_limiter
+        from reaper import Reaper
+        from tokenmigration import TokenHashMigration
+        from tokens import TokenDenylist
+        from workerpool import WorkerPool
+
+        factories = {
+            # One bounded keep-alive pool for every Supabase request of this process
+            "db": lambda: PooledPostgrestClient(
+                f"{SUPABASE_URL}/rest/v1",
+                SUPABASE_KEY,
+                pool_size=DB_POOL_SIZE,
+                timeout=httpx.Timeout(
+                    DB_TIMEOUT_SECONDS,
+                    connect=DB_CONNECT_TIMEOUT_SECONDS,
+                    pool=DB_POOL_TIMEOUT_SECONDS
+                ),
+            ),
+            # Validated session tokens, keyed by token digest (see security.validate_token)
+            "token_cache": lambda: SessionTokenCache(
+                maxsize=TOKEN_CACHE_MAX_SIZE,
+                ttl=TOKEN_CACHE_TTL_SECONDS,
+                negative_ttl=TOKEN_CACHE_NEGATIVE_TTL_SECONDS
+            ),
+            "account_cache": lambda: AccountProfileCache(
+                maxsize=ACCOUNT_CACHE_MAX_SIZE,
+                ttl=ACCOUNT_CACHE_TTL_SECONDS,
+                fill_window=DB_TIMEOUT_SECONDS
+            ),
+            "denylist": lambda: TokenDenylist(ttl=ACCESS_TOKEN_TTL_SECONDS),
+            # Failed login tracking; backend chosen by RATE_LIMIT_BACKEND
+            "login_limiter": lambda: create_rate_limiter(
+                RATE_LIMIT_BACKEND,
+                max_keys=RATE_LIMIT_MAX_KEYS,
+                sqlite_path=RATE_LIMIT_SQLITE_PATH,
+                redis_url=RATE_LIMIT_REDIS_URL
+            ),
+            # Algorithm and cost for new password hashes (cost calibrated at startup when "auto")
+            "password_hasher": lambda: PasswordHasher(
+                algorithm=PASSWORD_HASH_ALGORITHM,
+                cost=None if PASSWORD_HASH_COST == "auto" else int(PASSWORD_HASH_COST),
+                target_seconds=PASSWORD_HASH_TARGET_MS / 1000,
+                scrypt_block_size=SCRYPT_BLOCK_SIZE,
+                scrypt_parallelism=SCRYPT_PARALLELISM,
+                argon2_memory_kib=ARGON2_MEMORY_KIB,
+                argon2_parallelism=ARGON2_PARALLELISM
+            ),
+            # Password hashing runs here so it never blocks the event loop
+            "hash_pool": lambda: WorkerPool(
+                name="hash",
+                kind=HASH_POOL_KIND,
+                max_workers=HASH_POOL_WORKERS,
+                max_queue=HASH_POOL_MAX_QUEUE
+            ),
+            "outbox": lambda: Outbox(
+                store=create_store(EMAIL_OUTBOX_BACKEND),
+                transport=create_transport(EMAIL_TRANSPORT),
+                max_attempts=EMAIL_MAX_ATTEMPTS,
+                retry_base=EMAIL_RETRY_BASE_SECONDS,
+                retry_max=EMAIL_RETRY_MAX_SECONDS,
+            ),
+            "reaper": lambda: Reaper(
+                interval=REAPER_INTERVAL_SECONDS,
+                batch_size=REAPER_BATCH_SIZE,
+                max_batches=REAPER_MAX_BATCHES,
+                jitter=REAPER_JITTER,
+            ),
+            "password_migration": lambda: PasswordHashMigration(batch_size=PASSWORD_HASH_MIGRATION_BATCH_SIZE),
+            "token_migration": lambda: TokenHashMigration(batch_size=TOKEN_HASH_MIGRATION_BATCH_SIZE),
+            "loop_monitor": lambda: LoopMonitor(
+                interval=LOOP_MONITOR_INTERVAL_SECONDS,
+                threshold=LOOP_BLOCK_THRESHOLD_SECONDS,
+                max_reports=LOOP_MONITOR_MAX_REPORTS,
+            ),
+        }
+        unknown = set(overrides) - set(factories) - {"sendgrid"}
+        if unknown:
+            raise TypeError(f"Unknown resources: {', '.join(sorted(unknown))}")
+        built = {name: overrides[name] if name in overrides else factory() for name, factory in factories.items()}
+        return cls(**built, sendgrid=overrides.get("sendgrid"))
+
+    @property
+    def sendgrid(self) -> "SendGridClient":
+        """The SendGrid API client, created on first use (workers that never send don't open it)"""
+        if self._sendgrid is None:
+            from emailservice import SendGridClient
+            self._sendgrid = SendGridClient(SENDGRID_API_KEY, SENDGRID_API_HOST)
+        return self._sendgrid
+
+    async def start(self):
+        """Make these the current resources and start the background tasks enabled in config"""
+        global _current
+        _current = self
+        # Calibrating takes a few hashes; the first requests don't wait for it. Hashes made
+        # before it finishes use the default cost and are upgraded at a later login.
+        from security import calibrate_password_hashing
+        self.calibration = asyncio.create_task(calibrate_password_hashing(), name="password-calibration")
+        # Before the first request, so lookups only retry by raw token where such rows remain
+        import repository
+        await repository.check_legacy_tokens()
+        await self.outbox.start()
+        if LOOP_MONITOR_ENABLED:
+            await self.loop_monitor.start()
+        if REAPER_ENABLED:
+            await self.reaper.start()
+        if PASSWORD_HASH_MIGRATION_ENABLED:
+            await self.password_migration.start()
+        if TOKEN_HASH_MIGRATION_ENABLED:
+            await self.token_migration.start()
+
+    async def close(self):
+        """
+        Stop the background tasks, then close the pools they use: the outbox
+        finishes its in-flight deliveries before the SendGrid pool closes, and
+        the database pool closes last.
+        """
+        global _current
+        if self.calibration is not None:
+            self.calibration.cancel()
+        await self.reaper.stop()
+        await self.password_migration.stop()
+        await self.token_migration.stop()
+        await self.loop_monitor.stop()
+        await self.outbox.stop()
+        await self.hash_pool.shutdown()
+        await self.login_limiter.close()
+        if self._sendgrid is not None:
+            await self._sendgrid.aclose()
+            self._sendgrid = None
+        await self.db.aclose()
+        if _current is self:
+            _current = None
+
+    def replacing(self, **parts) -> "Resources":
+        """These resources with some parts swapped, e.g. by dependency overrides; self if none differ"""
+        changed = {name: value for name, value in parts.items() if getattr(self, name) is not value}
+        if not changed:
+            return self
+        view = copy.copy(self)
+        view.__dict__.update(changed)
+        return view
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "token_cache": self.token_cache.stats(),
+            "account_cache": self.account_cache.stats(),
+            "hash_pool": self.hash_pool.stats(),
+            "password_hashing": self.password_hasher.describe(),
+            "email_outbox": self.outbox.stats(),
+            "reaper": self.reaper.stats(),
+            "password_migration": self.password_migration.stats(),
+            "token_migration": self.token_migration.stats(),
+            "loop_monitor": self.loop_monitor.stats(),
+        }
+
+
+# The resources of the running app, set by Resources.start()
+_current: Optional[Resources] = None
+
+# The resources of the request being handled (each request runs in its own task)
+_request_resources: ContextVar[Optional[Resources]] = ContextVar("request_resources", default=None)
+
+def bind_request(resources: Resources):
+    """Make resources what current() returns for the rest of this request"""
+    _request_resources.set(resources)
+
+def current() -> Resources:
+    """This request's Resources, else the running app's; RuntimeError outside the app's lifespan"""
+    resources = _request_resources.get() or _current
+    if resources is None:
+        raise RuntimeError("Application resources are not started (see main.lifespan)")
+    return resources
@@ -1,23 +1,37 @@
 # Account management routes: get, update, delete accounts
 
-from fastapi import APIRouter, HTTPException, Depends
-from typing import Optional
+from fastapi import APIRouter, HTTPException, Depends, Request, Response
+from fastapi.responses import JSONResponse
+from typing import List, Optional
 
-from models import AccountResponse
-from database import supabase
-from dependencies import get_current_account
+from models import AccountResponse, SessionResponse
+import repository
+from dependencies import get_current_account, get_bearer_token
+from security import delete_account_sessions, list_account_sessions, revoke_account_session
+from profiles import get_account_profile, get_account_profile_entry, update_account_profile, invalidate_account_profile
+from httpcache import etag_matches
 
 router = APIRouter(prefix="/accounts", tags=["Accounts"])
 
-@router.get("/me", response_model=AccountResponse)
-async def get_my_account(account_id: int = Depends(get_current_account)):
-    response = supabase.table("userAccount").select("id, name, email, phone, date_of_birth").eq("id", account_id).execute()
+# Profiles are per user and must be revalidated on every use (If-None-Match -> 304)
+PROFILE_CACHE_CONTROL = "private, no-cache"
+
+async def _profile_response(request: Request, account_id: int) -> Response:
+    """The account profile with its ETag; 304 if the client's copy is current"""
+    entry = await get_account_profile_entry(account_id)
     
-    if not response.data:
+    if not entry:
         raise HTTPException(status_code=404, detail="Account not found")
     
-    account = response.data[0]
-    return account
+    profile, etag = entry
+    headers = {"ETag": etag, "Cache-Control": PROFILE_CACHE_CONTROL}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(content=profile, headers=headers)
+
+@router.get("/me", response_model=AccountResponse)
+async def get_my_account(request: Request, account_id: int = Depends(get_current_account)):
+    return await _profile_response(request, account_id)
 
 @router.put("/me")
 async def update_my_account(
@@ -37,31 +51,40 @@ async def update_my_account(
     if phone:
         updates["phone"] = phone
     
-    supabase.table("userAccount").update(updates).eq("id", account_id).execute()
+    updated_account = await update_account_profile(account_id, updates)
     
-    response = supabase.table("userAccount").select("id, name, email, phone, date_of_birth").eq("id", account_id).execute()
-    updated_account = response.data[0]
+    if not updated_account:
+        raise HTTPException(status_code=404, detail="Account not found")
     
     return {
         "message": "Account updated successfully",
         "account": updated_account
     }
 
+@router.get("/me/sessions", response_model=List[SessionResponse])
+async def get_my_sessions(
+    account_id: int = Depends(get_current_account),
+    token: str = Depends(get_bearer_token)):
+    """List the caller's live sessions (newest first); current marks the one making this request"""
+    return await list_account_sessions(account_id, token)
+
+@router.delete("/me/sessions/{session_id}")
+async def delete_my_session(session_id: int, account_id: int = Depends(get_current_account)):
+    """Revoke one of the caller's sessions (e.g. sign out a lost device)"""
+    if not await revoke_account_session(account_id, session_id):
+        raise HTTPException(status_code=404, detail="Session not found")
+    
+    return {"message": "Session revoked"}
+
 @router.get("/{account_id}", response_model=AccountResponse)
-async def get_account(account_id: int, current_account_id: int = Depends(get_current_account)):
+async def get_account(request: Request, account_id: int, current_account_id: int = Depends(get_current_account)):
     if account_id != current_account_id:
         raise HTTPException(
             status_code=403,
             detail="You can only view your own account"
         )
     
-    response = supabase.table("userAccount").select("id, name, email, phone, date_of_birth").eq("id", account_id).execute()
-    
-    if not response.data:
-        raise HTTPException(status_code=404, detail="Account not found")
-    
-    account = response.data[0]
-    return account
+    return await _profile_response(request, account_id)
 
 @router.delete("/{account_id}")
 async def delete_account(
@@ -73,11 +96,11 @@ async def delete_account(
             detail="You can only delete your own account"
         )
     
-    resp = supabase.table("userAccount").select("id").eq("id", account_id).execute()
-    if not resp.data:
+    if not await get_account_profile(account_id):
         raise HTTPException(status_code=404, detail="Account not found")
     
-    supabase.table("sessions").delete().eq("account_id", account_id).execute()
-    supabase.table("userAccount").delete().eq("id", account_id).execute()
+    await delete_account_sessions(account_id)
+    await repository.delete_account(account_id)
+    invalidate_account_profile(account_id)
     
     return {"message": "Account deleted successfully"}
\ No newline at end of file
@@ -1,19 +1,72 @@
 # Admin routes for administrative tasks (debugging/testing)
 
-from fastapi import APIRouter, HTTPException, Depends, status
-from typing import List
+import json
+from datetime import datetime
+from fastapi import APIRouter, HTTPException, Depends, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
+from typing import AsyncIterator, List, Optional
 from models import AccountResponse
-from database import supabase
-from dependencies import get_current_account
+import repository
+from loopmonitor import LoopMonitor
+from dependencies import get_current_account, get_loop_monitor
 
 router = APIRouter(prefix="/admin", tags=["Admin"])
 
+# Page size used internally when streaming the whole table as NDJSON
+EXPORT_PAGE_SIZE = 500
+
+async def _stream_accounts(
+    after_id: Optional[int],
+    email_prefix: Optional[str],
+    created_after: Optional[datetime]) -> AsyncIterator[str]:
+    # Walk the table page by page so memory stays constant however many rows there are
+    while True:
+        page = await repository.list_accounts_page(after_id, EXPORT_PAGE_SIZE, email_prefix, created_after)
+        if not page:
+            return
+        yield "".join(AccountResponse(**account).model_dump_json() + "\n" for account in page)
+        if len(page) < EXPORT_PAGE_SIZE:
+            return
+        after_id = page[-1]["id"]
+
 @router.get("/accounts", response_model=List[AccountResponse])
-async def get_all_accounts(account_id: int = Depends(get_current_account)):
-    # Retrieve all accounts (for debugging/testing).
-    response = supabase.table("userAccount").select("id, name, email, phone, date_of_birth").execute()
+async def get_all_accounts(
+    request: Request,
+    response: Response,
+    after_id: Optional[int] = Query(None, description="Return accounts with id greater than this"),
+    limit: int = Query(100, ge=1, le=1000),
+    email_prefix: Optional[str] = Query(None, pattern=r"^[^*]*$"),
+    created_after: Optional[datetime] = None,
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+    account_id: int = Depends(get_current_account)):
+    # Retrieve accounts (for debugging/testing), one page at a time ordered by id.
+    # format=ndjson streams every matching account (from after_id on) as newline-delimited JSON.
+    if format == "ndjson":
+        return StreamingResponse(
+            _stream_accounts(after_id, email_prefix, created_after),
+            media_type="application/x-ndjson"
+        )
     
-    if not response.data:
-        return []
+    # Fetch one extra row to learn whether there is a next page
+    accounts = await repository.list_accounts_page(after_id, limit + 1, email_prefix, created_after)
+    if len(accounts) > limit:
+        accounts = accounts[:limit]
+        next_after_id = accounts[-1]["id"]
+        next_url = request.url.include_query_params(after_id=next_after_id)
+        response.headers["X-Next-After-Id"] = str(next_after_id)
+        response.headers["Link"] = f'<{next_url}>; rel="next"'
     
-    return [AccountResponse(**account) for account in response.data]
\ No newline at end of file
+    return [AccountResponse(**account) for account in accounts]
+
+
+@router.get("/diagnostics")
+async def get_diagnostics(
+    top: int = Query(10, ge=1, le=100),
+    recent: int = Query(10, ge=0, le=100),
+    account_id: int = Depends(get_current_account),
+    loop_monitor: LoopMonitor = Depends(get_loop_monitor)):
+    # Event loop lag and the call sites that blocked it (LOOP_MONITOR_ENABLED=true)
+    summary = loop_monitor.summary(top, recent)
+    if not summary["running"]:
+        summary["detail"] = "Event loop monitor is off; set LOOP_MONITOR_ENABLED=true to enable it"
+    return summary
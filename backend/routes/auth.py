@@ -1,166 +1,147 @@
-# Authentication routes: register, login, logout, password reset
+# Authentication routes: register, login, token refresh, logout, password reset
 
-from fastapi import APIRouter, HTTPException, Depends, status
+from fastapi import APIRouter, HTTPException, Depends, Request, status
 from datetime import datetime, timedelta
 import secrets
-import binascii
+import logging
 
 from models import (
-    AccountCreate, AccountLogin, LoginResponse, 
+    AccountCreate, AccountLogin, LoginResponse, RefreshResponse,
     ForgotPasswordRequest, PasswordResetRequest, TokenRequest
 )
-from database import supabase
+import repository
+from repository import EmailTakenError
 from security import (
-    hash_password, verify_password, generate_token, generate_expiry,
-    save_session, delete_session, check_rate_limit, increment_login_attempts, 
-    reset_login_attempts, get_lockout_time_remaining, LOCKOUT_SECONDS
+    hash_password_async, verify_account_password, generate_token, generate_expiry,
+    session_tokens, start_session, refresh_access_token, delete_session, forget_account_sessions, get_login_lockout,
+    record_failed_login, clear_failed_logins, parse_timestamp
 )
-from emailservice import send_reset_email, send_welcome_email
-from dependencies import get_current_account
+from outbox import Outbox
+from ratelimit import RateLimiter
+from profiles import invalidate_account_profile
+from dependencies import get_current_account, get_bearer_token, get_outbox, get_login_limiter
+from config import TOKEN_MODE
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/auth", tags=["Authentication"])
 
-@router.post("/register", response_model=LoginResponse, status_code=201)
-async def register(account: AccountCreate):
-    print(f"\n📝 Registration attempt for: {account.email}")
+@router.post("/register", response_model=LoginResponse, response_model_exclude_none=True, status_code=201)
+async def register(account: AccountCreate, outbox: Outbox = Depends(get_outbox)):
+    logger.debug("Registration attempt", extra={"event": "register.attempt", "email": account.email})
     
-    response = supabase.table("userAccount").select("id").eq("email", account.email).execute()
-    if response.data:
-        raise HTTPException(
-            status_code=400,
-            detail="Email already registered"
-        )
-        
-    password_hash = hash_password(account.password)
-    password_hash_str = binascii.hexlify(password_hash).decode()
+    password_hash = await hash_password_async(account.password)
     
     insert_data = {
         "name": account.name,
         "email": account.email,
         "phone": account.phone,
         "date_of_birth": account.date_of_birth,
-        "password": password_hash_str
+        "password": password_hash
     }
     
-    resp = supabase.table("userAccount").insert(insert_data).execute()
-    account_id = resp.data[0]["id"]
-    print(f"✅ Account created with ID: {account_id}")
-    
+    # Account and first session are created together in one round trip
     token = generate_token()
-    expires_at = generate_expiry()
-    save_session(account_id, token, expires_at)
+    try:
+        created_account = await repository.create_account_with_session(insert_data, token, generate_expiry())
+    except EmailTakenError:
+        raise HTTPException(
+            status_code=400,
+            detail="Email already registered"
+        )
+    session_id = created_account.pop("session_id")
+    logger.info("Account created", extra={"event": "register.success", "account_id": created_account["id"]})
     
-    resp = supabase.table("userAccount").select("id, name, email, phone, date_of_birth").eq("id", account_id).execute()
-    created_account = resp.data[0]
+    tokens = session_tokens(created_account["id"], token, session_id)
     
-    # Optionally send welcome email (non-blocking)
+    # Queue welcome email; delivered in the background by the outbox worker
     try:
-        send_welcome_email(account.email, account.name)
-    except Exception as e:
-        print(f"Warning: Could not send welcome email: {e}")
+        await outbox.enqueue("welcome", account.email, account.name)
+    except Exception:
+        logger.warning("Could not queue welcome email", exc_info=True, extra={"account_id": created_account["id"]})
     
     return {
         "message": "Account created successfully",
-        "token": token,
-        "account": created_account
+        "account": created_account,
+        **tokens
     }
 
-@router.post("/login", response_model=LoginResponse)
-async def login(credentials: AccountLogin):
-    print(f"\n🔑 Login attempt for: {credentials.email}")
-    
-    # Check rate limiting
-    if check_rate_limit(credentials.email):
-        lockout_remaining = get_lockout_time_remaining(credentials.email)
+@router.post("/login", response_model=LoginResponse, response_model_exclude_none=True)
+async def login(credentials: AccountLogin, request: Request, limiter: RateLimiter = Depends(get_login_limiter)):
+    logger.debug("Login attempt", extra={"event": "login.attempt", "email": credentials.email})
+    client_ip = request.client.host if request.client else None
+    
+    # Check rate limiting (per email and per client IP)
+    lockout_remaining = await get_login_lockout(limiter, credentials.email, client_ip)
+    if lockout_remaining:
         lockout_minutes = (lockout_remaining + 59) // 60  # Round up to next minute
         raise HTTPException(
             status_code=429,
             detail=f"Too many failed login attempts. Try again in {lockout_minutes} minute(s)."
         )
     
-    response = supabase.table("userAccount").select("id, name, email, phone, password, date_of_birth").eq("email", credentials.email).execute()
+    account = await repository.get_account_by_email(credentials.email, columns="id, name, email, phone, password, date_of_birth")
     
-    if not response.data:
-        print(f"❌ No account found for: {credentials.email}")
-        increment_login_attempts(credentials.email)
+    if not account:
+        logger.info("Login failed", extra={"event": "login.failure", "reason": "no_account", "email": credentials.email})
+        await record_failed_login(limiter, credentials.email, client_ip)
         raise HTTPException(
             status_code=401,
             detail="Invalid email or password"
         )
         
-    account = response.data[0]
-    print(f"✓ Account found - ID: {account['id']}")
-    
-    stored_password = account['password']
-    print(f"Stored password (first 20 chars): {stored_password[:20] if len(stored_password) > 20 else stored_password}...")
-    print(f"Stored password length: {len(stored_password)}")
-    
-    # Check if password is stored as plain text (legacy) or hashed (proper)
-    password_valid = False
-    
-    if len(stored_password) == 120:
-        # Proper bcrypt hash (hex-encoded, 120 characters)
-        print("Detected hashed password (120 chars)")
-        try:
-            stored_hash = binascii.unhexlify(stored_password)
-            password_valid = verify_password(credentials.password, stored_hash)
-            print(f"Hash verification result: {password_valid}")
-        except binascii.Error as e:
-            print(f"Error decoding hex hash: {e}")
-            password_valid = False
-    else:
-        # Legacy plain text password (should be upgraded)
-        password_valid = (credentials.password == stored_password)
-        
-        # If login succeeds with plain text password, automatically upgrade to hashed
-        if password_valid:
-            print("⚠️ Upgrading plain text password to bcrypt hash")
-            new_hash = hash_password(credentials.password)
-            new_hash_str = binascii.hexlify(new_hash).decode()
-            supabase.table("userAccount").update({
-                'password': new_hash_str
-            }).eq("id", account['id']).execute()
-            print("✅ Password upgraded to bcrypt hash")
+    password_valid = await verify_account_password(account['id'], credentials.password, account['password'])
     
     if not password_valid:
-        print(f"❌ Password verification failed for: {credentials.email}")
-        increment_login_attempts(credentials.email)
+        logger.info("Login failed", extra={"event": "login.failure", "reason": "bad_password", "account_id": account["id"]})
+        await record_failed_login(limiter, credentials.email, client_ip)
         raise HTTPException(
             status_code=401,
             detail="Invalid email or password"
         )
     
-    print(f"✅ Login successful for: {credentials.email}")
+    logger.info("Login successful", extra={"event": "login.success", "account_id": account["id"]})
     
     # Reset rate limiting on successful login
-    reset_login_attempts(credentials.email)
-    
-    # Update last login timestamp (if table has this column)
-    try:
-        supabase.table("userAccount").update({
-            'last_login': datetime.now().isoformat()
-        }).eq("id", account['id']).execute()
-    except Exception:
-        pass  # Column may not exist in the database
+    await clear_failed_logins(limiter, credentials.email)
     
-    token = generate_token()
-    expires_at = generate_expiry()
-    save_session(account['id'], token, expires_at)
+    # Create the session and update the last login timestamp in one round trip
+    tokens = await start_session(account['id'])
     
     account_dict = {k: v for k, v in account.items() if k != 'password'}
     
     return {
         "message": "Login successful",
-        "token": token,
-        "account": account_dict
+        "account": account_dict,
+        **tokens
     }
 
+@router.post("/refresh", response_model=RefreshResponse)
+async def refresh(request: TokenRequest):
+    """
+    Exchange a refresh token for a new short-lived access token (TOKEN_MODE=signed only).
+    """
+    if TOKEN_MODE != "signed":
+        raise HTTPException(
+            status_code=400,
+            detail="Token refresh is not enabled"
+        )
+    
+    tokens = await refresh_access_token(request.token)
+    if not tokens:
+        raise HTTPException(
+            status_code=401,
+            detail="Invalid or expired refresh token"
+        )
+    return tokens
+
 @router.post("/logout")
-async def logout(account_id: int = Depends(get_current_account)):
+async def logout(account_id: int = Depends(get_current_account), token: str = Depends(get_bearer_token)):
     """
     Logout current user by invalidating their token.
     Requires: Authorization header with Bearer token
     """
+    await delete_session(token)
     return {"message": "Logout successful"}
 
 @router.post("/logout/token")
@@ -169,116 +150,82 @@ async def logout_with_token(request: TokenRequest):
     Alternative logout endpoint that accepts token in request body.
     Use this if you prefer sending token in body instead of header.
     """
-    delete_session(request.token)
+    await delete_session(request.token)
     return {"message": "Logout successful"}
 
 @router.post("/password/forgot")
-async def forgot_password(request: ForgotPasswordRequest):
+async def forgot_password(request: ForgotPasswordRequest, outbox: Outbox = Depends(get_outbox)):
     """
-    Request password reset. Generates token, stores in database, and sends email.
+    Request password reset. Generates token, stores in database, and queues the email.
     """
-    response = supabase.table("userAccount").select("id, email, name").eq("email", request.email).execute()
+    # Generate secure reset token
+    reset_token = secrets.token_urlsafe(32)
+    expires_at = (datetime.now() + timedelta(hours=1)).isoformat()
     
-    if response.data:
-        account = response.data[0]
-        
-        # Delete any old unused tokens for this account
-        supabase.table("password_reset_tokens").delete().eq("account_id", account['id']).eq("used", False).execute()
-        
-        # Generate secure reset token
-        reset_token = secrets.token_urlsafe(32)
-        expires_at = (datetime.now() + timedelta(hours=1)).isoformat()
-        
-        # Save new token to database
-        supabase.table("password_reset_tokens").insert({
-            "account_id": account['id'],
-            "token": reset_token,
-            "expires_at": expires_at
-        }).execute()
-        
+    # Look up the account, drop its old unused tokens and save the new one in one round trip
+    account = await repository.create_reset_token(request.email, reset_token, expires_at)
+    
+    if account:
         # Build reset link (can be configured for deep link or HTTPS redirect)
         reset_link = f"lucaapp://reset-password?token={reset_token}"
         
-        print(f"\n🔐 Password Reset Requested")
-        print(f"   Email: {account['email']}")
-        print(f"   Name: {account['name']}")
-        print(f"   Reset Token: {reset_token}")
-        print(f"   Reset Link: {reset_link}")
-        print(f"   Expires: {datetime.now() + timedelta(hours=1)}")
+        logger.info("Password reset requested", extra={
+            "event": "password_reset.requested", "account_id": account["id"], "expires_at": expires_at
+        })
         
-        # Send email with reset link
-        send_reset_email(
+        # Queue email with reset link; delivered in the background by the outbox worker
+        await outbox.enqueue(
+            "reset",
             to_email=account['email'],
             to_name=account['name'],
             reset_link=reset_link
         )
     else:
-        print(f"\n⚠️ Password reset requested for non-existent email: {request.email}")
+        logger.info("Password reset requested for unknown email", extra={"event": "password_reset.unknown_email"})
     
     # Always return same message (security best practice)
     return {
         "message": "If this email exists, a reset link has been sent."
     }
 
+def _reset_failed(reason: str, detail: str):
+    logger.info("Password reset failed", extra={"event": "password_reset.failure", "reason": reason})
+    raise HTTPException(
+        status_code=400,
+        detail=detail
+    )
+
 @router.post("/password/reset")
 async def reset_password(request: PasswordResetRequest):
     """
     Reset password using a valid reset token.
     Token must be unused and not expired.
     """
-    print(f"\n🔑 Password reset attempt with token: {request.token[:10]}...")
-    
-    resp = supabase.table("password_reset_tokens").select("id, account_id, expires_at, used").eq("token", request.token).execute()
-    
-    if not resp.data:
-        print(f"❌ Invalid token")
-        raise HTTPException(
-            status_code=400,
-            detail="Invalid reset token"
-        )
-    
-    token_record = resp.data[0]
-    
-    # Check if token already used
+    # Check the token with one cheap read before hashing, so requests with a bad
+    # token never take a slot in the hash pool
+    token_record = await repository.get_reset_token(request.token)
+    if not token_record:
+        _reset_failed("invalid_token", "Invalid reset token")
     if token_record['used']:
-        print(f"❌ Token already used")
-        raise HTTPException(
-            status_code=400,
-            detail="Reset token has already been used"
-        )
-    
-    # Check token expiration
-    expires_at = datetime.fromisoformat(token_record['expires_at'])
-    if datetime.now() > expires_at:
-        print(f"❌ Token expired at {expires_at}")
-        raise HTTPException(
-            status_code=400,
-            detail="Reset token has expired. Please request a new reset link."
-        )
-    
-    # Get account info for logging
-    resp_a = supabase.table("userAccount").select("email, name").eq("id", token_record['account_id']).execute()
-    if not resp_a.data:
-        raise HTTPException(status_code=400, detail="Invalid reset token")
-    account = resp_a.data[0]
-    
-    print(f"✓ Valid token for: {account['email']}")
+        _reset_failed("token_used", "Reset token has already been used")
+    if datetime.now() > parse_timestamp(token_record['expires_at']):
+        _reset_failed("token_expired", "Reset token has expired. Please request a new reset link.")
     
-    # Hash the new password
-    new_password_hash = hash_password(request.new_password)
-    new_password_hash_str = binascii.hexlify(new_password_hash).decode()
+    # Hash before consuming, so a busy hash pool (503) or a failed hash leaves the token unused for a retry
+    new_password_hash = await hash_password_async(request.new_password)
     
-    # Update the password
-    supabase.table("userAccount").update({'password': new_password_hash_str}).eq("id", token_record['account_id']).execute()
+    # Consume the token, update the password and delete all sessions (force re-login
+    # everywhere) in one transaction; of two concurrent resets with the same token only one succeeds
+    account_id = await repository.reset_password_with_token(request.token, new_password_hash)
     
-    # Mark token as used
-    supabase.table("password_reset_tokens").update({'used': True}).eq("id", token_record['id']).execute()
+    if account_id is None:
+        # Used, expired or deleted since the check above
+        _reset_failed("token_used", "Reset token has already been used")
     
-    # Delete all active sessions for this account (force re-login everywhere)
-    supabase.table("sessions").delete().eq("account_id", token_record['account_id']).execute()
+    forget_account_sessions(account_id)
+    invalidate_account_profile(account_id)
     
-    print(f"✅ Password reset successful for: {account['email']}")
-    print(f"   All sessions deleted (user must re-login)")
+    logger.info("Password reset; all sessions deleted", extra={"event": "password_reset.success", "account_id": account_id})
     
     return {
         "message": "Password reset successfully. Please log in with your new password."
@@ -1,30 +1,93 @@
 # Security functions for password hashing, token generation, validation, and rate limiting
 
-import bcrypt
+import asyncio
+import logging
 import secrets
-import time
 from datetime import datetime, timedelta
-from typing import Optional
-from config import TOKEN_EXPIRY_DAYS
-from database import supabase
+from typing import List, Optional
+from config import (
+    TOKEN_EXPIRY_DAYS, MAX_SESSIONS_PER_ACCOUNT, TOKEN_MODE, ACCESS_TOKEN_TTL_SECONDS, MAX_LOGIN_ATTEMPTS_PER_IP
+)
+import repository
+from cache import MISSING
+from ratelimit import RateLimiter
+from resources import current
+from tokens import hash_token, is_signed_token, issue_access_token, verify_access_token
+from passwords import decode_stored
+
+logger = logging.getLogger(__name__)
 
 # Rate limiting constants
 MAX_LOGIN_ATTEMPTS = 5
 LOCKOUT_SECONDS = 300  # 5 minutes
 
-# In-memory storage for login attempts (in production, use Redis or database)
-login_attempts = {}
+# The password hasher, hash pool, token cache and denylist belong to the running
+# app (resources.current()); the login rate limiter is passed in by the route
+
+def hash_password(password: str) -> str:
+    """Hash a password with the configured algorithm and cost (stored as-is in userAccount.password)"""
+    return current().password_hasher.hash(password)
+
+def verify_password(password: str, password_hash: str) -> bool:
+    """Verify a password against a bcrypt, scrypt or argon2id hash"""
+    return current().password_hasher.verify(password, password_hash)
+
+def password_needs_rehash(password_hash: str) -> bool:
+    """True if the hash's algorithm differs from the current settings or its cost is lower"""
+    return current().password_hasher.needs_rehash(password_hash)
+
+async def hash_password_async(password: str) -> str:
+    """hash_password on the hash pool; raises PoolSaturatedError when the pool is full"""
+    # Bound method, so a process pool receives the calibrated cost along with the call
+    resources = current()
+    return await resources.hash_pool.run("hash", resources.password_hasher.hash, password)
+
+async def verify_password_async(password: str, password_hash: str) -> bool:
+    """verify_password on the hash pool; raises PoolSaturatedError when the pool is full"""
+    resources = current()
+    return await resources.hash_pool.run("verify", resources.password_hasher.verify, password, password_hash)
+
+async def verify_account_password(account_id: int, password: str, stored: str) -> bool:
+    """
+    Check a login password against the account's stored userAccount.password value.
+    On success, plain text passwords and outdated hashes are replaced with a
+    current hash, and hex-encoded hashes are rewritten in the native format.
+    """
+    kind, password_hash = decode_stored(stored)
+    if kind == "plain":
+        valid = secrets.compare_digest(password.encode("utf-8"), stored.encode("utf-8"))
+    else:
+        try:
+            valid = await verify_password_async(password, password_hash)
+        except ValueError:
+            logger.warning("Stored password hash is malformed", extra={"account_id": account_id})
+            return False
+    if not valid:
+        return False
 
-def hash_password(password: str) -> bytes:
-    """Hash a password using bcrypt with salt rounds of 12"""
-    password_bytes = password.encode('utf-8')
-    salt = bcrypt.gensalt(rounds=12)
-    return bcrypt.hashpw(password_bytes, salt)
+    if kind == "plain" or password_needs_rehash(password_hash):
+        replacement = None
+    elif kind == "hex":
+        replacement = password_hash
+    else:
+        return True
+    try:
+        if replacement is None:
+            replacement = await hash_password_async(password)
+        # Only if the password has not changed since it was read (e.g. by a reset)
+        if await repository.replace_password_hash(account_id, stored, replacement):
+            logger.info("Upgraded stored password", extra={
+                "event": "password.rehashed", "account_id": account_id, "from": kind
+            })
+    except Exception:
+        # The login itself succeeded; try again next time
+        logger.warning("Could not upgrade stored password", exc_info=True, extra={"account_id": account_id})
+    return True
 
-def verify_password(password: str, password_hash: bytes) -> bool:
-    """Verify a password against a bcrypt hash"""
-    password_bytes = password.encode('utf-8')
-    return bcrypt.checkpw(password_bytes, password_hash)
+async def calibrate_password_hashing():
+    """Pick the hash cost for this machine (PASSWORD_HASH_COST=auto), off the event loop"""
+    result = await asyncio.to_thread(current().password_hasher.calibrate)
+    logger.info("Password hashing configured", extra={"event": "password.calibrated", **result})
 
 def generate_token() -> str:
     """Generate a secure random token"""
@@ -35,69 +98,145 @@ def generate_expiry(days: int = TOKEN_EXPIRY_DAYS) -> str:
     expiry = datetime.now() + timedelta(days=days)
     return expiry.isoformat()
 
-def save_session(account_id: int, token: str, expires_at: str):
-    """Save a session token to database"""
-    supabase.table("sessions").insert({
-        "account_id": account_id,
-        "token": token,
-        "expires_at": expires_at
-    }).execute()
+def parse_timestamp(value: str) -> datetime:
+    """Parse a timestamp returned by Supabase as a naive local datetime"""
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed
 
-def validate_token(token: str) -> Optional[int]:
-    """Validate a token and return account_id if valid, None if invalid or expired"""
-    response = supabase.table("sessions").select("account_id").eq("token", token).gt("expires_at", datetime.now().isoformat()).execute()
-    if response.data:
-        return response.data[0]["account_id"]
-    return None
+async def save_session(account_id: int, token: str, expires_at: str) -> dict:
+    """Save a session token to database"""
+    return await repository.insert_session(account_id, token, expires_at)
 
-def delete_session(token: str):
-    """Delete a session (for logout)"""
-    supabase.table("sessions").delete().eq("token", token).execute()
+def session_tokens(account_id: int, token: str, session_id: int) -> dict:
+    """
+    Tokens to hand to the client for a new session.
+    In signed mode the session token becomes the refresh token and the
+    client also gets a short-lived signed access token.
+    """
+    if TOKEN_MODE != "signed":
+        return {"token": token}
+    return {
+        "token": issue_access_token(account_id, session_id),
+        "refresh_token": token,
+        "expires_in": ACCESS_TOKEN_TTL_SECONDS,
+    }
 
-# Rate limiting functions
-def check_rate_limit(identifier: str) -> bool:
+async def start_session(account_id: int) -> dict:
     """
-    Check if identifier has exceeded rate limit.
-    Returns True if rate limit exceeded, False otherwise.
+    Create a session after a successful login (also records last_login) and return its tokens.
+    Sessions beyond MAX_SESSIONS_PER_ACCOUNT are evicted, oldest first.
     """
-    current_time = time.time()
+    token = generate_token()
+    session_id, evicted = await repository.start_session(
+        account_id, token, generate_expiry(), MAX_SESSIONS_PER_ACCOUNT
+    )
+    forget_sessions(evicted)
+    return session_tokens(account_id, token, session_id)
+
+async def refresh_access_token(refresh_token: str) -> Optional[dict]:
+    """Issue a new access token for a live refresh session, None if it is invalid"""
+    session = await repository.get_live_session(refresh_token)
+    if not session:
+        return None
+    return {
+        "token": issue_access_token(session["account_id"], session["id"]),
+        "refresh_token": refresh_token,
+        "expires_in": ACCESS_TOKEN_TTL_SECONDS,
+    }
+
+async def validate_token(token: str) -> Optional[int]:
+    """Validate a token and return account_id if valid, None if invalid or expired"""
+    if is_signed_token(token):
+        claims = verify_access_token(token)
+        return claims["sub"] if claims else None
     
-    if identifier in login_attempts:
-        attempts, last_attempt = login_attempts[identifier]
-        
-        # Reset if lockout period has passed
-        if current_time - last_attempt > LOCKOUT_SECONDS:
-            login_attempts[identifier] = (0, current_time)
-            return False
-        
-        # Check if max attempts exceeded
-        if attempts >= MAX_LOGIN_ATTEMPTS:
-            return True
+    token_cache = current().token_cache
+    key = hash_token(token)
+    cached = token_cache.lookup(key)
+    if cached is None:
+        return None
+    if cached is not MISSING:
+        return cached[0]
     
-    return False
+    session = await repository.get_live_session(token)
+    if session:
+        token_cache.store(key, session["account_id"], parse_timestamp(session["expires_at"]))
+        return session["account_id"]
+    token_cache.store_negative(key)
+    return None
+
+def forget_sessions(sessions: List[dict]):
+    """Make deleted sessions unusable right away: drop cached tokens, revoke access tokens"""
+    resources = current()
+    for session in sessions:
+        resources.denylist.revoke(session["id"])
+        if session.get("token_hash"):
+            resources.token_cache.delete(session["token_hash"])
 
-def increment_login_attempts(identifier: str):
-    """Increment login attempt counter for an identifier"""
-    current_time = time.time()
+async def delete_session(token: str):
+    """Delete a session (for logout); accepts an access token or a session/refresh token"""
+    if is_signed_token(token):
+        claims = verify_access_token(token)
+        if claims:
+            current().denylist.revoke(claims["jti"])
+            await repository.delete_session_by_id(int(claims["jti"]))
+        return
     
-    if identifier in login_attempts:
-        attempts, _ = login_attempts[identifier]
-        login_attempts[identifier] = (attempts + 1, current_time)
-    else:
-        login_attempts[identifier] = (1, current_time)
-
-def reset_login_attempts(identifier: str):
-    """Reset login attempts on successful login"""
-    if identifier in login_attempts:
-        del login_attempts[identifier]
-
-def get_lockout_time_remaining(identifier: str) -> int:
-    """Get remaining lockout time in seconds"""
-    if identifier in login_attempts:
-        attempts, last_attempt = login_attempts[identifier]
-        if attempts >= MAX_LOGIN_ATTEMPTS:
-            elapsed = time.time() - last_attempt
-            remaining = LOCKOUT_SECONDS - elapsed
-            if remaining > 0:
-                return int(remaining)
-    return 0
\ No newline at end of file
+    forget_sessions(await repository.delete_session(token))
+    current().token_cache.delete(hash_token(token))
+
+async def list_account_sessions(account_id: int, current_token: str) -> List[dict]:
+    """Live sessions of an account, newest first, flagging the one current_token belongs to"""
+    claims = verify_access_token(current_token) if is_signed_token(current_token) else None
+    current_hash = None if claims else hash_token(current_token)
+    return [
+        {
+            "id": session["id"],
+            "expires_at": session["expires_at"],
+            "current": str(session["id"]) == claims["jti"] if claims else session["token_hash"] == current_hash,
+        }
+        for session in await repository.list_live_sessions(account_id)
+    ]
+
+async def revoke_account_session(account_id: int, session_id: int) -> bool:
+    """Delete one of an account's sessions; False if it does not exist or is not theirs"""
+    deleted = await repository.delete_account_session(account_id, session_id)
+    forget_sessions(deleted)
+    return bool(deleted)
+
+async def delete_account_sessions(account_id: int):
+    """Delete every session for an account (account deletion)"""
+    await repository.delete_sessions_for_account(account_id)
+    forget_account_sessions(account_id)
+
+def forget_account_sessions(account_id: int):
+    """Stop accepting an account's tokens in this process once its sessions are deleted"""
+    resources = current()
+    resources.token_cache.invalidate_account(account_id)
+    resources.denylist.revoke_account(account_id)
+
+# Rate limiting functions
+# Failed logins are counted per email and, when MAX_LOGIN_ATTEMPTS_PER_IP is set, per
+# client IP; either one can lock out a login.
+def _login_keys(email: str, ip: Optional[str]) -> list:
+    keys = [(f"login:email:{email.lower()}", MAX_LOGIN_ATTEMPTS)]
+    if ip and MAX_LOGIN_ATTEMPTS_PER_IP:
+        keys.append((f"login:ip:{ip}", MAX_LOGIN_ATTEMPTS_PER_IP))
+    return keys
+
+async def get_login_lockout(limiter: RateLimiter, email: str, ip: Optional[str]) -> int:
+    """Seconds until this email/IP may try to log in again, 0 if not locked out"""
+    remaining = 0
+    for key, limit in _login_keys(email, ip):
+        remaining = max(remaining, await limiter.retry_after(key, limit, LOCKOUT_SECONDS))
+    return remaining
+
+async def record_failed_login(limiter: RateLimiter, email: str, ip: Optional[str]):
+    for key, limit in _login_keys(email, ip):
+        await limiter.hit(key, limit, LOCKOUT_SECONDS)
+
+async def clear_failed_logins(limiter: RateLimiter, email: str):
+    """Reset the per-email counter on successful login (the per-IP counter keeps running)"""
+    await limiter.reset(f"login:email:{email.lower()}")
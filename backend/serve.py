@@ -0,0 +1,174 @@
+# Production launcher: several uvicorn worker processes behind one listening socket
+#
+#   python serve.py                        # WEB_CONCURRENCY workers, default one per usable CPU
+#   python serve.py --workers 4 --max-requests 20000 --max-requests-jitter 2000
+#
+# The supervisor binds the socket, then starts the workers with multiprocessing
+# "spawn": each one imports main in a fresh interpreter and creates its own
+# Supabase client, email client, caches, hash pool and background tasks, so no
+# connection, SQLite handle or thread is ever inherited across a fork. The
+# supervisor itself never imports main. With several workers it calibrates the
+# password hash cost once before starting them and hands it to them, so every
+# worker hashes at the same cost instead of each timing itself while the others
+# compete for the CPU. A single worker calibrates itself in the background, which
+# keeps the measurement off the cold start.
+#
+# A worker that exits is replaced. With --max-requests a worker stops accepting
+# after that many requests (plus a random jitter, so workers do not restart
+# together), finishes what it is serving and exits; this bounds slow memory growth.
+#
+# Settings come from config.py (WEB_*), command-line options override them.
+
+import argparse
+import importlib.util
+import ipaddress
+import logging
+import os
+import random
+import sys
+
+import uvicorn
+from uvicorn.supervisors import Multiprocess
+
+from config import (
+    WEB_HOST, WEB_PORT, WEB_CONCURRENCY, WEB_LOOP, WEB_HTTP, WEB_BACKLOG, WEB_KEEPALIVE_SECONDS,
+    WEB_MAX_REQUESTS, WEB_MAX_REQUESTS_JITTER, WEB_GRACEFUL_TIMEOUT_SECONDS, WEB_ACCESS_LOG,
+    FORWARDED_ALLOW_IPS, MAX_LOGIN_ATTEMPTS_PER_IP, RATE_LIMIT_BACKEND, PASSWORD_HASH_ALGORITHM, PASSWORD_HASH_COST,
+    PASSWORD_HASH_TARGET_MS, SCRYPT_BLOCK_SIZE, SCRYPT_PARALLELISM, ARGON2_MEMORY_KIB, ARGON2_PARALLELISM
+)
+from passwords import PasswordHasher
+
+logger = logging.getLogger("serve")
+
+
+def available_cpus() -> int:
+    """CPUs this process may use: its affinity mask, capped by a cgroup v2 CPU quota (containers)"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:  # not on Linux
+        cpus = os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, int(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+def fast_path(option: str, module: str, fallback: str) -> str:
+    """Resolve uvicorn's "auto" to the implementation it will pick, for the startup log"""
+    if option != "auto":
+        return option
+    return module if importlib.util.find_spec(module) else fallback
+
+def trusts_remote_proxy(forwarded_allow_ips: str) -> bool:
+    """Whether FORWARDED_ALLOW_IPS lists any proxy other than this host"""
+    for entry in forwarded_allow_ips.split(","):
+        entry = entry.strip()
+        if not entry or entry == "localhost" or entry.startswith("unix:"):
+            continue
+        try:
+            if not ipaddress.ip_network(entry, strict=False).is_loopback:
+                return True
+        except ValueError:  # "*" or a host name
+            return True
+    return False
+
+def calibrate_password_cost():
+    """With PASSWORD_HASH_COST=auto, measure once here and pass the result to every worker"""
+    if PASSWORD_HASH_COST != "auto":
+        return
+    hasher = PasswordHasher(
+        algorithm=PASSWORD_HASH_ALGORITHM,
+        cost=None,
+        target_seconds=PASSWORD_HASH_TARGET_MS / 1000,
+        scrypt_block_size=SCRYPT_BLOCK_SIZE,
+        scrypt_parallelism=SCRYPT_PARALLELISM,
+        argon2_memory_kib=ARGON2_MEMORY_KIB,
+        argon2_parallelism=ARGON2_PARALLELISM
+    )
+    result = hasher.calibrate()
+    os.environ["PASSWORD_HASH_COST"] = str(result["cost"])
+    logger.info("Password hash cost calibrated for all workers: %s", result)
+
+
+class RecyclingServer(uvicorn.Server):
+    """uvicorn server whose request limit gets its own random jitter in each worker process"""
+
+    def __init__(self, config: uvicorn.Config, max_requests_jitter: int):
+        super().__init__(config)
+        self.max_requests_jitter = max_requests_jitter
+
+    def run(self, sockets=None):
+        # Runs in the worker after spawn, so every worker draws its own jitter
+        if self.config.limit_max_requests and self.max_requests_jitter:
+            self.config.limit_max_requests += random.randint(0, self.max_requests_jitter)
+        return super().run(sockets=sockets)
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run the API with several uvicorn worker processes")
+    parser.add_argument("--host", default=WEB_HOST)
+    parser.add_argument("--port", type=int, default=WEB_PORT)
+    parser.add_argument("--workers", type=int, default=WEB_CONCURRENCY, help="0 = one per usable CPU")
+    parser.add_argument("--loop", default=WEB_LOOP, choices=["auto", "asyncio", "uvloop"])
+    parser.add_argument("--http", default=WEB_HTTP, choices=["auto", "h11", "httptools"])
+    parser.add_argument("--backlog", type=int, default=WEB_BACKLOG, help="Pending connections the socket queues")
+    parser.add_argument("--keepalive", type=int, default=WEB_KEEPALIVE_SECONDS, help="Idle keep-alive timeout, seconds")
+    parser.add_argument("--max-requests", type=int, default=WEB_MAX_REQUESTS, help="Recycle a worker after this many requests (0 = never)")
+    parser.add_argument("--max-requests-jitter", type=int, default=WEB_MAX_REQUESTS_JITTER)
+    parser.add_argument("--graceful-timeout", type=int, default=WEB_GRACEFUL_TIMEOUT_SECONDS, help="Seconds a stopping worker may spend on in-flight requests")
+    parser.add_argument("--no-access-log", dest="access_log", action="store_false", default=WEB_ACCESS_LOG)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+
+    cpus = available_cpus()
+    workers = args.workers or cpus
+    # Each worker sizes its password hash pool to its share of the CPUs, not to all of them
+    os.environ.setdefault("HASH_POOL_WORKERS", str(max(1, cpus // workers)))
+    if workers > 1 and RATE_LIMIT_BACKEND == "memory":
+        logger.warning("RATE_LIMIT_BACKEND=memory counts failed logins per worker; "
+                       "use sqlite or redis so the %d workers share the limits", workers)
+    if FORWARDED_ALLOW_IPS.strip() == "*":
+        logger.warning("FORWARDED_ALLOW_IPS=* trusts X-Forwarded-For from any client, so the per-IP "
+                       "login limit can be evaded; set it to the proxy's address or CIDR")
+    elif MAX_LOGIN_ATTEMPTS_PER_IP and not trusts_remote_proxy(FORWARDED_ALLOW_IPS):
+        logger.warning("MAX_LOGIN_ATTEMPTS_PER_IP is on but FORWARDED_ALLOW_IPS trusts no proxy: behind a "
+                       "load balancer every client shares its address and one counter; set FORWARDED_ALLOW_IPS")
+    if workers > 1:
+        calibrate_password_cost()
+
+    config = uvicorn.Config(
+        "main:app",
+        host=args.host,
+        port=args.port,
+        workers=workers,
+        loop=args.loop,
+        http=args.http,
+        backlog=args.backlog,
+        timeout_keep_alive=args.keepalive,
+        limit_max_requests=args.max_requests or None,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        access_log=args.access_log,
+        proxy_headers=True,
+        forwarded_allow_ips=FORWARDED_ALLOW_IPS,
+    )
+    logger.info(
+        "Starting %d workers on %s:%d (cpus=%d, loop=%s, http=%s, backlog=%d, keepalive=%ds, max_requests=%s)",
+        workers, args.host, args.port, cpus,
+        fast_path(args.loop, "uvloop", "asyncio"), fast_path(args.http, "httptools", "h11"),
+        args.backlog, args.keepalive,
+        f"{args.max_requests}+{args.max_requests_jitter}" if args.max_requests else "off",
+    )
+    server = RecyclingServer(config, args.max_requests_jitter)
+    sock = config.bind_socket()
+    # The supervisor also runs a single worker, so it still gets restarted after recycling
+    Multiprocess(config, target=server.run, sockets=[sock]).run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,11 @@
+-- Columns of "userAccount" added after the original schema (see the schema comment
+-- in database.py). Run this in the Supabase SQL editor before sql/indexes.sql and
+-- sql/functions.sql, and before deploying an API version that uses them.
+
+-- Account creation time; /admin/accounts?created_after= filters on it. Existing
+-- rows get the time this runs, since their real creation time was never recorded.
+alter table "userAccount" add column if not exists created_at timestamptz default now();
+
+-- Time of the latest successful login; written by /auth/login (start_session in
+-- sql/functions.sql, or its fallback in repository.py). Null until the next login.
+alter table "userAccount" add column if not exists last_login timestamp;
@@ -0,0 +1,250 @@
+-- Postgres functions called over PostgREST (/rest/v1/rpc/<name>) by repository.py.
+-- Run this in the Supabase SQL editor. Each function does in one round trip
+-- what would otherwise take several sequential API calls, inside one transaction.
+-- If they are not installed the API falls back to the multi-call path.
+
+-- Requires: "userAccount".last_login from sql/accounts.sql, and the token_hash
+-- columns from sql/token_hash.sql. Tokens are passed in as their digest
+-- (tokens.hash_token); the drops below remove the versions that took p_token.
+
+-- Digest of a raw token, the same as tokens.hash_token: base64url SHA-256, no padding
+create or replace function token_digest(p_token text)
+returns text
+language sql
+immutable
+as $$
+    select rtrim(translate(encode(sha256(convert_to(p_token, 'UTF8')), 'base64'), '+/', '-_'), '=');
+$$;
+
+-- /auth/register: create the account and its first session atomically.
+-- Raises unique_violation (23505) if the email is already registered.
+drop function if exists register_account(text, text, text, text, text, text, timestamp);
+
+create or replace function register_account(
+    p_name text,
+    p_email text,
+    p_phone text,
+    p_date_of_birth text,
+    p_password text,
+    p_token_hash text,
+    p_expires_at timestamp
+)
+returns table (id int, name text, email text, phone text, date_of_birth text, session_id int)
+language plpgsql
+as $$
+declare
+    v_account "userAccount"%rowtype;
+    v_session_id int;
+begin
+    insert into "userAccount" (name, email, phone, date_of_birth, password)
+    values (p_name, p_email, p_phone, p_date_of_birth, p_password)
+    returning * into v_account;
+
+    insert into sessions (account_id, token_hash, expires_at)
+    values (v_account.id, p_token_hash, p_expires_at)
+    returning sessions.id into v_session_id;
+
+    return query select v_account.id, v_account.name, v_account.email, v_account.phone,
+                        v_account.date_of_birth, v_session_id;
+end;
+$$;
+
+-- /auth/login: record last_login, create the session and evict the account's
+-- oldest sessions beyond p_max_sessions (0 = no cap), all in one call.
+-- Returns the evicted sessions as [{id, token_hash}] so the API can drop them from
+-- its token cache. (The drops replace the older versions.)
+drop function if exists start_session(int, text, timestamp, timestamp);
+drop function if exists start_session(int, text, timestamp, timestamp, int);
+
+create or replace function start_session(
+    p_account_id int,
+    p_token_hash text,
+    p_expires_at timestamp,
+    p_login_at timestamp,
+    p_max_sessions int
+)
+returns table (session_id int, evicted jsonb)
+language plpgsql
+as $$
+declare
+    v_session_id int;
+    v_evicted jsonb := '[]'::jsonb;
+begin
+    update "userAccount" set last_login = p_login_at where "userAccount".id = p_account_id;
+
+    insert into sessions (account_id, token_hash, expires_at)
+    values (p_account_id, p_token_hash, p_expires_at)
+    returning sessions.id into v_session_id;
+
+    if p_max_sessions > 0 then
+        with doomed as (
+            delete from sessions
+            where sessions.id in (
+                select s.id from sessions s
+                where s.account_id = p_account_id
+                order by s.id desc
+                offset p_max_sessions
+            )
+            returning sessions.id, coalesce(sessions.token_hash, token_digest(sessions.token)) as token_hash
+        )
+        select coalesce(jsonb_agg(jsonb_build_object('id', doomed.id, 'token_hash', doomed.token_hash)), '[]'::jsonb)
+        into v_evicted
+        from doomed;
+    end if;
+
+    return query select v_session_id, v_evicted;
+end;
+$$;
+
+-- /auth/password/forgot: replace the account's unused reset tokens with a new one.
+-- Returns the account (id, email, name), or no row if the email is not registered.
+drop function if exists request_password_reset(text, text, timestamp);
+
+create or replace function request_password_reset(
+    p_email text,
+    p_token_hash text,
+    p_expires_at timestamp
+)
+returns table (id int, email text, name text)
+language plpgsql
+as $$
+declare
+    v_account "userAccount"%rowtype;
+begin
+    select * into v_account from "userAccount" a where a.email = p_email;
+    if not found then
+        return;
+    end if;
+
+    delete from password_reset_tokens t where t.account_id = v_account.id and t.used = false;
+
+    insert into password_reset_tokens (account_id, token_hash, expires_at)
+    values (v_account.id, p_token_hash, p_expires_at);
+
+    return query select v_account.id, v_account.email, v_account.name;
+end;
+$$;
+
+-- /auth/password/reset: consume the reset token, set the new password hash and
+-- delete every session of the account, in one transaction. The token is used only
+-- if it is unused and unexpired at p_now, so of two concurrent resets with the same
+-- token only one succeeds. p_token (the raw token) also matches rows from before
+-- token_hash; it is null once those are migrated. Returns the account id and the
+-- number of sessions deleted, or no row if the token cannot be used or the account
+-- no longer exists.
+drop function if exists reset_account_password(int, text);
+
+create or replace function reset_password_with_token(
+    p_token_hash text,
+    p_token text,
+    p_password text,
+    p_now timestamp
+)
+returns table (account_id int, sessions_deleted int)
+language plpgsql
+as $$
+declare
+    v_account_id int;
+    v_deleted int;
+begin
+    update password_reset_tokens t set used = true
+    where (t.token_hash = p_token_hash or (p_token is not null and t.token = p_token))
+      and t.used = false and t.expires_at > p_now
+    returning t.account_id into v_account_id;
+    if not found then
+        return;
+    end if;
+
+    update "userAccount" set password = p_password where "userAccount".id = v_account_id;
+    if not found then
+        return;
+    end if;
+
+    with doomed as (
+        delete from sessions where sessions.account_id = v_account_id returning 1
+    )
+    select count(*) into v_deleted from doomed;
+
+    return query select v_account_id, v_deleted;
+end;
+$$;
+
+-- Password hash migration (hashmigration.py): rewrite hex-encoded hashes in the
+-- native $algorithm$... form for up to p_batch_size accounts after p_after_id.
+-- Only accounts whose password starts with "24" (hex of "$") are read, through the
+-- partial index in sql/indexes.sql, and only values that are the hex of a known hash
+-- prefix ($2a$, $2b$, $2y$, $scrypt$, $argon2id$) are touched. Returns the last id
+-- looked at (null if there was none), how many rows were converted, and whether
+-- the batch came back short, i.e. nothing is left after last_id.
+-- (The drop replaces the older version without done.)
+drop function if exists convert_hex_password_hashes(int, int);
+
+create or replace function convert_hex_password_hashes(
+    p_after_id int,
+    p_batch_size int
+)
+returns table (last_id int, converted int, done boolean)
+language plpgsql
+as $$
+declare
+    v_last_id int;
+    v_converted int;
+    v_done boolean;
+begin
+    with batch as (
+        select a.id from "userAccount" a
+        where a.id > p_after_id
+          and a.password like '24%'
+        order by a.id
+        limit p_batch_size
+    ), changed as (
+        update "userAccount" a
+        set password = convert_from(decode(a.password, 'hex'), 'UTF8')
+        from batch
+        where a.id = batch.id
+          and a.password ~ '^(24326124|24326224|24327924|2473637279707424|246172676f6e32696424)([0-9a-f]{2})*$'
+        returning a.id
+    )
+    select (select max(batch.id) from batch),
+           (select count(*) from changed),
+           (select count(*) < p_batch_size from batch)
+    into v_last_id, v_converted, v_done;
+
+    return query select v_last_id, v_converted, v_done;
+end;
+$$;
+
+-- Token hash migration (tokenmigration.py): replace the raw token of up to
+-- p_batch_size rows of sessions or password_reset_tokens by its digest.
+-- Converted rows drop out of the "token is not null" partial index, so every
+-- batch starts at the front of what is left. Returns how many rows were
+-- converted; fewer than p_batch_size means the table is done.
+create or replace function hash_legacy_tokens(
+    p_table text,
+    p_batch_size int
+)
+returns table (converted int)
+language plpgsql
+as $$
+declare
+    v_converted int;
+begin
+    if p_table not in ('sessions', 'password_reset_tokens') then
+        raise exception 'hash_legacy_tokens: unsupported table %', p_table;
+    end if;
+
+    execute format(
+        'with batch as (
+             select id from %1$I where token is not null order by id limit $1
+         ), changed as (
+             update %1$I t set token_hash = token_digest(t.token), token = null
+             from batch where t.id = batch.id
+             returning 1
+         )
+         select count(*) from changed', p_table)
+    into v_converted
+    using p_batch_size;
+
+    return query select v_converted;
+end;
+$$;
@@ -0,0 +1,22 @@
+-- Indexes for the queries in repository.py. Run this in the Supabase SQL editor,
+-- after sql/accounts.sql.
+-- The unique constraint on email already provides its index; the unique indexes
+-- on the token digests are in sql/token_hash.sql.
+
+-- validate_token filters on expires_at and the reaper scans expired rows in
+-- expires_at order; both stay index range scans as the tables grow.
+create index if not exists sessions_expires_at_idx on sessions (expires_at);
+create index if not exists password_reset_tokens_expires_at_idx on password_reset_tokens (expires_at);
+
+-- Deleting every session / unused reset token of one account
+-- (logout everywhere, password reset, account deletion).
+create index if not exists sessions_account_id_idx on sessions (account_id);
+create index if not exists password_reset_tokens_account_id_idx on password_reset_tokens (account_id);
+
+-- /admin/accounts?created_after= (list_accounts_page): range on creation time.
+create index if not exists user_account_created_at_idx on "userAccount" (created_at);
+
+-- Password hash migration (convert_hex_password_hashes, hex_password_rows): only
+-- the accounts still holding a hex-encoded hash, so its startup check and batches
+-- stay small once the table is converted.
+create index if not exists user_account_hex_password_idx on "userAccount" (id) where password like '24%';
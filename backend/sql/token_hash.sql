@@ -0,0 +1,21 @@
+-- Token digests: sessions and password_reset_tokens store tokens.hash_token(token)
+-- in token_hash instead of the raw token. Run this in the Supabase SQL editor
+-- before deploying the API version that writes token_hash, then sql/functions.sql.
+--
+-- token stays, nullable, for rows written before this change. The API hashes
+-- them in the background (tokenmigration.py, hash_legacy_tokens) and looks up
+-- by raw token only until a table has none left.
+
+alter table sessions add column if not exists token_hash text;
+alter table sessions alter column token drop not null;
+alter table password_reset_tokens add column if not exists token_hash text;
+alter table password_reset_tokens alter column token drop not null;
+
+-- Every lookup is an equality on the digest: 43 characters, uniformly
+-- distributed, one unique index entry per row.
+create unique index if not exists sessions_token_hash_key on sessions (token_hash);
+create unique index if not exists password_reset_tokens_token_hash_key on password_reset_tokens (token_hash);
+
+-- Rows the migration still has to convert; shrinks to nothing as it runs.
+create index if not exists sessions_legacy_token_idx on sessions (id) where token is not null;
+create index if not exists password_reset_tokens_legacy_token_idx on password_reset_tokens (id) where token is not null;
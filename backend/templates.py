@@ -0,0 +1,62 @@
+# Compiled, cached templates for emails and the password reset web pages
+#
+# Templates live in backend/templates/ and use {{ name }} placeholders. Each file is
+# parsed once into literal fragments and placeholder names, so rendering is a join.
+# Values are HTML-escaped when rendering .html templates.
+
+import html
+import re
+from functools import lru_cache
+from pathlib import Path
+from typing import List, Tuple
+
+from httpcache import etag_for
+
+TEMPLATE_DIR = Path(__file__).parent / "templates"
+
+_PLACEHOLDER = re.compile(r"\{\{\s*(\w+)\s*\}\}")
+
+
+class CompiledTemplate:
+    """A template split into literal fragments and placeholder names"""
+
+    def __init__(self, source: str, escape: bool):
+        self.escape = escape
+        self.parts: List[Tuple[bool, str]] = []
+        position = 0
+        for match in _PLACEHOLDER.finditer(source):
+            self.parts.append((False, source[position:match.start()]))
+            self.parts.append((True, match.group(1)))
+            position = match.end()
+        self.parts.append((False, source[position:]))
+
+    def render(self, **values) -> str:
+        out = []
+        for is_placeholder, text in self.parts:
+            if is_placeholder:
+                value = str(values[text])
+                out.append(html.escape(value) if self.escape else value)
+            else:
+                out.append(text)
+        return "".join(out)
+
+
+class StaticPage:
+    """A page rendered once, kept as bytes together with its ETag"""
+
+    def __init__(self, body: str):
+        self.body = body.encode("utf-8")
+        self.etag = etag_for(self.body)
+
+
+@lru_cache(maxsize=None)
+def get_template(name: str) -> CompiledTemplate:
+    """Load and compile a template (cached for the life of the process)"""
+    source = (TEMPLATE_DIR / name).read_text(encoding="utf-8")
+    return CompiledTemplate(source, escape=name.endswith(".html"))
+
+def render(name: str, **values) -> str:
+    return get_template(name).render(**values)
+
+def prerender(name: str, **values) -> StaticPage:
+    return StaticPage(render(name, **values))
@@ -0,0 +1,105 @@
+# Background hashing of raw tokens stored before token_hash existed
+#
+# Sessions and reset tokens are stored as their digest (tokens.hash_token). Rows
+# written before that hold the raw token in the token column, and lookups retry
+# by raw token while a table may still have such rows. This job converts them:
+# per table, batches of rows that still have a raw token, one round trip per
+# batch through the hash_legacy_tokens function, or, if that is not installed,
+# one read per batch plus one conditional update per row. When a table comes back
+# short it is done and repository stops the raw-token retries for it. Tables the
+# startup check (repository.check_legacy_tokens) found clean are skipped. Converting
+# is idempotent, so it is safe for several workers to run it at once.
+
+import asyncio
+import logging
+import random
+import time
+from typing import Any, Dict, Optional
+
+import repository
+
+logger = logging.getLogger(__name__)
+
+TABLES = ("sessions", "password_reset_tokens")
+
+# Upper bound of the random pause between two batches, in seconds
+BATCH_PAUSE_SECONDS = 0.5
+
+
+class TokenHashMigration:
+    """Replaces raw tokens by their digest, table by table and batch by batch"""
+
+    def __init__(self, batch_size: int):
+        self.batch_size = batch_size
+        self.counters: Dict[str, int] = {"batches": 0, "converted": 0, "errors": 0}
+        self.table: Optional[str] = None
+        self.finished = False
+        self.seconds: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def _fallback_batch(self, table: str) -> bool:
+        rows = await repository.legacy_token_rows(table, self.batch_size)
+        converted = 0
+        for row in rows:
+            if await repository.store_token_hash(table, row["id"], row["token"]):
+                converted += 1
+        self.counters["converted"] += converted
+        # A row that could not be updated was deleted or converted meanwhile; stop
+        # if nothing moved so a stuck row cannot keep the loop going
+        return len(rows) == self.batch_size and converted > 0
+
+    async def run_batch(self, table: str) -> bool:
+        """Convert one batch of table; returns whether rows may remain"""
+        self.counters["batches"] += 1
+        converted = await repository.hash_legacy_tokens(table, self.batch_size)
+        if converted is None:
+            return await self._fallback_batch(table)
+        self.counters["converted"] += converted
+        return converted == self.batch_size
+
+    async def run(self):
+        started = time.perf_counter()
+        for table in TABLES:
+            if not repository.legacy_tokens_remaining()[table]:
+                continue
+            self.table = table
+            while await self.run_batch(table):
+                await asyncio.sleep(random.uniform(0, BATCH_PAUSE_SECONDS))
+            repository.mark_tokens_migrated(table)
+        self.table = None
+        self.finished = True
+        self.seconds = round(time.perf_counter() - started, 3)
+        logger.info("Token hash migration finished", extra={
+            "event": "token_migration.finished", **self.counters, "seconds": self.seconds
+        })
+
+    async def _run(self):
+        try:
+            await self.run()
+        except Exception:
+            # Not retried until the next start; lookups keep falling back to raw tokens
+            self.counters["errors"] += 1
+            logger.exception("Token hash migration failed", extra={"table": self.table})
+
+    async def start(self):
+        if self._task is None and not self.finished:
+            self._task = asyncio.create_task(self._run(), name="token-hash-migration")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "finished": self.finished,
+            **self.counters,
+            "table": self.table,
+            "raw_token_lookups": repository.legacy_tokens_remaining(),
+            "seconds": self.seconds,
+        }
@@ -0,0 +1,110 @@
+# Signed access tokens (TOKEN_MODE=signed): verified locally with HMAC, no database hit
+#
+# Format: base64url(json claims) "." base64url(HMAC-SHA256(claims))
+# Claims: sub = account id, jti = id of the refresh session the token was issued from, exp = expiry
+# Opaque session tokens from secrets.token_urlsafe never contain ".", so the two are easy to tell apart.
+#
+# Opaque session and reset tokens are never stored as-is: the database and the
+# token cache hold hash_token(token), a fixed-width SHA-256 digest.
+
+import base64
+import hashlib
+import hmac
+import json
+import time
+from typing import Any, Dict, Optional
+
+from config import TOKEN_MODE, TOKEN_SIGNING_SECRET, ACCESS_TOKEN_TTL_SECONDS
+from resources import current
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+def _sign(payload: str) -> str:
+    digest = hmac.new(TOKEN_SIGNING_SECRET.encode("utf-8"), payload.encode("ascii"), hashlib.sha256).digest()
+    return _b64encode(digest)
+
+
+class TokenDenylist:
+    """
+    Revoked access tokens, kept only until they would have expired anyway.
+    Entries are keyed by token id (the refresh session id), plus a per-account
+    cutoff so every token issued before a password reset can be revoked at once.
+    """
+
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+        self._tokens: Dict[str, float] = {}
+        self._accounts: Dict[int, float] = {}
+        self._next_prune = 0.0
+
+    def revoke(self, jti: str):
+        self._prune()
+        self._tokens[str(jti)] = time.time() + self.ttl
+
+    def revoke_account(self, account_id: int):
+        """Revoke every token for account_id issued up to now"""
+        self._prune()
+        self._accounts[account_id] = time.time()
+
+    def is_revoked(self, claims: Dict[str, Any]) -> bool:
+        if claims["jti"] in self._tokens:
+            return True
+        cutoff = self._accounts.get(claims["sub"])
+        return cutoff is not None and claims["iat"] <= cutoff
+
+    def _prune(self):
+        now = time.time()
+        if now < self._next_prune:
+            return
+        self._next_prune = now + 60
+        self._tokens = {jti: exp for jti, exp in self._tokens.items() if exp > now}
+        self._accounts = {aid: cutoff for aid, cutoff in self._accounts.items() if cutoff + self.ttl > now}
+
+    def __len__(self) -> int:
+        return len(self._tokens) + len(self._accounts)
+
+
+def hash_token(token: str) -> str:
+    """Digest stored for an opaque token: base64url SHA-256 without padding, always 43 characters"""
+    return _b64encode(hashlib.sha256(token.encode("utf-8")).digest())
+
+def is_signed_token(token: str) -> bool:
+    """True if token should be verified as a signed access token (TOKEN_MODE=signed only)"""
+    # In opaque mode a token containing "." is just an unknown opaque token (a 401)
+    return TOKEN_MODE == "signed" and bool(TOKEN_SIGNING_SECRET) and "." in token
+
+def issue_access_token(account_id: int, session_id: int) -> str:
+    """Create a short-lived access token bound to a refresh session"""
+    now = time.time()
+    claims = {
+        "sub": account_id,
+        "jti": str(session_id),
+        "iat": now,
+        "exp": int(now) + ACCESS_TOKEN_TTL_SECONDS,
+    }
+    payload = _b64encode(json.dumps(claims, separators=(",", ":")).encode("utf-8"))
+    return f"{payload}.{_sign(payload)}"
+
+def verify_access_token(token: str) -> Optional[Dict[str, Any]]:
+    """Return the claims of a valid, unexpired, unrevoked access token, else None (also for malformed input)"""
+    if not TOKEN_SIGNING_SECRET:
+        return None
+    try:
+        payload, signature = token.split(".")
+        if not hmac.compare_digest(signature.encode("ascii"), _sign(payload).encode("ascii")):
+            return None
+        claims = json.loads(_b64decode(payload))
+    except (ValueError, UnicodeError, TypeError):
+        return None
+    # Signed by us, but check the shape anyway rather than fail later on a bad claim
+    if not (isinstance(claims, dict) and isinstance(claims.get("sub"), int) and isinstance(claims.get("jti"), str)
+            and isinstance(claims.get("iat"), (int, float)) and isinstance(claims.get("exp"), (int, float))):
+        return None
+    if claims["exp"] <= time.time() or current().denylist.is_revoked(claims):
+        return None
+    return claims
@@ -0,0 +1,122 @@
+# Bounded worker pool for CPU-bound calls (bcrypt) so they never run on the event loop
+
+import asyncio
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+from metrics import POOL_RUN, POOL_WAIT, POOL_REJECTED
+
+
+class PoolSaturatedError(Exception):
+    """Raised when a pool's queue is full; surfaced to clients as a 503"""
+
+    def __init__(self, pool_name: str, retry_after: int = 1):
+        super().__init__(f"{pool_name} pool is saturated")
+        self.pool_name = pool_name
+        self.retry_after = retry_after
+
+
+def _timed_call(fn: Callable, *args) -> tuple:
+    """Run fn inside the worker and return (result, seconds spent executing)"""
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+class _OperationStats:
+    __slots__ = ("count", "total_seconds", "max_seconds", "total_wait_seconds")
+
+    def __init__(self):
+        self.count = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.total_wait_seconds = 0.0
+
+    def record(self, run_seconds: float, wait_seconds: float):
+        self.count += 1
+        self.total_seconds += run_seconds
+        self.total_wait_seconds += wait_seconds
+        if run_seconds > self.max_seconds:
+            self.max_seconds = run_seconds
+
+    def as_dict(self) -> Dict[str, float]:
+        avg = self.total_seconds / self.count if self.count else 0.0
+        avg_wait = self.total_wait_seconds / self.count if self.count else 0.0
+        return {
+            "count": self.count,
+            "avg_ms": round(avg * 1000, 2),
+            "max_ms": round(self.max_seconds * 1000, 2),
+            "avg_queue_wait_ms": round(avg_wait * 1000, 2),
+        }
+
+
+class WorkerPool:
+    """
+    Thread or process pool with a bounded backlog.
+    At most max_workers calls run at once and at most max_queue more may wait;
+    anything beyond that is rejected with PoolSaturatedError instead of piling up.
+    """
+
+    def __init__(self, name: str, kind: str, max_workers: int, max_queue: int):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown pool kind: {kind}")
+        self.name = name
+        self.kind = kind
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self.rejected = 0
+        self._executor: Executor = None
+        self._operations: Dict[str, _OperationStats] = {}
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix=f"{self.name}-pool"
+                )
+        return self._executor
+
+    async def run(self, operation: str, fn: Callable, *args) -> Any:
+        """Run fn(*args) on the pool, rejecting the call if the backlog is full"""
+        if self.in_flight >= self.max_workers + self.max_queue:
+            self.rejected += 1
+            POOL_REJECTED.labels(self.name).inc()
+            raise PoolSaturatedError(self.name)
+
+        self.in_flight += 1
+        submitted = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            result, run_seconds = await loop.run_in_executor(
+                self._get_executor(), _timed_call, fn, *args
+            )
+        finally:
+            self.in_flight -= 1
+
+        wait_seconds = max(0.0, time.perf_counter() - submitted - run_seconds)
+        self._operations.setdefault(operation, _OperationStats()).record(run_seconds, wait_seconds)
+        POOL_RUN.labels(self.name, operation).observe(run_seconds)
+        POOL_WAIT.labels(self.name, operation).observe(wait_seconds)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "kind": self.kind,
+            "workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "queued": max(0, self.in_flight - self.max_workers),
+            "rejected": self.rejected,
+            "operations": {name: op.as_dict() for name, op in self._operations.items()},
+        }
+
+    async def shutdown(self):
+        """Wait for running and queued calls off the event loop, then release the workers"""
+        if self._executor is not None:
+            executor, self._executor = self._executor, None
+            await asyncio.to_thread(executor.shutdown, wait=True)